@@ -0,0 +1,286 @@
+"""Headless batch posting for NibblerBOT jobs.
+
+Posts every CAM job found in one or more FreeCAD documents through
+NibblerBOT_post without any dialog, one FreeCAD worker process per core:
+
+    python NibblerBOT_batch.py --freecad-lib /usr/lib/freecad/lib \\
+        --output-dir ~/Documents/FreeCAD/Gcode \\
+        "Classes/FreeCAD CAM 101 - Intro to CAM"
+
+Directories are searched for .FCStd files.  Dust collection options, the
+job author and the upload destination come from the flags below or from a
+JSON config file (--config) whose keys are the long option names, e.g.
+
+    {"output_dir": "Gcode", "job_author": "billy", "upload": true,
+     "remote_path": "/classes", "dust_off": true, "args": "--inches"}
+
+Flags given on the command line win over the config file.
+"""
+
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import shlex
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# make sure we can import NibblerBOT_post from the same folder
+post_dir = os.path.dirname(os.path.abspath(__file__))
+if post_dir not in sys.path:
+    sys.path.insert(0, post_dir)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Post FreeCAD CAM jobs with NibblerBOT_post, no GUI required."
+    )
+    parser.add_argument(
+        "documents", nargs="*", help=".FCStd files or folders containing them"
+    )
+    parser.add_argument("--config", help="JSON file with default option values")
+    parser.add_argument(
+        "--job",
+        action="append",
+        dest="jobs",
+        help="only post jobs with this label (repeatable)",
+    )
+    parser.add_argument(
+        "--output-dir", help="folder for the .ngc files, default=next to document"
+    )
+    parser.add_argument(
+        "--args",
+        default="",
+        help='extra post processor arguments, e.g. --args="--inches"',
+    )
+    parser.add_argument("--job-author", help="remote user folder to upload to")
+    parser.add_argument("--remote-path", help="remote folder to upload to")
+    parser.add_argument(
+        "--upload",
+        action="store_true",
+        help="upload each program to the NibblerBOT server (needs --job-author)",
+    )
+    parser.add_argument(
+        "--dust-on",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="turn dust collection ON at start (M208), default=on",
+    )
+    parser.add_argument(
+        "--dust-off",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="turn dust collection OFF at end (M209), default=off",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of FreeCAD worker processes, default=one per core",
+    )
+    parser.add_argument(
+        "--freecad-lib",
+        default=os.environ.get("FREECAD_LIB"),
+        help="folder containing FreeCAD.so/FreeCAD.pyd, default=$FREECAD_LIB",
+    )
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args, _ = parser.parse_known_args(argv)
+    if args.config:
+        with open(args.config, "r") as f:
+            config = json.load(f)
+        parser.set_defaults(**{k.replace("-", "_"): v for k, v in config.items()})
+    args = parser.parse_args(argv)
+    if not args.documents:
+        parser.error("no documents given")
+    if args.upload and not args.job_author:
+        parser.error("--upload needs --job-author")
+    return args
+
+
+def post_arguments(args):
+    """Translate the batch options into a post processor argument string."""
+    argstring = [args.args, "--no-dialogs", "--no-show-editor"]
+    argstring.append("--dust-on" if args.dust_on else "--no-dust-on")
+    argstring.append("--dust-off" if args.dust_off else "--no-dust-off")
+    if args.upload:
+        argstring.append("--job-author " + shlex.quote(args.job_author))
+        if args.remote_path:
+            argstring.append("--remote-path " + shlex.quote(args.remote_path))
+    else:
+        argstring.append("--no-remote-post")
+    return " ".join(a for a in argstring if a)
+
+
+def find_documents(paths):
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = glob.glob(os.path.join(path, "**", "*.FCStd"), recursive=True)
+            documents.extend(sorted(found))
+        else:
+            documents.append(path)
+    return documents
+
+
+def init_worker(freecad_lib):
+    if freecad_lib and freecad_lib not in sys.path:
+        sys.path.append(freecad_lib)
+
+
+def job_postlist(job):
+    """Return the objects FreeCAD would hand to the post for job, in order."""
+    try:
+        from Path.Post.Command import buildPostList
+    except ImportError:
+        buildPostList = None
+
+    if buildPostList is not None:
+        postlist = []
+        for _name, objects in buildPostList(job):
+            postlist.extend(objects)
+        return postlist
+
+    # operation order with the tool controller ahead of every tool change
+    postlist = []
+    current_tc = None
+    for op in job.Operations.Group:
+        tc = getattr(op, "ToolController", None)
+        if tc is not None and tc is not current_tc:
+            postlist.append(tc)
+            current_tc = tc
+        postlist.append(op)
+    return postlist
+
+
+def output_filename(document, job, job_count, output_dir):
+    stem = os.path.splitext(os.path.basename(document))[0]
+    if job_count > 1:
+        stem += "-" + job.Label
+    folder = output_dir or os.path.dirname(os.path.abspath(document))
+    return os.path.join(folder, stem + ".ngc")
+
+
+def post_document(document, job_labels, output_dir, argstring):
+    """Post the jobs of one document; runs inside a worker process."""
+    import FreeCAD
+
+    results = []
+    doc = FreeCAD.openDocument(document)
+    try:
+        FreeCAD.setActiveDocument(doc.Name)
+        jobs = [
+            obj
+            for obj in doc.Objects
+            if hasattr(obj, "Operations") and hasattr(obj, "PostProcessor")
+        ]
+        if job_labels:
+            jobs = [job for job in jobs if job.Label in job_labels]
+
+        for job in jobs:
+            filename = output_filename(document, job, len(jobs), output_dir)
+            log = io.StringIO()
+            start = time.time()
+            try:
+                with contextlib.redirect_stdout(log):
+                    # a fresh module per job so no setting or line number
+                    # leaks from one program into the next
+                    import NibblerBOT_post
+
+                    post = importlib.reload(NibblerBOT_post)
+                    post.RETURN_GCODE = False
+                    job_args = getattr(job, "PostProcessorArgs", "") or ""
+                    result = post.export(
+                        job_postlist(job), filename, job_args + " " + argstring
+                    )
+                ok = result is not None
+            except Exception as e:
+                log.write(f"{type(e).__name__}: {e}\n")
+                ok = False
+            results.append(
+                {
+                    "document": document,
+                    "job": job.Label,
+                    "output": filename,
+                    "ok": ok,
+                    "seconds": time.time() - start,
+                    "log": log.getvalue(),
+                }
+            )
+        if not jobs:
+            results.append(
+                {
+                    "document": document,
+                    "job": None,
+                    "output": None,
+                    "ok": False,
+                    "seconds": 0.0,
+                    "log": "No CAM jobs found.\n",
+                }
+            )
+    finally:
+        FreeCAD.closeDocument(doc.Name)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    init_worker(args.freecad_lib)
+
+    documents = find_documents(args.documents)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    argstring = post_arguments(args)
+    workers = max(1, min(args.workers or 1, len(documents)))
+
+    print(f"Posting {len(documents)} document(s) with {workers} worker(s)...")
+    start = time.time()
+    failures = 0
+    posted = 0
+    # FreeCAD is not fork safe, so every worker starts a fresh interpreter
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(args.freecad_lib,),
+    ) as pool:
+        futures = {
+            pool.submit(
+                post_document, document, args.jobs, args.output_dir, argstring
+            ): document
+            for document in documents
+        }
+        for future in as_completed(futures):
+            document = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {document}: {e}")
+                continue
+            for result in results:
+                if result["ok"]:
+                    posted += 1
+                    print(f"ok     {result['output']} ({result['seconds']:.1f} s)")
+                else:
+                    failures += 1
+                    print(f"FAILED {document} [{result['job']}]")
+                    print(result["log"].rstrip())
+
+    print(
+        f"Posted {posted} job(s), {failures} failure(s) in {time.time() - start:.1f} s"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,575 @@
+"""Benchmarks for the NibblerBOT post processor on generated jobs.
+
+Runs export(), parse() and optimize_gcode() on synthetic workloads shaped
+like the shop's jobs, each in a fresh FreeCAD worker process without the
+GUI:
+
+    python NibblerBOT_bench.py --freecad-lib /usr/lib/freecad/lib
+
+    surfacing  one dense 3D surface raster of about a million moves
+    engrave    hundreds of small engrave operations with one V-bit, like
+               the "job_NibblerBOT 2D Engrave" template
+    panel      pockets, drilling and profiles with tabs over many tools,
+               like the "job_NibblerBOT 2D Panel" template
+    retool     pockets and profiles with one end mill around a surface pass
+               with a ball end mill, so the job returns to a tool
+
+For every workload it reports lines per second and peak memory of a full
+export, and the seconds spent in each stage.  --save stores the results
+as the baseline; later runs compare against it and exit with status 1 if
+anything got slower or bigger by more than --threshold.  --scale shrinks
+or grows the jobs, e.g. --scale 0.1 for a quick check.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# make sure we can import NibblerBOT_post from the same folder
+post_dir = os.path.dirname(os.path.abspath(__file__))
+if post_dir not in sys.path:
+    sys.path.insert(0, post_dir)
+
+from NibblerBOT_batch import init_worker
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Times shorter than this are too noisy to call a regression
+MIN_STAGE_SECONDS = 0.1
+
+# Posting the templates' way: inches, no dialogs, nothing uploaded, and no
+# operation cache so every repetition formats the whole program; the
+# envelope check and tool grouping are on so their stages are timed too
+POST_ARGS = (
+    "--inches --no-dialogs --no-show-editor --no-remote-post --dust-off --estimate"
+    " --no-operation-cache --envelope-check --group-tools"
+)
+
+
+class BenchObject:
+    """Just enough of a document object for export() and parse()."""
+
+    def __init__(self, label, commands, **properties):
+        import Path
+
+        self.Label = label
+        self.Name = label.replace(" ", "")
+        self.Path = Path.Path(commands)
+        self.Active = True
+        self.InList = []
+        for name, value in properties.items():
+            setattr(self, name, value)
+
+
+class Generator:
+    """Builds the commands of a job the way FreeCAD CAM operations do."""
+
+    def __init__(self, seed):
+        import Path
+
+        self.command = Path.Command
+        self.random = random.Random(seed)
+        self.objects = []
+        self.tool_controller = None
+
+    def tool(self, number, label, speed=18000.0):
+        C = self.command
+        tc = BenchObject(
+            "TC: " + label,
+            [C("(TC: %s)" % label), C("M6", {"T": number}), C("M3", {"S": speed})],
+            Tool=label,
+            VertFeed=5.0,
+            HorizFeed=20.0,
+            SpindleSpeed=speed,
+        )
+        self.objects.append(tc)
+        self.tool_controller = tc
+        return tc
+
+    def reload(self, tc):
+        """Change back to tc, listed again like FreeCAD's post list does."""
+        self.objects.append(tc)
+        self.tool_controller = tc
+
+    def operation(self, label, commands):
+        C = self.command
+        commands = [C("(%s)" % label), C("G0", {"Z": 25.0})] + commands
+        commands.append(C("G0", {"Z": 25.0}))
+        self.objects.append(
+            BenchObject(label, commands, ToolController=self.tool_controller)
+        )
+
+    def plunge(self, x, y, z, feed=5.0):
+        C = self.command
+        return [
+            C("G0", {"X": x, "Y": y}),
+            C("G0", {"Z": 3.0}),
+            C("G1", {"X": x, "Y": y, "Z": z, "F": feed}),
+        ]
+
+    def surface(self, label, rows, columns, width=500.0, depth=300.0):
+        """A zigzag raster over a bumpy height map."""
+        C = self.command
+        commands = self.plunge(0.0, 0.0, -1.0)
+        for row in range(rows):
+            y = depth * row / max(rows - 1, 1)
+            xs = range(columns) if row % 2 == 0 else range(columns - 1, -1, -1)
+            for column in xs:
+                x = width * column / max(columns - 1, 1)
+                z = -3.0 + math.sin(x / 40.0) * math.cos(y / 30.0) * 2.0
+                commands.append(C("G1", {"X": x, "Y": y, "Z": z, "F": 20.0}))
+        self.operation(label, commands)
+
+    def engrave(self, label, x0, y0, strokes):
+        """Short strokes and small arcs, lifting between them."""
+        C = self.command
+        rand = self.random
+        commands = []
+        for _ in range(strokes):
+            x = x0 + rand.uniform(0.0, 20.0)
+            y = y0 + rand.uniform(0.0, 8.0)
+            commands += self.plunge(x, y, -0.5)
+            for _ in range(rand.randint(4, 12)):
+                if rand.random() < 0.3:
+                    r = rand.uniform(0.5, 2.0)
+                    name = "G2" if rand.random() < 0.5 else "G3"
+                    commands.append(
+                        C(name, {"X": x + 2 * r, "Y": y, "I": r, "J": 0.0, "F": 15.0})
+                    )
+                    x += 2 * r
+                else:
+                    x += rand.uniform(-1.0, 1.0)
+                    y += rand.uniform(-1.0, 1.0)
+                    commands.append(C("G1", {"X": x, "Y": y, "F": 15.0}))
+            commands.append(C("G0", {"Z": 3.0}))
+        self.operation(label, commands)
+
+    def pocket(self, label, x0, y0, size, stepover, depth, stepdown):
+        """Offset rings with arc corners, several step downs."""
+        C = self.command
+        commands = []
+        z = 0.0
+        while z > depth:
+            z = max(z - stepdown, depth)
+            commands += self.plunge(x0 + size / 2, y0 + size / 2, z)
+            inset = size / 2 - stepover
+            while inset > 0:
+                lo_x, lo_y = x0 + inset, y0 + inset
+                hi_x, hi_y = x0 + size - inset, y0 + size - inset
+                r = min(stepover, (hi_x - lo_x) / 2)
+                commands += [
+                    C("G1", {"X": lo_x + r, "Y": lo_y, "Z": z, "F": 20.0}),
+                    C("G1", {"X": hi_x - r, "Y": lo_y, "Z": z}),
+                    C("G3", {"X": hi_x, "Y": lo_y + r, "Z": z, "I": 0.0, "J": r}),
+                    C("G1", {"X": hi_x, "Y": hi_y - r, "Z": z}),
+                    C("G3", {"X": hi_x - r, "Y": hi_y, "Z": z, "I": -r, "J": 0.0}),
+                    C("G1", {"X": lo_x + r, "Y": hi_y, "Z": z}),
+                    C("G3", {"X": lo_x, "Y": hi_y - r, "Z": z, "I": 0.0, "J": -r}),
+                    C("G1", {"X": lo_x, "Y": lo_y + r, "Z": z}),
+                    C("G3", {"X": lo_x + r, "Y": lo_y, "Z": z, "I": r, "J": 0.0}),
+                ]
+                inset -= stepover
+            commands.append(C("G0", {"Z": 3.0}))
+        self.operation(label, commands)
+
+    def drill(self, label, holes):
+        C = self.command
+        rand = self.random
+        commands = [C("G0", {"Z": 3.0})]
+        for _ in range(holes):
+            commands.append(
+                C(
+                    "G81",
+                    {
+                        "X": rand.uniform(10.0, 490.0),
+                        "Y": rand.uniform(10.0, 290.0),
+                        "Z": -6.0,
+                        "R": 3.0,
+                        "F": 5.0,
+                    },
+                )
+            )
+        commands.append(C("G80"))
+        self.operation(label, commands)
+
+    def profile(self, label, x0, y0, width, height, depth, stepdown, tabs=True):
+        """A rectangle at every step down, rising over tabs on the last."""
+        C = self.command
+        commands = self.plunge(x0, y0, 0.0)
+        corners = [(x0 + width, y0), (x0 + width, y0 + height), (x0, y0 + height)]
+        corners.append((x0, y0))
+        z = 0.0
+        while z > depth:
+            z = max(z - stepdown, depth)
+            commands.append(C("G1", {"X": x0, "Y": y0, "Z": z, "F": 5.0}))
+            px, py = x0, y0
+            for x, y in corners:
+                if z == depth and tabs:
+                    # climb over a tab in the middle of every side
+                    for t, tab_z in ((0.45, z), (0.45, z + 2.0), (0.55, z + 2.0)):
+                        point = {"X": px + (x - px) * t, "Y": py + (y - py) * t}
+                        commands.append(C("G1", dict(point, Z=tab_z, F=20.0)))
+                    commands.append(C("G1", dict(point, Z=z)))
+                commands.append(C("G1", {"X": x, "Y": y, "Z": z, "F": 20.0}))
+                px, py = x, y
+        self.operation(label, commands)
+
+
+def surfacing_job(scale):
+    job = Generator(1)
+    job.tool(1, "1/8 ball end mill")
+    side = max(int(1000 * math.sqrt(scale)), 2)
+    job.surface("Surface", side, side)
+    return job.objects
+
+
+def engrave_job(scale):
+    job = Generator(2)
+    job.tool(2, "60 deg V-bit")
+    for index in range(max(int(400 * scale), 1)):
+        row, column = divmod(index, 20)
+        job.engrave("Engrave%03d" % index, column * 24.0, row * 10.0 % 290.0, 30)
+    return job.objects
+
+
+def panel_job(scale):
+    job = Generator(3)
+    parts = max(int(40 * scale), 1)
+    tools = [(1, "1/4 end mill"), (3, "1/8 end mill"), (4, "3mm drill")]
+    tools += [(5, "1/16 end mill"), (6, "90 deg V-bit"), (7, "1/2 surfacing bit")]
+    for number, label in tools:
+        job.tool(number, label)
+        for part in range(parts):
+            x0 = 10.0 + part % 8 * 60.0
+            y0 = 10.0 + part // 8 % 5 * 55.0
+            name = "%s %d" % (label.split()[-1].capitalize(), part)
+            if "drill" in label:
+                job.drill("Drilling " + name, 40)
+            elif "V-bit" in label:
+                job.engrave("Engrave " + name, x0, y0, 40)
+            else:
+                job.pocket("Pocket " + name, x0, y0, 40.0, 1.5, -6.0, 2.0)
+                job.profile("Profile " + name, x0, y0, 45.0, 45.0, -6.35, 2.0)
+    return job.objects
+
+
+def retool_job(scale):
+    job = Generator(4)
+    end_mill = job.tool(1, "1/4 end mill")
+    parts = max(int(20 * scale), 1)
+    corners = [
+        (10.0 + part % 8 * 60.0, 10.0 + part // 8 % 5 * 55.0) for part in range(parts)
+    ]
+    for part, (x0, y0) in enumerate(corners):
+        job.pocket("Pocket %d" % part, x0, y0, 40.0, 1.5, -6.0, 2.0)
+    job.tool(3, "1/8 ball end mill")
+    side = max(int(300 * math.sqrt(scale)), 2)
+    job.surface("Surface", side, side)
+    # profiles come after the surface pass, so grouping must load T1 again
+    job.reload(end_mill)
+    for part, (x0, y0) in enumerate(corners):
+        job.profile("Profile %d" % part, x0, y0, 45.0, 45.0, -6.35, 2.0)
+    return job.objects
+
+
+WORKLOADS = {
+    "surfacing": surfacing_job,
+    "engrave": engrave_job,
+    "panel": panel_job,
+    "retool": retool_job,
+}
+
+
+def peak_mb():
+    """Return the peak resident memory of this process in MB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+def timed(times, stage, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    times[stage] = times.get(stage, 0.0) + time.perf_counter() - start
+    return result
+
+
+def stage_times(post, objects, argstring):
+    """Run the stages of export() one at a time and return their seconds."""
+    post.processArguments(argstring)
+    times = {}
+    operations = timed(times, "collect", post.collect_operations, objects)
+    notes = []
+    if post.GROUP_TOOLS:
+        notes.append(timed(times, "group", post.group_operations, operations))
+    if post.REORDER:
+        notes.append(timed(times, "reorder", post.reorder_operations, operations))
+    if post.ARC_FIT_TOLERANCE:
+        notes.append(
+            timed(
+                times,
+                "arc fit",
+                post.arc_fit_operations,
+                operations,
+                post.ARC_FIT_TOLERANCE,
+            )
+        )
+    if post.SIMPLIFY_TOLERANCE:
+        notes.append(
+            timed(
+                times,
+                "simplify",
+                post.simplify_operations,
+                operations,
+                post.SIMPLIFY_TOLERANCE,
+                post.SIMPLIFY_METHOD,
+            )
+        )
+    for op in operations:
+        timed(times, "tabulate", op.tabulate)
+    if post.ESTIMATE:
+        notes.extend(timed(times, "estimate", post.estimate_operations, operations))
+    if post.CHECK_ENVELOPE:
+        timed(times, "envelope", post.check_envelope, operations)
+    lines = timed(times, "format", list, post.generate_gcode(operations, None, notes))
+    lines = timed(
+        times,
+        "optimize",
+        list,
+        post.optimize_lines(lines, optimize=False, xy_before_z=True),
+    )
+    lines = timed(times, "number", list, post.number_lines(lines))
+    timed(times, "write", post.write_gcode, lines, io.StringIO())
+    return times
+
+
+def fastest(times, stage, function, *args):
+    """Run function and keep the shortest time seen for stage."""
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    times[stage] = min(seconds, times.get(stage, seconds))
+    return result
+
+
+def run_workload(name, scale, argstring, repeat):
+    """Benchmark one workload; runs inside a fresh worker process.
+
+    Every measurement is repeated and the fastest run counts, which keeps
+    the noise of a busy machine out of the comparison.
+    """
+    import importlib
+
+    import FreeCAD  # noqa: F401  sets up the CAM modules
+    import NibblerBOT_post
+
+    objects = WORKLOADS[name](scale)
+    times = {}
+    stages = {}
+    with tempfile.TemporaryDirectory() as folder, open(os.devnull, "w") as quiet:
+        filename = os.path.join(folder, name + ".ngc")
+        with contextlib.redirect_stdout(quiet):
+            for _ in range(repeat):
+                # a fresh module so no setting or line number leaks
+                post = importlib.reload(NibblerBOT_post)
+                post.RETURN_GCODE = False
+                fastest(times, "export", post.export, objects, filename, argstring)
+            peak = peak_mb()
+            for _ in range(repeat):
+                post = importlib.reload(NibblerBOT_post)
+                for stage, seconds in stage_times(post, objects, argstring).items():
+                    stages[stage] = min(seconds, stages.get(stage, seconds))
+        with open(filename, "r") as f:
+            gcode = f.read()
+
+    for _ in range(repeat):
+        fastest(times, "parse", lambda: [list(post.parse(obj)) for obj in objects])
+        fastest(times, "optimize_gcode", post.optimize_gcode, gcode)
+
+    lines = gcode.count("\n") + 1
+    return {
+        "moves": sum(len(obj.Path.Commands) for obj in objects),
+        "lines": lines,
+        "bytes": len(gcode),
+        "seconds": times["export"],
+        "lines_per_sec": lines / times["export"] if times["export"] else 0.0,
+        "peak_mb": peak,
+        "stages": stages,
+        "parse": times["parse"],
+        "optimize_gcode": times["optimize_gcode"],
+    }
+
+
+def compare(name, result, baseline, threshold):
+    """Return a description of every regression of result against baseline."""
+    regressions = []
+    limit = 1.0 + threshold
+    too_short = result["seconds"] < MIN_STAGE_SECONDS
+    if not too_short and result["lines_per_sec"] * limit < baseline["lines_per_sec"]:
+        regressions.append(
+            "%s: %.0f lines/s, baseline %.0f"
+            % (name, result["lines_per_sec"], baseline["lines_per_sec"])
+        )
+    if result["peak_mb"] and baseline.get("peak_mb"):
+        if result["peak_mb"] > baseline["peak_mb"] * limit:
+            regressions.append(
+                "%s: peak %.0f MB, baseline %.0f MB"
+                % (name, result["peak_mb"], baseline["peak_mb"])
+            )
+    timings = dict(result["stages"], parse=result["parse"])
+    timings["optimize_gcode"] = result["optimize_gcode"]
+    before = dict(baseline.get("stages", {}))
+    before["parse"] = baseline.get("parse")
+    before["optimize_gcode"] = baseline.get("optimize_gcode")
+    for stage, seconds in timings.items():
+        old = before.get(stage)
+        if old is None or seconds < MIN_STAGE_SECONDS:
+            continue
+        if seconds > old * limit:
+            regressions.append(
+                "%s: %s %.2f s, baseline %.2f s" % (name, stage, seconds, old)
+            )
+    return regressions
+
+
+def report(name, result):
+    peak = result["peak_mb"]
+    print(
+        "%-10s %9d moves %9d lines %7.2f s %9.0f lines/s  peak %s"
+        % (
+            name,
+            result["moves"],
+            result["lines"],
+            result["seconds"],
+            result["lines_per_sec"],
+            "%.0f MB" % peak if peak else "n/a",
+        )
+    )
+    stages = dict(result["stages"], parse=result["parse"])
+    stages["optimize_gcode"] = result["optimize_gcode"]
+    print(
+        "           "
+        + "  ".join("%s %.2f" % (stage, seconds) for stage, seconds in stages.items())
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark NibblerBOT_post on generated jobs, no GUI required."
+    )
+    parser.add_argument(
+        "workloads",
+        nargs="*",
+        help="workloads to run: %s, default=all" % ", ".join(WORKLOADS),
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="job size relative to the standard workloads, default=1",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="runs of every measurement, the fastest counts, default=3",
+    )
+    parser.add_argument(
+        "--args", default="", help="extra post processor arguments, e.g. --args=--modal"
+    )
+    parser.add_argument(
+        "--baseline",
+        default="NibblerBOT_bench.json",
+        help="file with stored results, default=NibblerBOT_bench.json",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="store these results as the baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed slowdown or growth over the baseline, default=0.2 (20%%)",
+    )
+    parser.add_argument(
+        "--freecad-lib",
+        default=os.environ.get("FREECAD_LIB"),
+        help="folder containing FreeCAD.so/FreeCAD.pyd, default=$FREECAD_LIB",
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    names = args.workloads or list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error("unknown workload " + ", ".join(unknown))
+    argstring = " ".join(a for a in (POST_ARGS, args.args) if a)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            stored = json.load(f)
+        if stored.get("scale") == args.scale and stored.get("args") == argstring:
+            baselines = stored["workloads"]
+        else:
+            print("Baseline was taken with other settings, not comparing.")
+
+    results = {}
+    regressions = []
+    # FreeCAD is not fork safe, and a fresh process per workload keeps the
+    # peak memory of one from showing up in the next
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(args.freecad_lib,),
+        ) as pool:
+            result = pool.submit(
+                run_workload, name, args.scale, argstring, args.repeat
+            ).result()
+        results[name] = result
+        report(name, result)
+        if name in baselines:
+            regressions += compare(name, result, baselines[name], args.threshold)
+
+    if args.save:
+        stored = {"scale": args.scale, "args": argstring, "workloads": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as f:
+                previous = json.load(f)
+            if (
+                previous.get("scale") == args.scale
+                and previous.get("args") == argstring
+            ):
+                stored["workloads"] = previous["workloads"]
+        stored["workloads"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""On-disk cache of formatted operation bodies, so re-posts skip them.
+
+An operation body is the text format_table() makes of an operation's
+tables.  It depends on nothing but the tables, the block delete flag and
+the format settings, and its line numbers are still placeholders that
+number_lines() fills in afterwards, so a body from an earlier post can be
+dropped into a new program unchanged.
+"""
+
+import hashlib
+import os
+import time
+
+# Part of every key; bump it when the text of a body changes for the same
+# tables and settings without the post's source changing
+CACHE_VERSION = 1
+
+
+def source_digest(*paths):
+    """Return a digest of the source files at paths.
+
+    Salting the keys with it keeps an updated post processor from reusing
+    bodies an older version wrote.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+class OperationCache:
+    """Formatted operation bodies keyed by what they are made from.
+
+    Every entry is one <key>.ngc file with the lines of a body.  Reading an
+    entry touches it, and evict() removes the least recently used entries
+    once the directory holds more than max_bytes.  Entries are written to a
+    temporary file first, so two FreeCADs or a batch run can share it.
+    """
+
+    def __init__(self, directory, max_bytes, salt=b""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.salt = repr(CACHE_VERSION).encode() + salt
+
+    def key(self, tables, block_delete):
+        digest = hashlib.blake2b(self.salt, digest_size=20)
+        digest.update(b"/" if block_delete else b"")
+        for table in tables:
+            table.fingerprint(digest)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".ngc")
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        """Return the lines stored for key or None."""
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8", newline="\n") as f:
+                lines = f.readlines()
+            os.utime(path)
+        except OSError:
+            return None  # evicted by another post in the meantime
+        return lines
+
+    def store(self, key, lines):
+        """Keep lines for key; return False if they cannot be stored."""
+        # readlines() must give the very same lines back
+        if not all(line.endswith("\n") for line in lines):
+            return False
+        if "".join(lines).count("\n") != len(lines):
+            return False
+        path = self.path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = "%s.%d.tmp" % (path, os.getpid())
+            with open(temporary, "w", encoding="utf-8", newline="\n") as f:
+                f.writelines(lines)
+            os.replace(temporary, path)
+        except OSError:
+            return False
+        return True
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_bytes."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as found:
+                for entry in found:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.endswith(".tmp"):
+                        # left behind by a post that died while writing
+                        if time.time() - stat.st_mtime > 3600:
+                            entries.append((0.0, stat.st_size, entry.path))
+                    elif entry.name.endswith(".ngc"):
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return 0
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
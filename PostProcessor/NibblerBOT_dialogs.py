@@ -0,0 +1,668 @@
+"""Qt dialogs of the post processor.
+
+Only imported once export() knows it runs with a GUI, so posting without
+one never loads Qt.  The upload dialogs take the remote client from the
+post and load the network modules when they first need them.
+"""
+
+import os
+import re
+import threading
+
+try:
+    import PySide  # Use the FreeCAD wrapper
+except ImportError:
+    try:
+        import PySide6  # Outside FreeCAD, try Qt6 first
+
+        PySide = PySide6
+    except ImportError:
+        import PySide2  # Fall back to Qt5 (if this fails, Python will kill this module's import)
+
+        PySide = PySide2
+
+from PySide import QtCore, QtGui, QtWidgets
+
+import NibblerBOT_viewer as viewer
+
+selected_username = None  # Variable to store the selected username
+
+
+def application():
+    """Return the running QApplication, creating one outside FreeCAD."""
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+
+def show_missing_feeds(missing_feed_speeds):
+    dialog = QtWidgets.QDialog()
+    dialog.setWindowTitle("Missing Feed/Speeds")
+    dialog.resize(400, 300)
+    layout = QtWidgets.QVBoxLayout(dialog)
+
+    label = QtWidgets.QLabel("The following Tool Controllers have missing feeds/speed:")
+    layout.addWidget(label)
+
+    text_edit = QtWidgets.QTextEdit()
+    text_edit.setReadOnly(True)
+    for tc in missing_feed_speeds:
+        text_edit.append(f"{tc['Name']}")
+        if tc["VertFeed"] == 0:
+            text_edit.append("  Missing: Vertical Feed")
+        if tc["HorizFeed"] == 0:
+            text_edit.append("  Missing: Horizontal Feed")
+        if tc["SpindleSpeed"] == 0:
+            text_edit.append("  Missing: Spindle Speed")
+    layout.addWidget(text_edit)
+
+    button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok)
+    button_box.accepted.connect(dialog.accept)
+    layout.addWidget(button_box)
+
+    dialog.exec_()
+
+
+class DustCollectionOptionsDialog(QtWidgets.QDialog):
+    def __init__(self, dust_on=True, dust_off=False, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Dust Collection Options")
+        self.setLayout(QtWidgets.QVBoxLayout())
+
+        self.start_checkbox = QtWidgets.QCheckBox(
+            "Turn Dust Collection ON at Start (M208)"
+        )
+        self.start_checkbox.setChecked(dust_on)
+        self.layout().addWidget(self.start_checkbox)
+
+        self.end_checkbox = QtWidgets.QCheckBox(
+            "Turn Dust Collection OFF at End (M209)"
+        )
+        self.end_checkbox.setChecked(dust_off)
+        self.layout().addWidget(self.end_checkbox)
+
+        button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
+        )
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        self.layout().addWidget(button_box)
+
+    def get_options(self):
+        return self.start_checkbox.isChecked(), self.end_checkbox.isChecked()
+
+
+def confirm_envelope(report):
+    """Ask whether to write a program that leaves the envelope anyway."""
+    response = QtWidgets.QMessageBox.warning(
+        None,
+        "Machine Envelope",
+        "\n".join(report) + "\n\nCheck the work offset and units. Write anyway?",
+        QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+        QtWidgets.QMessageBox.No,
+    )
+    return response == QtWidgets.QMessageBox.Yes
+
+
+def edit_gcode(gcode):
+    """Show gcode in FreeCAD's editor; return the accepted text or None."""
+    import Path.Post.Utils as PostUtils
+
+    dia = PostUtils.GCodeEditorDialog()
+    dia.editor.setText(gcode)
+    if dia.exec_():
+        return dia.editor.toPlainText()
+    return None
+
+
+def show_viewer(filename, final):
+    """Show a program too large for the editor, read-only."""
+    if final is None:
+        program = viewer.LineIndex.open(filename)
+    else:
+        program = viewer.LineIndex(final.encode())
+    try:
+        title = "G-code" if filename == "-" else os.path.basename(filename)
+        viewer.GCodeViewer(program, title).exec_()
+    finally:
+        program.close()
+
+
+def prompt_username_selection(usernames):
+    global selected_username
+
+    dialog = QtWidgets.QDialog()
+    dialog.setWindowTitle("Select Remote User Folder")
+    # dialog.setMinimumWidth(265)  # Adjusted minimum width to better fit the title
+
+    # Create layout for the dialog
+    layout = QtWidgets.QVBoxLayout(dialog)
+
+    # Add a label
+    label = QtWidgets.QLabel("Please select your user folder:")
+    layout.addWidget(label)
+
+    # Add a combo box with search functionality
+    combo_box = ComboBoxWithSearch()
+    combo_box.addItem("")  # Add blank entry at the beginning
+    combo_box.addItems(usernames)
+
+    # Set the initial value of the combo box to the stored username
+    if selected_username in usernames:
+        combo_box.setCurrentText(selected_username)
+
+    layout.addWidget(combo_box)
+
+    # Add the button box with centered buttons
+    button_box = QtWidgets.QDialogButtonBox(
+        QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
+    )
+    button_box.accepted.connect(dialog.accept)
+    button_box.rejected.connect(dialog.reject)
+
+    # Customize the button text
+    button_box.button(QtWidgets.QDialogButtonBox.Ok).setText("Select")
+
+    # Add button box to layout, center it horizontally
+    layout.addWidget(button_box, alignment=QtCore.Qt.AlignHCenter)
+
+    # Set the layout and execute the dialog
+    dialog.setLayout(layout)
+
+    if dialog.exec_():
+        # Retrieve the selected username
+        selected_username = combo_box.currentText()
+    else:
+        selected_username = None
+
+    return selected_username
+
+
+class ListingRelay(QtCore.QObject):
+    """Carries finished folder listings from worker threads to the GUI thread."""
+
+    loaded = QtCore.Signal(str, object)  # path, future
+
+
+class FileManagerDialog(QtWidgets.QDialog):
+    def __init__(self, client, username, file_content, filename):
+        super().__init__()
+        self.username = username
+        self.file_content = file_content
+        self.filename = filename
+        self.current_path = "/"
+        self.loading_path = None  # folder whose listing is on its way
+        self.client = client
+        self.relay = ListingRelay(self)
+        self.relay.loaded.connect(self.handle_listing)
+
+        self.setWindowTitle("Select Directory and File Name")
+        self.setLayout(QtWidgets.QVBoxLayout())
+
+        # # Navigate Up Button
+        # self.navigate_up_button = QtWidgets.QPushButton()
+        # self.navigate_up_button.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_ArrowUp))
+        # self.navigate_up_button.setFixedSize(24, 24)  # Button size matches icon size
+        # self.navigate_up_button.clicked.connect(self.navigate_up)
+        # self.layout().addWidget(self.navigate_up_button, alignment=QtCore.Qt.AlignLeft)
+
+        # File Manager Tree View
+        self.file_list = QtWidgets.QTreeView()
+        self.file_list.setRootIsDecorated(False)  # No tree expand/collapse indicators
+        self.file_list.setAlternatingRowColors(True)  # For better row visibility
+        self.file_list.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectRows
+        )  # Row-based selection
+        self.file_list.setEditTriggers(
+            QtWidgets.QAbstractItemView.NoEditTriggers
+        )  # Disable editing
+        self.layout().addWidget(self.file_list)
+
+        # Connect double-click signal to handler
+        self.file_list.doubleClicked.connect(self.handle_item_double_click)
+        self.file_list.clicked.connect(self.handle_single_click)
+
+        # Custom Sort Model for Sorting
+        self.model = QtGui.QStandardItemModel()
+        self.model.setHorizontalHeaderLabels(["Name", "Date Modified", "Size"])
+
+        self.proxy_model = CustomSortModel()
+        self.proxy_model.setSourceModel(self.model)
+        self.file_list.setModel(self.proxy_model)
+
+        self.file_list.setColumnWidth(0, 300)  # Name column
+        self.file_list.setColumnWidth(1, 150)  # Date Modified column
+        self.file_list.setColumnWidth(2, 100)  # Size column
+
+        # Enable sorting and set default sort order
+        self.file_list.setSortingEnabled(True)
+        self.file_list.sortByColumn(
+            1, QtCore.Qt.DescendingOrder
+        )  # Default to sorting by "Date Modified" in descending order
+
+        # File Name Input
+        self.file_name_input = QtWidgets.QLineEdit(self.filename)
+        self.layout().addWidget(QtWidgets.QLabel("File Name:"))
+        self.layout().addWidget(self.file_name_input)
+
+        # Buttons
+        button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
+        )
+        button_box.accepted.connect(self.handle_save)
+        button_box.rejected.connect(self.reject)
+        self.layout().addWidget(button_box)
+
+        self.resize(650, 400)  # Initial size of the dialog
+        self.refresh_file_list()
+
+    def fetch_files(self):
+        import requests
+
+        try:
+            return self.client.listing(self.username, self.current_path)
+        except requests.RequestException as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Error fetching files: {e}")
+        return {}
+
+    def refresh_file_list(self):
+        """Show the current folder, from the cache or once it has loaded."""
+        path = self.current_path
+        data = self.client.cached_listing(self.username, path)
+        if data is not None:
+            self.loading_path = None
+            self.show_listing(data)
+            return
+
+        self.loading_path = path
+        self.model.removeRows(0, self.model.rowCount())
+        loading_item = QtGui.QStandardItem("Loading...")
+        loading_item.setEnabled(False)
+        self.model.appendRow(
+            [loading_item, QtGui.QStandardItem(""), QtGui.QStandardItem("")]
+        )
+        future = self.client.listing_async(self.username, path)
+        future.add_done_callback(lambda f: self.emit_listing(path, f))
+
+    def emit_listing(self, path, future):
+        # runs on a worker thread; the dialog may be gone already
+        try:
+            self.relay.loaded.emit(path, future)
+        except RuntimeError:
+            pass
+
+    def handle_listing(self, path, future):
+        import requests
+
+        if path != self.loading_path:
+            return  # the user has moved on to another folder
+        self.loading_path = None
+        try:
+            data = future.result()
+        except requests.RequestException as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Error fetching files: {e}")
+            data = {}
+        self.show_listing(data)
+
+    def show_listing(self, data):
+        self.model.removeRows(0, self.model.rowCount())  # Clear the model
+
+        if not isinstance(data, dict):
+            QtWidgets.QMessageBox.critical(
+                self, "Error", "Invalid data format received from API."
+            )
+            return
+
+        dirs = data.get('dirs', [])
+        files = data.get('files', [])
+
+        folder_icon = self.style().standardIcon(QtWidgets.QStyle.SP_DirIcon)
+        file_icon = self.style().standardIcon(QtWidgets.QStyle.SP_FileIcon)
+
+        # Add "Navigate Up" row if not at the root level
+        if self.current_path != "/":
+            navigate_up_item = QtGui.QStandardItem(folder_icon, "..")
+            navigate_up_item.setEditable(False)
+            self.model.appendRow(
+                [navigate_up_item, QtGui.QStandardItem(""), QtGui.QStandardItem("")]
+            )
+
+        # Sort directories alphabetically
+        dirs.sort(key=str.lower)
+
+        # Add directories
+        for directory in dirs:
+            folder_item = QtGui.QStandardItem(folder_icon, directory)
+            folder_item.setEditable(False)
+            # Size column intentionally left empty for folders
+            self.model.appendRow(
+                [folder_item, QtGui.QStandardItem(""), QtGui.QStandardItem("")]
+            )
+
+        # Add files
+        for file in files:
+            name = file.get('name', 'Unknown')
+            date = file.get('date', '')
+            time = file.get('time', '')
+            size = file.get('size', '')
+
+            date_modified = f"{date} {time}".strip()
+
+            file_item = QtGui.QStandardItem(file_icon, name)
+            file_item.setEditable(False)
+            date_item = QtGui.QStandardItem(date_modified)
+            size_str = file.get('size', '')
+            # Add space between digits and size indicator
+            size_str = re.sub(r'(\d)([a-zA-Z])', r'\1 \2', size_str.strip())
+            # size_str = re.sub(r'(\d)([a-zA-Z])', r'\1 \2', size_str.strip()).lower().replace('b', 'bytes')
+            size_str = re.sub(
+                r'\bB\b', 'bytes', size_str
+            )  # Replace standalone 'B' with 'BYTES'
+            size_item = QtGui.QStandardItem(size_str)
+            self.model.appendRow([file_item, date_item, size_item])
+
+        self.file_list.clearSelection()
+        self.file_name_input.setFocus()
+        self.client.prefetch_listings(self.username, self.current_path, data)
+
+    def handle_item_double_click(self, index):
+        source_index = self.proxy_model.mapToSource(
+            index
+        )  # Map proxy index to source model index
+        row = source_index.row()  # Get the row number
+
+        # Retrieve the first column item (representing the main identifier, e.g., folder or file name)
+        item = self.model.item(
+            row, 0
+        )  # Assuming column 0 is where the main name or ".." resides
+        if not item:
+            return
+
+        item_name = item.text()
+
+        # Check if it's the "Navigate Up" row
+        if item_name == "..":
+            if self.current_path != "/":
+                self.current_path = os.path.dirname(self.current_path.rstrip("/"))
+                if not self.current_path:
+                    self.current_path = "/"
+                self.refresh_file_list()
+        else:
+            # Handle folder or file selection
+            # Assume column 2 contains the "Date Modified" to differentiate folders from files
+            is_folder = not self.model.item(row, 1).text()
+            if is_folder:
+                self.current_path = os.path.join(self.current_path, item_name).replace(
+                    "\\", "/"
+                )
+                self.refresh_file_list()
+            else:
+                self.file_name_input.setText(item_name)
+                self.handle_save()
+
+    def handle_single_click(self, index):
+        source_index = self.proxy_model.mapToSource(
+            index
+        )  # Map proxy index to source model index
+        row = source_index.row()  # Get the row number
+
+        # Retrieve the first column item (representing the main identifier, e.g., folder or file name)
+        item = self.model.item(
+            row, 0
+        )  # Assuming column 0 is where the main name or ".." resides
+        if not item:
+            return
+
+        item_name = item.text()
+
+        # Handle folder or file selection
+        # Assume column 2 contains the "Date Modified" to differentiate folders from files
+        is_folder = not self.model.item(row, 1).text()
+        if not is_folder:
+            self.file_name_input.setText(item_name)
+            self.file_name_input.setFocus()
+
+    def navigate_up(self):
+        if self.current_path != "/":
+            self.current_path = os.path.dirname(self.current_path.rstrip("/"))
+            if not self.current_path:
+                self.current_path = "/"
+            self.refresh_file_list()
+
+    def prompt_overwrite(self):
+        response = QtWidgets.QMessageBox.question(
+            self,
+            "Overwrite File",
+            "File already exists. Do you want to overwrite it?",
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+        )
+        if response == QtWidgets.QMessageBox.Yes:
+            self.accept()
+
+    def handle_save(self):
+        if self.loading_path is not None:
+            # the overwrite check needs the listing, so wait for it
+            self.loading_path = None
+            self.show_listing(self.fetch_files())
+        proxy_model = self.file_list.model()  # Get the proxy model
+        source_model = proxy_model.sourceModel()  # Access the underlying source model
+        root_node = (
+            source_model.invisibleRootItem()
+        )  # Get the root node of the source model
+        number_of_files = root_node.rowCount()
+
+        existing_files = []
+        for i in range(number_of_files):
+            file_item = root_node.child(
+                i, 0
+            )  # Assuming file names are in the second column
+            if file_item:
+                file_name = file_item.text()
+                existing_files.append(file_name)
+
+        input_file_name = self.file_name_input.text()
+        if input_file_name in existing_files:
+            self.prompt_overwrite()
+        else:
+            self.accept()
+
+
+class UploadProgress(QtCore.QObject):
+    """Non-modal progress dialog for one background upload.
+
+    The transfer runs on the shared client's worker thread; signals bring
+    its progress and result back to the GUI thread.
+    """
+
+    progressed = QtCore.Signal(int)  # percent
+    finished = QtCore.Signal(object)  # future
+
+    def __init__(self, filename, client, queue_upload, report_latency):
+        # owned by the application so it outlives this module
+        super().__init__(QtWidgets.QApplication.instance())
+        self.filename = filename
+        self.client = client
+        self.queue_upload = queue_upload  # post's outbox fallback
+        self.report_latency = report_latency
+        self.percent = -1
+        self.cancel = threading.Event()
+        self.dialog = QtWidgets.QProgressDialog(
+            f"Uploading {filename}...", "Cancel", 0, 100
+        )
+        self.dialog.setWindowTitle("NibblerBOT Upload")
+        self.dialog.setWindowModality(QtCore.Qt.NonModal)
+        self.dialog.setMinimumDuration(500)  # quick uploads never show it
+        self.dialog.canceled.connect(self.cancel.set)
+        self.progressed.connect(self.dialog.setValue)
+        self.finished.connect(self.report)
+
+    def start(self, username, file_content, path, compression, delta):
+        self.upload = (username, file_content, path)
+        future = self.client.upload_async(
+            username,
+            file_content,
+            self.filename,
+            path,
+            compression,
+            progress=self.update,
+            cancel=self.cancel,
+            delta=delta,
+        )
+        future.add_done_callback(self.finished.emit)
+
+    def update(self, sent, total):
+        # runs on the worker thread for every block; only signal new percents
+        percent = 100 * sent // max(total, 1)
+        if percent != self.percent:
+            self.percent = percent
+            self.progressed.emit(percent)
+
+    def report(self, future):
+        import requests
+        import NibblerBOT_remote as remote
+
+        self.dialog.reset()
+        # a top-level widget, so it is not deleted along with this object
+        self.dialog.deleteLater()
+        failed = True
+        try:
+            response = future.result()
+        except remote.UploadCancelled:
+            message = f"Upload of {self.filename} cancelled."
+            failed = False
+        except requests.RequestException as e:
+            message = f"Upload of {self.filename} failed! {e}"
+            if self.queue_upload(*self.retry_args(), e):
+                message = f"Server unreachable, {self.filename} is in the outbox."
+                failed = False
+        else:
+            if response.status_code == 200:
+                message = f"Upload of {self.filename} successful!"
+                failed = False
+            elif self.queue_upload(*self.retry_args(), response=response):
+                message = f"Server unavailable, {self.filename} is in the outbox."
+                failed = False
+            else:
+                message = (
+                    f"Upload of {self.filename} failed! "
+                    f"{response.status_code} {response.text}"
+                )
+        print(message)
+        self.report_latency()
+        self.notify(message, failed)
+        self.deleteLater()
+
+    def retry_args(self):
+        username, file_content, path = self.upload
+        return username, file_content, self.filename, path
+
+    def notify(self, message, failed):
+        import FreeCADGui
+
+        main_window = FreeCADGui.getMainWindow()
+        main_window.statusBar().showMessage(message, 15000)
+        if failed:
+            box = QtWidgets.QMessageBox(
+                QtWidgets.QMessageBox.Warning,
+                "NibblerBOT Upload",
+                message,
+                QtWidgets.QMessageBox.Ok,
+                main_window,
+            )
+            box.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+            box.setModal(False)
+            box.show()
+
+
+class CustomSortModel(QtCore.QSortFilterProxyModel):
+    def __init__(self, sort_column=1, *args, **kwargs):  # Default sort by name
+        super(CustomSortModel, self).__init__(*args, **kwargs)
+        self.sort_column = 1  # Default sort by name
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.sort_column = column
+        super().sort(column, order)  # Call
+
+    def lessThan(self, left, right):
+        # Check if the item is a folder or a file based on the 'Date Modified' (typically, folders might have this empty)
+        left_date = self.sourceModel().data(
+            left.sibling(left.row(), 1), QtCore.Qt.DisplayRole
+        )
+        right_date = self.sourceModel().data(
+            right.sibling(right.row(), 1), QtCore.Qt.DisplayRole
+        )
+
+        left_is_folder = not left_date
+        right_is_folder = not right_date
+
+        # Folders come before files
+        if left_is_folder or right_is_folder:
+            return False
+
+        # Sorting by the designated column when both are either files or folders
+        if self.sort_column == 0:  # Sort by name
+            left_data = self.sourceModel().data(
+                left.sibling(left.row(), 0), QtCore.Qt.DisplayRole
+            )
+            right_data = self.sourceModel().data(
+                right.sibling(right.row(), 0), QtCore.Qt.DisplayRole
+            )
+        elif self.sort_column == 1:  # Sort by date
+            left_data = QtCore.QDateTime.fromString(left_date, "yyyy-MM-dd HH:mm:ss")
+            right_data = QtCore.QDateTime.fromString(right_date, "yyyy-MM-dd HH:mm:ss")
+        elif self.sort_column == 2:  # Sort by size
+            left_data = self.extract_size(
+                self.sourceModel().data(
+                    left.sibling(left.row(), 2), QtCore.Qt.DisplayRole
+                )
+            )
+            right_data = self.extract_size(
+                self.sourceModel().data(
+                    right.sibling(right.row(), 2), QtCore.Qt.DisplayRole
+                )
+            )
+        else:
+            return False  # Default fallback
+
+        return left_data < right_data
+
+    def extract_size(self, size_str):
+        if not size_str:
+            return 0  # Assume empty or 'N/A' for folders
+
+        size_str = size_str.strip().upper()
+        if 'KB' in size_str:
+            return float(size_str.replace('KB', '').strip()) * 1024
+        elif 'MB' in size_str:
+            return float(size_str.replace('MB', '').strip()) * 1024 * 1024
+        elif 'GB' in size_str:
+            return float(size_str.replace('GB', '').strip()) * 1024 * 1024 * 1024
+        elif 'TB' in size_str:
+            return float(size_str.replace('TB', '').strip()) * 1024 * 1024 * 1024 * 1024
+        elif 'BYTES' in size_str:
+            return float(size_str.replace('BYTES', '').strip())
+        else:
+            return float(size_str)  # Assume bytes if no unit is specified
+
+
+class ComboBoxWithSearch(QtWidgets.QComboBox):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setEditable(True)
+        self.setInsertPolicy(QtWidgets.QComboBox.NoInsert)
+
+        self.completer = QtWidgets.QCompleter(self)
+        self.setCompleter(self.completer)
+        self.completer.setCompletionMode(QtWidgets.QCompleter.PopupCompletion)
+
+        self.set_model(QtGui.QStandardItemModel())
+        self.completer.setModel(self.model())
+
+    def set_model(self, model):
+        self.clear()
+        self.setModel(model)
+
+    def addItems(self, items):
+        for item in items:
+            self.addItem(item)
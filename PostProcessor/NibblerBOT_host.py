@@ -0,0 +1,88 @@
+"""What the post processor needs from FreeCAD, behind one small interface.
+
+The G-code core in NibblerBOT_post only sees objects with Label, Path and
+the usual operation properties, and commands with Name and Parameters, such
+as toolpath.PostCommand.  Everything else it asks the host for: placed
+commands, the job of an operation, preferences, whether there is a GUI and
+where FreeCAD keeps its files.  FreeCAD is imported when the host is first
+needed, so the core loads and runs without it, e.g. in worker processes.
+"""
+
+import os
+
+
+class Host:
+    """Host for plain Python objects, used when FreeCAD is not available.
+
+    Paths are taken as already placed and preferences keep their defaults.
+    """
+
+    gui_up = False
+
+    def placed_commands(self, leaf):
+        return leaf.Path.Commands
+
+    def find_parent_job(self, obj):
+        return getattr(obj, "Job", None)
+
+    def preference_float(self, group, name, default):
+        return default
+
+    def user_data_dir(self):
+        # FreeCAD's own default, so the outbox is shared with the GUI
+        return os.path.join(os.path.expanduser("~"), ".local", "share", "FreeCAD")
+
+    def document_filename(self):
+        return None
+
+
+class FreeCADHost(Host):
+    """Host for the objects of a FreeCAD document."""
+
+    def __init__(self):
+        import FreeCAD
+        import PathScripts.PathUtils as PathUtils
+
+        self.freecad = FreeCAD
+        self.path_utils = PathUtils
+
+    @property
+    def gui_up(self):
+        return self.freecad.GuiUp
+
+    def placed_commands(self, leaf):
+        return self.path_utils.getPathWithPlacement(leaf).Commands
+
+    def find_parent_job(self, obj):
+        return self.path_utils.findParentJob(obj)
+
+    def preference_float(self, group, name, default):
+        prefs = self.freecad.ParamGet("User parameter:BaseApp/Preferences/" + group)
+        return prefs.GetFloat(name, default)
+
+    def user_data_dir(self):
+        return self.freecad.getUserAppDataDir()
+
+    def document_filename(self):
+        document = self.freecad.ActiveDocument
+        return None if document is None else document.FileName
+
+
+_current = None
+
+
+def current():
+    """Return the FreeCAD host if FreeCAD can be imported, else a plain one."""
+    global _current
+    if _current is None:
+        try:
+            _current = FreeCADHost()
+        except ImportError:
+            _current = Host()
+    return _current
+
+
+def use(host):
+    """Make host the one current() returns, e.g. Host() to skip FreeCAD."""
+    global _current
+    _current = host
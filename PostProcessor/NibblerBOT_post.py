@@ -21,34 +21,27 @@
 # *                                                                         *
 # ***************************************************************************
 
-import FreeCAD
-from FreeCAD import Units
-import Path
 import argparse
 import datetime
 import shlex
-import Path.Post.Utils as PostUtils
-import PathScripts.PathUtils as PathUtils
-import tkinter as tk
-from tkinter import simpledialog
-import requests
-import re, os
-
-selected_username = None  # Variable to store the selected username
-
-try:
-    import PySide  # Use the FreeCAD wrapper
-except ImportError:
-    try:
-        import PySide6  # Outside FreeCAD, try Qt6 first
-
-        PySide = PySide6
-    except ImportError:
-        import PySide2  # Fall back to Qt5 (if this fails, Python will kill this module's import)
-
-        PySide = PySide2
-
-from PySide import QtCore, QtGui, QtWidgets
+import re, os, io, sys
+import collections
+import contextlib
+import itertools
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# the toolpath stages live next to this file, which FreeCAD does not put on
+# sys.path; worker processes inherit the entry as well
+post_dir = os.path.dirname(os.path.abspath(__file__))
+if post_dir not in sys.path:
+    sys.path.insert(0, post_dir)
+
+# FreeCAD, Qt and the network modules are only imported once needed, see
+# NibblerBOT_host, NibblerBOT_dialogs and remote_client()
+import NibblerBOT_host as host
+import NibblerBOT_toolpath as toolpath
 
 TOOLTIP = """
 This is a postprocessor file for the Path workbench. It is used to
@@ -118,6 +111,189 @@ parser.add_argument(
     "--no-remote-post", action="store_true", help="Don't post to remote machine"
 )
 
+parser.add_argument(
+    "--remote-path",
+    help="Remote folder to upload to without asking, used with --no-dialogs",
+)
+
+parser.add_argument(
+    "--compress",
+    choices=["none", "auto", "gzip", "zstd"],
+    default="none",
+    help="Compress uploads if the server accepts it, auto picks the best, default=none",
+)
+
+parser.add_argument(
+    "--delta-upload",
+    action=argparse.BooleanOptionalAction,
+    default=False,
+    help="Skip identical uploads and send only changed blocks of older copies if the server offers it, default=off",
+)
+
+parser.add_argument(
+    "--connect-timeout",
+    type=float,
+    default=5.0,
+    help="Seconds to wait for the NibblerBOT server to accept a connection, default=5",
+)
+
+parser.add_argument(
+    "--read-timeout",
+    type=float,
+    default=60.0,
+    help="Seconds to wait for a reply from the NibblerBOT server, default=60",
+)
+
+parser.add_argument(
+    "--retries",
+    type=int,
+    default=3,
+    help="Times to retry a failed user or folder listing, default=3",
+)
+
+parser.add_argument(
+    "--dust-on",
+    action=argparse.BooleanOptionalAction,
+    default=None,
+    help="Turn dust collection ON at start (M208), default=on",
+)
+
+parser.add_argument(
+    "--dust-off",
+    action=argparse.BooleanOptionalAction,
+    default=None,
+    help="Turn dust collection OFF at end (M209), default=off",
+)
+
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=0,
+    help="format operations on this many worker processes, default=0 (serial)",
+)
+
+parser.add_argument(
+    "--operation-cache",
+    action=argparse.BooleanOptionalAction,
+    default=True,
+    help="Reuse the G-code of operations that are unchanged since an earlier post, default=on",
+)
+
+parser.add_argument(
+    "--operation-cache-size",
+    type=float,
+    metavar="MB",
+    default=256.0,
+    help="Disk space kept for the operation cache, default=256",
+)
+
+parser.add_argument(
+    "--group-tools",
+    action="store_true",
+    help="Group operations by tool to save tool changes, keeping roughing before finishing and profiles last",
+)
+
+parser.add_argument(
+    "--reorder",
+    action="store_true",
+    help="Reorder operations marked reorderable to shorten rapids between them",
+)
+
+parser.add_argument(
+    "--arc-fit",
+    nargs="?",
+    const="default",
+    metavar="TOL",
+    help="Replace G1 runs that follow an arc with G2/G3 within TOL mm, default TOL=GeometryTolerance preference",
+)
+
+parser.add_argument(
+    "--simplify",
+    nargs="?",
+    const="default",
+    metavar="TOL",
+    help="Drop zero length moves and merge G1 moves that are straight within TOL mm, default TOL=LibAreaCurveAccuracy preference",
+)
+
+parser.add_argument(
+    "--simplify-method",
+    choices=sorted(toolpath.SIMPLIFY_METHODS),
+    default="merge",
+    help="Line simplification used by --simplify, default=merge (linear time)",
+)
+
+parser.add_argument(
+    "--estimate",
+    action="store_true",
+    help="Estimate the cycle time per operation and tool and add it to the header",
+)
+
+parser.add_argument(
+    "--accel",
+    type=float,
+    default=500.0,
+    help="Machine acceleration for --estimate in mm/s^2, default=500",
+)
+
+parser.add_argument(
+    "--jerk",
+    type=float,
+    default=0.0,
+    help="Machine jerk for --estimate in mm/s^3, default=0 (trapezoidal moves)",
+)
+
+parser.add_argument(
+    "--tool-change-time",
+    type=float,
+    default=0.0,
+    help="Seconds --estimate adds for every tool change, default=0",
+)
+
+parser.add_argument(
+    "--envelope-check",
+    action=argparse.BooleanOptionalAction,
+    default=False,
+    help="Check every move, arcs included, against the machine envelope before writing, default=off",
+)
+
+parser.add_argument(
+    "--envelope-min",
+    type=float,
+    nargs=3,
+    metavar=("X", "Y", "Z"),
+    help="Lowest work coordinates in mm, Z from the top of the stock; turns the envelope check on",
+)
+
+parser.add_argument(
+    "--envelope-max",
+    type=float,
+    nargs=3,
+    metavar=("X", "Y", "Z"),
+    help="Highest work coordinates in mm, Z from the top of the stock; turns the envelope check on",
+)
+
+parser.add_argument(
+    "--envelope-clearance",
+    type=float,
+    default=0.0,
+    metavar="MM",
+    help="Tool length clearance kept below the top of the envelope, default=0",
+)
+
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="memory",
+    choices=["memory", "time", "cprofile"],
+    help="Save time, lines, bytes and traced memory of every stage and operation as .profile.json next to the output; time skips the (slow) memory tracing, cprofile runs cProfile instead",
+)
+
+parser.add_argument(
+    "--no-dialogs",
+    action="store_true",
+    help="Never prompt; take dust options, job author and remote path from arguments",
+)
+
 TOOLTIP_ARGS = parser.format_help()
 
 # These globals set common customization preferences
@@ -125,14 +301,43 @@ OUTPUT_COMMENTS = True
 OUTPUT_HEADER = True
 OUTPUT_LINE_NUMBERS = False
 SHOW_EDITOR = True
+EDITOR_LIMIT = 200000  # characters; bigger programs open in the read-only viewer
 MODAL = False  # if true commands are suppressed if the same as previous line.
 USE_TLO = True  # if true G43 will be output following tool changes
 OUTPUT_DOUBLES = (
     True  # if false duplicate axis values are suppressed if the same as previous line.
 )
 MEASURE_TOOL = False
+RETURN_GCODE = True  # if false export() skips reading a written file back into memory
+SHOW_DIALOGS = True  # if false export() runs unattended, e.g. for batch posting
+PARALLEL_WORKERS = 0  # worker processes formatting operations, 0 or 1 is serial
+PARALLEL_MIN_COMMANDS = 5000  # smaller operations are formatted in-process
+OPERATION_CACHE = True  # reuse bodies of operations posted before unchanged
+OPERATION_CACHE_SIZE = 256.0  # MB kept in the operation cache
+CACHE_MIN_COMMANDS = 1000  # smaller operations are cheaper to format than to read back
+DUST_ON = True  # default for "Turn Dust Collection ON at Start (M208)"
+DUST_OFF = False  # default for "Turn Dust Collection OFF at End (M209)"
+GROUP_TOOLS = False  # schedule operations for the fewest tool changes
+REORDER = False  # reorder operations marked reorderable within a tool
+ARC_FIT_TOLERANCE = None  # mm, fit G2/G3 arcs to G1 runs when set
+SIMPLIFY_TOLERANCE = None  # mm, merge straight G1 runs when set
+SIMPLIFY_METHOD = "merge"
+ESTIMATE = False  # add a cycle time estimate to the header
+ACCELERATION = 500.0  # mm/s^2
+JERK = 0.0  # mm/s^3, 0 for trapezoidal moves
+TOOL_CHANGE_TIME = 0.0  # seconds
+CHECK_ENVELOPE = False  # check moves against the envelope limits before writing
+ENVELOPE_MIN = None  # (x, y, z) mm, z from the stock top; None for the corners
+ENVELOPE_MAX = None
+ENVELOPE_CLEARANCE = 0.0  # mm kept free below CORNER_MAX z for the tool length
+ENVELOPE_REPORT_LIMIT = 10  # operations listed in an envelope report
+PROFILE = None  # "memory", "time" or "cprofile" to profile export()
+PROFILER = None  # PostProfiler of the running export
+DEFAULT_RAPID_SPEED = 1000 * 25.4 / 60  # mm/s, 1000 in/min as in the job templates
+WRITE_BUFFER_SIZE = 1 << 20  # bytes buffered before the output file is flushed
 COMMAND_SPACE = " "
 LINENR = 100  # line number starting value
+LINE_NUMBER_MARK = "N#"  # placeholder until number_lines() assigns the number
 
 # These globals will be reflected in the Machine configuration of the project
 UNITS = "G21"  # G21 for metric, G20 for us standard
@@ -146,6 +351,12 @@ PRECISION = 3
 
 REMOTE_POST = True
 JOB_AUTHOR = ""
+REMOTE_PATH = ""
+COMPRESS_UPLOAD = "none"  # request encoding for uploads: none, auto, gzip or zstd
+DELTA_UPLOAD = False  # skip identical uploads, send deltas against older copies
+CONNECT_TIMEOUT = 5.0  # seconds
+READ_TIMEOUT = 60.0  # seconds
+RETRIES = 3  # extra tries for listings, uploads are never repeated
 BASE_URL = "https://nibblerbot.knoxmakers.org:1337/"
 
 
@@ -191,6 +402,31 @@ def processArguments(argstring):
     global OUTPUT_DOUBLES
     global JOB_AUTHOR
     global REMOTE_POST
+    global REMOTE_PATH
+    global COMPRESS_UPLOAD
+    global DELTA_UPLOAD
+    global CONNECT_TIMEOUT
+    global READ_TIMEOUT
+    global RETRIES
+    global SHOW_DIALOGS
+    global DUST_ON
+    global DUST_OFF
+    global PARALLEL_WORKERS
+    global OPERATION_CACHE
+    global OPERATION_CACHE_SIZE
+    global GROUP_TOOLS
+    global REORDER
+    global ARC_FIT_TOLERANCE
+    global SIMPLIFY_TOLERANCE
+    global SIMPLIFY_METHOD
+    global ESTIMATE
+    global ACCELERATION
+    global JERK
+    global TOOL_CHANGE_TIME
+    global CHECK_ENVELOPE
+    global ENVELOPE_CLEARANCE
+    global ENVELOPE_MIN, ENVELOPE_MAX
+    global PROFILE
 
     try:
         args = parser.parse_args(shlex.split(argstring))
@@ -225,6 +461,47 @@ def processArguments(argstring):
             REMOTE_POST = False
         if args.job_author:
             JOB_AUTHOR = args.job_author
+        if args.remote_path:
+            REMOTE_PATH = args.remote_path
+        COMPRESS_UPLOAD = args.compress
+        DELTA_UPLOAD = args.delta_upload
+        CONNECT_TIMEOUT = args.connect_timeout
+        READ_TIMEOUT = args.read_timeout
+        RETRIES = args.retries
+        if args.dust_on is not None:
+            DUST_ON = args.dust_on
+        if args.dust_off is not None:
+            DUST_OFF = args.dust_off
+        if args.no_dialogs:
+            SHOW_DIALOGS = False
+        PARALLEL_WORKERS = args.workers
+        OPERATION_CACHE = args.operation_cache
+        OPERATION_CACHE_SIZE = args.operation_cache_size
+        if args.group_tools:
+            GROUP_TOOLS = True
+        if args.reorder:
+            REORDER = True
+        if args.arc_fit == "default":
+            ARC_FIT_TOLERANCE = cam_tolerance("GeometryTolerance")
+        elif args.arc_fit is not None:
+            ARC_FIT_TOLERANCE = float(args.arc_fit)
+        if args.simplify == "default":
+            SIMPLIFY_TOLERANCE = cam_tolerance("LibAreaCurveAccuracy")
+        elif args.simplify is not None:
+            SIMPLIFY_TOLERANCE = float(args.simplify)
+        SIMPLIFY_METHOD = args.simplify_method
+        if args.estimate:
+            ESTIMATE = True
+        ACCELERATION = args.accel
+        JERK = args.jerk
+        TOOL_CHANGE_TIME = args.tool_change_time
+        CHECK_ENVELOPE = args.envelope_check
+        if args.envelope_min is not None or args.envelope_max is not None:
+            CHECK_ENVELOPE = True
+        ENVELOPE_MIN = args.envelope_min
+        ENVELOPE_MAX = args.envelope_max
+        ENVELOPE_CLEARANCE = args.envelope_clearance
+        PROFILE = args.profile
 
     except Exception:
         return False
@@ -232,17 +509,54 @@ def processArguments(argstring):
     return True
 
 
+def cam_tolerance(name):
+    """Return a CAM tolerance preference in mm, as install.py sets them."""
+    return host.current().preference_float("Mod/CAM", name, 0.01016)
+
+
+def dialogs_enabled():
+    return SHOW_DIALOGS and host.current().gui_up
+
+
 def export(objectslist, filename, argstring):
-    # Prompt for dust collection options before anything else
+    global PROFILER
+
+    if not processArguments(argstring):
+        return None
+    if not PROFILE:
+        return post_objects(objectslist, filename)
+
+    import NibblerBOT_profile as profile
+
+    PROFILER = profile.PostProfiler(
+        memory=PROFILE == "memory", use_cprofile=PROFILE == "cprofile"
+    )
+    try:
+        with PROFILER.running():
+            return post_objects(objectslist, filename)
+    finally:
+        report_profile(PROFILER, filename)
+        PROFILER = None
+
+
+def post_objects(objectslist, filename):
+    """Post objectslist to filename with the settings processArguments() set."""
     global UNITS
     global UNIT_FORMAT
     global UNIT_SPEED_FORMAT
     global PREAMBLE, POSTAMBLE
     global blockDelete
 
-    app = QtWidgets.QApplication.instance()
-    if app is None:
-        app = QtWidgets.QApplication([])
+    interactive = dialogs_enabled()
+    if interactive:
+        import NibblerBOT_dialogs as dialogs
+
+        app = dialogs.application()
+        if REMOTE_POST:
+            # the username dialog comes last; fetch its list meanwhile
+            remote_client().prefetch_usernames()
+    if REMOTE_POST:
+        report_outbox()
 
     missing_feed_speeds = []
     for obj in objectslist:
@@ -264,43 +578,32 @@ def export(objectslist, filename, argstring):
                     }
                 )
 
-    if missing_feed_speeds:
-        dialog = QtWidgets.QDialog()
-        dialog.setWindowTitle("Missing Feed/Speeds")
-        dialog.resize(400, 300)
-        layout = QtWidgets.QVBoxLayout(dialog)
-
-        label = QtWidgets.QLabel(
-            "The following Tool Controllers have missing feeds/speed:"
-        )
-        layout.addWidget(label)
-
-        text_edit = QtWidgets.QTextEdit()
-        text_edit.setReadOnly(True)
+    if missing_feed_speeds and not interactive:
+        print("The following Tool Controllers have missing feeds/speed:")
         for tc in missing_feed_speeds:
-            text_edit.append(f"{tc['Name']}")
+            print(f"{tc['Name']}")
             if tc["VertFeed"] == 0:
-                text_edit.append("  Missing: Vertical Feed")
+                print("  Missing: Vertical Feed")
             if tc["HorizFeed"] == 0:
-                text_edit.append("  Missing: Horizontal Feed")
+                print("  Missing: Horizontal Feed")
             if tc["SpindleSpeed"] == 0:
-                text_edit.append("  Missing: Spindle Speed")
-        layout.addWidget(text_edit)
-
-        button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok)
-        button_box.accepted.connect(dialog.accept)
-        layout.addWidget(button_box)
-
-        dialog.exec_()
+                print("  Missing: Spindle Speed")
         return None
 
-    options_dialog = DustCollectionOptionsDialog()
-    if options_dialog.exec_():
-        dust_on, dust_off = options_dialog.get_options()
-    else:
-        print("User cancelled dust collection options dialog.")
+    if missing_feed_speeds:
+        dialogs.show_missing_feeds(missing_feed_speeds)
         return None
 
+    # Prompt for dust collection options before anything else
+    dust_on, dust_off = DUST_ON, DUST_OFF
+    if interactive:
+        options_dialog = dialogs.DustCollectionOptionsDialog(dust_on, dust_off)
+        if options_dialog.exec_():
+            dust_on, dust_off = options_dialog.get_options()
+        else:
+            print("User cancelled dust collection options dialog.")
+            return None
+
     # Add M208 at end of PREAMBLE if dust_on is checked and not already present
     if dust_on and "M208" not in PREAMBLE:
         PREAMBLE = PREAMBLE.rstrip() + "\nM208\n"
@@ -310,11 +613,6 @@ def export(objectslist, filename, argstring):
         if "M300" in POSTAMBLE:
             POSTAMBLE = POSTAMBLE.replace("M300", "M209\nM300")
 
-    if not processArguments(argstring):
-        return None
-
-    tool_list = set()
-
     for obj in objectslist:
         if not hasattr(obj, "Path"):
             print(
@@ -325,40 +623,756 @@ def export(objectslist, filename, argstring):
             return None
 
     print("postprocessing...")
-    gcode = ""
     blockDelete = False
 
+    with profile_stage("collect"):
+        operations = collect_operations(objectslist)
+    notes = []
+    if GROUP_TOOLS:
+        with profile_stage("group"):
+            notes.append(group_operations(operations))
+        print(notes[-1])
+    if REORDER:
+        with profile_stage("reorder"):
+            notes.append(reorder_operations(operations))
+        print(notes[-1])
+    if ARC_FIT_TOLERANCE:
+        with profile_stage("arc_fit"):
+            notes.append(arc_fit_operations(operations, ARC_FIT_TOLERANCE))
+        print(notes[-1])
+    if SIMPLIFY_TOLERANCE:
+        with profile_stage("simplify"):
+            notes.append(
+                simplify_operations(operations, SIMPLIFY_TOLERANCE, SIMPLIFY_METHOD)
+            )
+        print(notes[-1])
+    with profile_stage("tabulate"):
+        for op in operations:
+            profile_operation(op.label, commands=op.command_count())
+            op.tabulate()
+        profile_operation(None)
+    if ESTIMATE:
+        with profile_stage("estimate"):
+            estimate = estimate_operations(operations)
+        notes.extend(estimate)
+        print("\n".join(estimate))
+    if CHECK_ENVELOPE:
+        with profile_stage("envelope"):
+            report = check_envelope(operations)
+        if report:
+            print("\n".join(report))
+            notes.append("WARNING: " + report[0])
+            if interactive and not dialogs.confirm_envelope(report):
+                print("Envelope check failed, nothing written.")
+                return None
+    cache = None
+    if OPERATION_CACHE:
+        with profile_stage("cache"):
+            cache = operation_cache()
+            print(look_up_operations(cache, operations))
+    with profile_stage("pool"):
+        pool = start_format_pool(PARALLEL_WORKERS, operations)
+    try:
+        gcode_lines = profile_stream(
+            "format", generate_gcode(operations, pool, notes, cache), per_operation=True
+        )
+        gcode_lines = profile_stream(
+            "optimize", optimize_lines(gcode_lines, optimize=False, xy_before_z=True)
+        )
+        gcode_lines = profile_stream("number", number_lines(gcode_lines))
+
+        # Stream the program straight to its destination.  The full text is
+        # only materialized when the editor, the upload or the caller needs it.
+        final = None
+        with profile_stage("write"):
+            if filename == "-":
+                buffer = io.StringIO()
+                write_gcode(gcode_lines, buffer)
+                final = buffer.getvalue()
+            else:
+                with pythonopen(filename, "w", buffering=WRITE_BUFFER_SIZE) as gfile:
+                    write_gcode(gcode_lines, gfile)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if cache is not None:
+        with profile_stage("cache"):
+            cache.evict()
+
+    if interactive and SHOW_EDITOR:
+        if final is None:
+            size = os.path.getsize(filename)
+        else:
+            size = len(final)
+        if size > EDITOR_LIMIT:
+            # the editor cannot cope with big programs; page through them instead
+            with profile_stage("editor"):
+                dialogs.show_viewer(filename, final)
+        else:
+            if final is None:
+                final = read_gcode(filename)
+            with profile_stage("editor"):
+                edited = dialogs.edit_gcode(final)
+            if edited is not None and edited != final:
+                final = edited
+                if not filename == "-":
+                    with pythonopen(filename, "w") as gfile:
+                        gfile.write(final)
+
+    print("done postprocessing.")
+
+    if REMOTE_POST:
+        if final is None:
+            final = read_gcode(filename)
+        with profile_stage("upload"):
+            if prompt_and_upload(final, filename):
+                return final
+            else:
+                return final
+
+    if final is None:
+        if not RETURN_GCODE:
+            return ""
+        final = read_gcode(filename)
+
+    return final
+
+
+def is_active(obj):
+    if hasattr(obj, "Active"):
+        if not obj.Active:
+            return False
+    if hasattr(obj, "Base") and hasattr(obj.Base, "Active"):
+        if not obj.Base.Active:
+            return False
+    return True
+
+
+def path_leaves(pathobj):
+    """Yield the objects whose paths make up pathobj, in output order."""
+    if hasattr(pathobj, "Group"):  # We have a compound or project.
+        for p in pathobj.Group:
+            yield from path_leaves(p)
+    # groups might contain non-path things like stock.
+    elif hasattr(pathobj, "Path"):
+        yield pathobj
+
+
+# Scheduling hints in an operation's Comment, e.g. "reorderable after: Pocket"
+REORDERABLE_HINT = re.compile(r"\breorderable\b", re.IGNORECASE)
+AFTER_HINT = re.compile(r"\bafter:\s*([^;\n]+)", re.IGNORECASE)
+
+
+# Machining stage of an operation by the type in its internal name; an
+# operation never moves ahead of one from an earlier stage
+OPERATION_STAGES = {
+    "Adaptive": 0,
+    "Pocket": 0,
+    "Face": 0,
+    "MillFace": 0,
+    "Helix": 0,
+    "Slot": 0,
+    "Drilling": 0,
+    "Tapping": 0,
+    "ThreadMilling": 0,
+    "Surface": 1,
+    "Waterline": 1,
+    "Engrave": 1,
+    "Vcarve": 1,
+    "Deburr": 1,
+    "Profile": 2,
+    "Contour": 2,
+}
+
+
+class PostOperation:
+    """One active operation with its placed commands and post metadata.
+
+    Built once per export by collect_operations() so the placement transform
+    and command materialization happen a single time; every later stage
+    reads from here instead of going back to the document object.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.label = obj.Label
+
+        # placed command lists, one per leaf path in parse() order; the
+        # toolpath stages rewrite these, then tabulate() replaces them
+        self.paths = [host.current().placed_commands(leaf) for leaf in path_leaves(obj)]
+        self.tables = None
+
+        # set by look_up_operations() when the body is worth caching
+        self.cache_key = None
+        self.cache_hit = False
+
+        # tool numbers in first-use order
+        tools = {}
+        for commands in self.paths:
+            for command in commands:
+                parameters = command.Parameters
+                if "T" in parameters:
+                    tools.setdefault(parameters["T"], None)
+        self.tools = list(tools)
+
+        self.coolant_mode = "None"
+        if hasattr(obj, "CoolantMode"):
+            self.coolant_mode = obj.CoolantMode
+        elif hasattr(obj, "Base") and hasattr(obj.Base, "CoolantMode"):
+            self.coolant_mode = obj.Base.CoolantMode
+
+        self.block_delete = bool(
+            hasattr(obj, "BlockDelete")
+            and obj.BlockDelete
+            or hasattr(obj, "Base")
+            and hasattr(obj.Base, "BlockDelete")
+            and obj.Base.BlockDelete
+        )
+
+        # scheduling hints; tool controllers, fixtures and anything else
+        # without a tool controller always stay where they are
+        self.tool_controller = getattr(obj, "ToolController", None)
+        comment = getattr(obj, "Comment", "") or ""
+        self.reorderable = self.tool_controller is not None and bool(
+            getattr(obj, "Reorderable", False) or REORDERABLE_HINT.search(comment)
+        )
+        base = obj
+        while hasattr(base, "Base") and hasattr(base.Base, "Name"):
+            base = base.Base  # look through dressups
+        kind = re.match(r"[A-Za-z]*", getattr(base, "Name", ""))
+        self.stage = OPERATION_STAGES.get(kind.group(0))
+        match = AFTER_HINT.search(comment)
+        self.after = set()
+        if match:
+            self.after = {l.strip() for l in match.group(1).split(",") if l.strip()}
+
+    def tabulate(self):
+        """Turn the command lists into CommandTables for the later stages."""
+        self.tables = [toolpath.CommandTable.from_commands(c) for c in self.paths]
+        self.paths = None
+
+    def command_count(self):
+        if self.tables is not None:
+            return sum(len(table) for table in self.tables)
+        return sum(len(commands) for commands in self.paths)
+
+
+def collect_operations(objectslist):
+    """Return a PostOperation for every active object, in output order."""
+    operations = []
+    for obj in objectslist:
+        if is_active(obj):
+            profile_operation(obj.Label)
+            operations.append(PostOperation(obj))
+            profile_operation(obj.Label, placed=operations[-1].command_count())
+    profile_operation(None)
+    return operations
+
+
+def must_precede(first, second):
+    """Return True if first, ahead of second in the job, has to stay there."""
+    return (
+        first.tool_controller is second.tool_controller
+        or first.label in second.after
+        or first.stage is None
+        or second.stage is None
+        or first.stage < second.stage
+    )
+
+
+def group_operations(operations):
+    """Regroup operations by tool in place and return a summary line.
+
+    Tool controllers are emitted ahead of their group; fixtures and anything
+    else that is not an operation split the job into parts that are
+    scheduled on their own.
+    """
+    controllers = {
+        id(op.tool_controller) for op in operations if op.tool_controller is not None
+    }
+    loads = {}  # tool controller id -> its unused PostOperations, in job order
+    for op in operations:
+        if id(op.obj) in controllers:
+            loads.setdefault(id(op.obj), collections.deque()).append(op)
+    controller_objects = {key: unused[0].obj for key, unused in loads.items()}
+
+    def load(controller):
+        # every load needs its own PostOperation, as tabulate() consumes it
+        unused = loads[controller]
+        if unused:
+            return unused.popleft()
+        return PostOperation(controller_objects[controller])
+
+    result = []
+    before_changes = after_changes = 0
+
+    def schedule(part):
+        nonlocal before_changes, after_changes
+        tools = [id(op.tool_controller) for op in part]
+        before = [
+            {i for i in range(j) if must_precede(part[i], part[j])}
+            for j in range(len(part))
+        ]
+        order = toolpath.group_by_tool(tools, before)
+        before_changes += toolpath.tool_loads(range(len(part)), tools)
+        after_changes += toolpath.tool_loads(order, tools)
+        current = None
+        for i in order:
+            if tools[i] != current:
+                current = tools[i]
+                if current in loads:
+                    result.append(load(current))
+            result.append(part[i])
+
+    part = []
+    for op in operations:
+        if op.tool_controller is not None:
+            part.append(op)
+        elif id(op.obj) not in controllers:
+            if part:
+                schedule(part)
+                part = []
+            result.append(op)
+    if part:
+        schedule(part)
+    operations[:] = result
+
+    return "Tool changes: %d -> %d, %d saved" % (
+        before_changes,
+        after_changes,
+        before_changes - after_changes,
+    )
+
+
+def reorder_operations(operations):
+    """Reorder runs of reorderable operations in place; return a summary line.
+
+    A run ends at every operation that is not reorderable, such as tool
+    controllers and fixtures, and wherever the tool controller changes, so
+    operations never move to another tool or fixture.  Within a run the
+    "after:" hints of the operations are respected.
+    """
+    result = []
+    here = None
+    moved = 0
+    before_length = after_length = 0.0
+
+    def place(run):
+        nonlocal here, moved, before_length, after_length
+        ends = [toolpath.path_ends(op.paths) for op in run]
+        index = {op.label: i for i, op in enumerate(run)}
+        before = [{index[l] for l in op.after if l in index} for op in run]
+        order = toolpath.plan_order(ends, here, before)
+        before_length += toolpath.travel_length(range(len(run)), ends, here)
+        after_length += toolpath.travel_length(order, ends, here)
+        moved += sum(1 for position, i in enumerate(order) if position != i)
+        result.extend(run[i] for i in order)
+        for i in order:
+            if ends[i][1] is not None:
+                here = ends[i][1]
+
+    run = []
+    for op in operations:
+        if run and (
+            not op.reorderable or op.tool_controller is not run[0].tool_controller
+        ):
+            place(run)
+            run = []
+        if op.reorderable:
+            run.append(op)
+            continue
+        result.append(op)
+        exit = toolpath.path_ends(op.paths)[1]
+        if exit is not None:
+            here = exit
+    if run:
+        place(run)
+    operations[:] = result
+
+    scale = UNIT_SCALE[UNIT_FORMAT]
+    return "Reorder: %d operations moved, rapids %.1f -> %.1f %s" % (
+        moved,
+        before_length / scale,
+        after_length / scale,
+        UNIT_FORMAT,
+    )
+
+
+def arc_fit_operations(operations, tolerance):
+    """Fit G2/G3 arcs into every operation and return a summary line."""
+    formatter = CommandFormatter()
+
+    def size(commands):
+        # approximate: every word printed as if it were not a double
+        total = 0
+        for c in commands:
+            words = formatter.words(c.Name, c.Parameters, {"F": None})
+            total += len(COMMAND_SPACE.join([c.Name] + words)) + len(COMMAND_SPACE) + 1
+        return total
+
+    moves = arcs = bytes_saved = 0
+    for op in operations:
+        for index, commands in enumerate(op.paths):
+            stats = toolpath.ArcFitStats()
+            op.paths[index] = toolpath.fit_arcs(commands, tolerance, stats)
+            moves += stats.moves
+            arcs += stats.arcs
+            for removed, added in stats.replaced:
+                bytes_saved += size(removed) - size(added)
+    return "Arc fit %g mm: %d moves -> %d arcs, %d lines and about %d bytes saved" % (
+        tolerance,
+        moves,
+        arcs,
+        moves - arcs,
+        bytes_saved,
+    )
+
+
+# Globals a formatting worker needs to produce the same lines as export()
+FORMAT_SETTINGS = [
+    "OUTPUT_COMMENTS",
+    "OUTPUT_LINE_NUMBERS",
+    "MODAL",
+    "USE_TLO",
+    "OUTPUT_DOUBLES",
+    "COMMAND_SPACE",
+    "TOOL_CHANGE",
+    "UNITS",
+    "UNIT_FORMAT",
+    "UNIT_SPEED_FORMAT",
+    "PRECISION",
+]
+
+
+def operation_cache():
+    """Return the OperationCache for the current format settings.
+
+    The settings and the source of the post and toolpath modules salt every
+    key, so bodies are only reused for the same output.
+    """
+    import NibblerBOT_cache
+
+    settings = [globals()[name] for name in FORMAT_SETTINGS]
+    salt = repr((settings, LINE_NUMBER_MARK)).encode()
+    salt += NibblerBOT_cache.source_digest(__file__, toolpath.__file__)
+    directory = os.path.join(host.current().user_data_dir(), "NibblerBOT", "operations")
+    return NibblerBOT_cache.OperationCache(
+        directory, int(OPERATION_CACHE_SIZE * (1 << 20)), salt
+    )
+
+
+def look_up_operations(cache, operations):
+    """Key the operations worth caching and note which the cache holds."""
+    keyed = hits = 0
+    for op in operations:
+        op.cache_key = None
+        op.cache_hit = False
+        if op.command_count() < CACHE_MIN_COMMANDS:
+            continue
+        op.cache_key = cache.key(op.tables, op.block_delete)
+        op.cache_hit = cache.contains(op.cache_key)
+        keyed += 1
+        hits += op.cache_hit
+    return "Operation cache: %d of %d operations reused" % (hits, keyed)
+
+
+def cached_body(cache, op, body, formatter):
+    """Return the body of op from the cache, else format and store it.
+
+    body is what a worker already formatted, or None.
+    """
+    if body is None and op.cache_hit:
+        body = cache.load(op.cache_key)
+        if body is not None:
+            return body
+    if body is None:
+        body = []
+        for table in op.tables:
+            body.extend(format_table(table, formatter))
+    cache.store(op.cache_key, body)
+    return body
+
+
+def python_executable():
+    """Return a Python interpreter for worker processes or None.
+
+    Inside FreeCAD sys.executable is FreeCAD itself; the bundled interpreter
+    lives next to it.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    folder = os.path.dirname(sys.executable)
+    for name in ("python3", "python", "python.exe"):
+        candidate = os.path.join(folder, name)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def start_format_pool(workers, operations):
+    """Start worker processes for generate_gcode() or return None for serial."""
+    if workers is None or workers <= 1:
+        return None
+    heavy = sum(
+        1
+        for op in operations
+        if op.command_count() >= PARALLEL_MIN_COMMANDS and not op.cache_hit
+    )
+    if heavy < 2:
+        return None
+    executable = python_executable()
+    if executable is None:
+        print("No Python interpreter found for workers, formatting serially.")
+        return None
+
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(executable)
+    try:
+        return ProcessPoolExecutor(max_workers=min(workers, heavy), mp_context=context)
+    except (OSError, ValueError) as e:
+        print(f"Could not start worker processes ({e}), formatting serially.")
+        return None
+
+
+def format_operation(settings, tables, block_delete):
+    """Format one operation body in a worker process.
+
+    tables are the operation's CommandTables, which pickle as a few arrays
+    instead of one object per command.
+    """
+    global blockDelete
+    globals().update(settings)
+    blockDelete = block_delete
+    formatter = CommandFormatter()
+    lines = []
+    for table in tables:
+        lines.extend(format_table(table, formatter))
+    return lines
+
+
+def format_in_pool(pool, operations):
+    """Yield each operation body in order, None where it is formatted inline.
+
+    Only a few operations are in flight at a time so memory stays bounded by
+    the window instead of the program.
+    """
+    settings = {name: globals()[name] for name in FORMAT_SETTINGS}
+    window = 2 * max(PARALLEL_WORKERS, 1)
+    pending = collections.deque()
+    remaining = iter(operations)
+
+    def submit(op):
+        if op.command_count() < PARALLEL_MIN_COMMANDS or op.cache_hit:
+            return op, None
+        return op, pool.submit(format_operation, settings, op.tables, op.block_delete)
+
+    for op in itertools.islice(remaining, window):
+        pending.append(submit(op))
+    while pending:
+        op, future = pending.popleft()
+        following = next(remaining, None)
+        if following is not None:
+            pending.append(submit(following))
+        if future is None:
+            yield None
+            continue
+        try:
+            yield future.result()
+        except Exception as e:
+            print(f"Worker failed on {op.label} ({e}), formatting it serially.")
+            yield None
+
+
+def simplify_operations(operations, tolerance, method):
+    """Simplify the straight moves of every operation and return a summary line."""
+    stats = toolpath.SimplifyStats()
+    for op in operations:
+        for index, commands in enumerate(op.paths):
+            op.paths[index] = toolpath.simplify(commands, tolerance, method, stats)
+    return "Simplify %s %g mm: %d zero length and %d straight moves removed" % (
+        method,
+        tolerance,
+        stats.degenerate,
+        stats.merged,
+    )
+
+
+def rapid_speeds(operations):
+    """Return the HorizRapid and VertRapid of the job's setup sheet in mm/s."""
+    for op in operations:
+        if op.tool_controller is None:
+            continue
+        job = host.current().find_parent_job(op.obj)
+        setup = getattr(job, "SetupSheet", None)
+        if setup is not None:
+            horizontal = getattr(setup.HorizRapid, "Value", setup.HorizRapid)
+            vertical = getattr(setup.VertRapid, "Value", setup.VertRapid)
+            return horizontal or DEFAULT_RAPID_SPEED, vertical or DEFAULT_RAPID_SPEED
+    return DEFAULT_RAPID_SPEED, DEFAULT_RAPID_SPEED
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+def estimate_operations(operations):
+    """Return header lines with the estimated cycle time per operation and tool."""
+    rapid_xy, rapid_z = rapid_speeds(operations)
+    machine = toolpath.Machine(
+        rapid_xy,
+        rapid_z,
+        accel=ACCELERATION,
+        jerk=JERK,
+        tool_change=TOOL_CHANGE_TIME,
+    )
+    state = toolpath.MotionState()
+    per_operation = []
+    per_tool = {}
+    tool = None
+    for op in operations:
+        if op.tools:
+            tool = op.tools[-1]
+        seconds = 0.0
+        for table in op.tables:
+            seconds += toolpath.estimate_time(table, machine, state)
+        per_operation.append((op.label, seconds))
+        if tool is not None:
+            per_tool[tool] = per_tool.get(tool, 0.0) + seconds
+
+    total = sum(seconds for _, seconds in per_operation)
+    lines = ["Estimated cycle time: " + format_duration(total)]
+    for label, seconds in per_operation:
+        if seconds > 0:
+            lines.append("  %s: %s" % (label, format_duration(seconds)))
+    for tool, seconds in per_tool.items():
+        lines.append("  T%d: %s" % (int(tool), format_duration(seconds)))
+    return lines
+
+
+def stock_top(operations):
+    """Return the Z of the top of the job's stock in work coordinates, else 0."""
+    for op in operations:
+        job = host.current().find_parent_job(op.obj)
+        stock = getattr(job, "Stock", None)
+        shape = getattr(stock, "Shape", None)
+        if shape is not None:
+            return shape.BoundBox.ZMax
+    return 0.0
+
+
+def envelope_limits(operations):
+    """Return the (x, y, z) corners moves must stay within, in mm.
+
+    X and Y default to the machine corners.  Z is measured from the top of
+    the stock, since jobs usually cut below a work origin there, and by
+    default may go the machine's Z travel either way.
+    """
+    travel = CORNER_MAX["z"] - CORNER_MIN["z"]
+    lower = [CORNER_MIN["x"], CORNER_MIN["y"], -travel]
+    upper = [CORNER_MAX["x"], CORNER_MAX["y"], travel]
+    if ENVELOPE_MIN is not None:
+        lower = list(ENVELOPE_MIN)
+    if ENVELOPE_MAX is not None:
+        upper = list(ENVELOPE_MAX)
+    top = stock_top(operations)
+    lower[2] += top
+    upper[2] += top - ENVELOPE_CLEARANCE
+    return lower, upper
+
+
+def command_text(command):
+    return " ".join(
+        [command.Name]
+        + ["%s%g" % (word, value) for word, value in command.Parameters.items()]
+    )
+
+
+def check_envelope(operations):
+    """Return report lines for moves outside the machine envelope, or []."""
+    lower, upper = envelope_limits(operations)
+    state = toolpath.MotionState()
+    offending = []
+    for op in operations:
+        count = 0
+        first = None
+        offset = 0
+        for table in op.tables:
+            rows, crossed = toolpath.envelope_violations(table, lower, upper, state)
+            if len(rows) and first is None:
+                index = int(rows[0])
+                axes = toolpath.crossed_limits(crossed[0])
+                first = (offset + index, table.command(index), axes)
+            count += len(rows)
+            offset += len(table)
+        if count:
+            offending.append((op.label, count, first))
+    if not offending:
+        return []
+
+    lines = [
+        "%d moves outside the machine envelope X%g..%g Y%g..%g Z%g..%g mm"
+        % (
+            sum(count for _, count, _ in offending),
+            lower[0],
+            upper[0],
+            lower[1],
+            upper[1],
+            lower[2],
+            upper[2],
+        )
+    ]
+    for label, count, (index, command, axes) in offending[:ENVELOPE_REPORT_LIMIT]:
+        lines.append(
+            "  %s: %d, first command %d %s (%s)"
+            % (label, count, index + 1, command_text(command), axes)
+        )
+    if len(offending) > ENVELOPE_REPORT_LIMIT:
+        lines.append(
+            "  and %d more operations" % (len(offending) - ENVELOPE_REPORT_LIMIT)
+        )
+    return lines
+
+
+def generate_gcode(operations, pool=None, notes=(), cache=None):
+    """Yield the complete program for operations one line at a time.
+
+    With a pool from start_format_pool() the operation bodies are formatted
+    by worker processes and stitched back in order.  notes are extra header
+    comments, e.g. what the toolpath stages changed.  With an OperationCache
+    the bodies look_up_operations() found are read back from it and the
+    other keyed ones are stored in it.
+    """
+    global blockDelete
+
+    formatter = CommandFormatter()
+    bodies = format_in_pool(pool, operations) if pool is not None else None
+
+    tool_list = set()
+    for op in operations:
+        tool_list.update(op.tools)
+
     # write header
     if OUTPUT_HEADER:
-        gcode += linenumber() + "(Exported by FreeCAD)\n"
-        gcode += linenumber() + "(Post Processor: " + __name__ + ")\n"
-        gcode += linenumber() + "(Output Time:" + str(now) + ")\n"
+        yield linenumber() + "(Exported by FreeCAD)\n"
+        yield linenumber() + "(Post Processor: " + __name__ + ")\n"
+        yield linenumber() + "(Output Time:" + str(now) + ")\n"
+        for note in notes:
+            yield linenumber() + "(" + note + ")\n"
 
     # Write the preamble
     if OUTPUT_COMMENTS:
-        gcode += linenumber() + "(begin preamble)\n"
+        yield linenumber() + "(begin preamble)\n"
     for line in PREAMBLE.splitlines(False):
-        gcode += linenumber() + line + "\n"
-    gcode += linenumber() + UNITS + "\n"
-
-    for obj in objectslist:
-        # Skip inactive operations
-        if hasattr(obj, "Active"):
-            if not obj.Active:
-                continue
-        if hasattr(obj, "Base") and hasattr(obj.Base, "Active"):
-            if not obj.Base.Active:
-                continue
-
-        for command in PathUtils.getPathWithPlacement(obj).Commands:
-            if "T" in command.Parameters:
-                tool_list.add(command.Parameters["T"])
+        yield linenumber() + line + "\n"
+    yield linenumber() + UNITS + "\n"
 
     # Output the tool list at the beginning of the G-code file
     if len(tool_list) > 0:
-        gcode += linenumber() + "; List of Tools Used:\n"
+        yield linenumber() + "; List of Tools Used:\n"
         for tool in tool_list:
-            gcode += linenumber() + "; Tool: {}\n".format(int(tool))
+            yield linenumber() + "; Tool: {}\n".format(int(tool))
 
     # if len(tool_list) > 0:
     # Ensure that the last tool printed is the first one used
@@ -371,663 +1385,719 @@ def export(objectslist, filename, argstring):
     #        if MEASURE_TOOL:
     #            gcode += "/ " + linenumber() + "M38\n"
 
-    for obj in objectslist:
-        # Skip inactive operations
-        if hasattr(obj, "Active"):
-            if not obj.Active:
-                continue
-        if hasattr(obj, "Base") and hasattr(obj.Base, "Active"):
-            if not obj.Base.Active:
-                continue
-
-        if (
-            hasattr(obj, "BlockDelete")
-            and obj.BlockDelete
-            or hasattr(obj, "Base")
-            and hasattr(obj.Base, "BlockDelete")
-            and obj.Base.BlockDelete
-        ):
-            blockDelete = True
-
-        if blockDelete:
-            gcode += "/ "
+    for op in operations:
+        profile_operation(op.label)
+        blockDelete = op.block_delete
+        prefix = "/ " if blockDelete else ""
 
         # do the pre_op
         if OUTPUT_COMMENTS:
-            gcode += linenumber() + "(begin operation: %s)\n" % obj.Label
-            if blockDelete:
-                gcode += "/ "
-            gcode += linenumber() + "(machine units: %s)\n" % (UNIT_SPEED_FORMAT)
+            yield prefix + linenumber() + "(begin operation: %s)\n" % op.label
+            yield prefix + linenumber() + "(machine units: %s)\n" % UNIT_SPEED_FORMAT
         for line in PRE_OPERATION.splitlines(True):
-            if blockDelete:
-                gcode += "/ "
-            gcode += linenumber() + line
+            yield prefix + linenumber() + line
 
-        # get coolant mode
-        coolantMode = "None"
-        if (
-            hasattr(obj, "CoolantMode")
-            or hasattr(obj, "Base")
-            and hasattr(obj.Base, "CoolantMode")
-        ):
-            if hasattr(obj, "CoolantMode"):
-                coolantMode = obj.CoolantMode
-            else:
-                coolantMode = obj.Base.CoolantMode
+        coolantMode = op.coolant_mode
 
         # turn coolant on if required
         if OUTPUT_COMMENTS:
             if not coolantMode == "None":
-                if blockDelete:
-                    gcode += "/ "
-                gcode += linenumber() + "(Coolant On:" + coolantMode + ")\n"
+                yield prefix + linenumber() + "(Coolant On:" + coolantMode + ")\n"
         if coolantMode == "Flood":
-            if blockDelete:
-                gcode += "/ "
-            gcode += linenumber() + "M8" + "\n"
+            yield prefix + linenumber() + "M8" + "\n"
         if coolantMode == "Mist":
-            if blockDelete:
-                gcode += "/ "
-            gcode += linenumber() + "M7" + "\n"
+            yield prefix + linenumber() + "M7" + "\n"
 
         # process the operation gcode
-        gcode += parse(obj)
+        body = next(bodies) if bodies is not None else None
+        if cache is not None and op.cache_key is not None:
+            body = cached_body(cache, op, body, formatter)
+        if body is not None:
+            yield from body
+        else:
+            for table in op.tables:
+                yield from format_table(table, formatter)
 
         # do the post_op
         if OUTPUT_COMMENTS:
-            if blockDelete:
-                gcode += "/ "
-            gcode += linenumber() + "(finish operation: %s)\n" % obj.Label
+            yield prefix + linenumber() + "(finish operation: %s)\n" % op.label
         for line in POST_OPERATION.splitlines(True):
-            gcode += linenumber() + line
+            yield linenumber() + line
 
         # turn coolant off if required
         if not coolantMode == "None":
             if OUTPUT_COMMENTS:
-                if blockDelete:
-                    gcode += "/ "
-                gcode += linenumber() + "(Coolant Off:" + coolantMode + ")\n"
-
-            if blockDelete:
-                gcode += "/ "
-            gcode += linenumber() + "M9" + "\n"
+                yield prefix + linenumber() + "(Coolant Off:" + coolantMode + ")\n"
+            yield prefix + linenumber() + "M9" + "\n"
 
         blockDelete = False
+    profile_operation(None)
 
     # do the post_amble
     if OUTPUT_COMMENTS:
-        gcode += "(begin postamble)\n"
+        yield "(begin postamble)\n"
     for line in POSTAMBLE.splitlines(True):
-        gcode += linenumber() + line
+        yield linenumber() + line
 
-    gcode = optimize_gcode(gcode, optimize=False, xy_before_z=True)
 
-    if FreeCAD.GuiUp and SHOW_EDITOR:
-        final = gcode
-        if len(gcode) > 200000:
-            print("Skipping editor since output is greater than 100kb")
-        else:
-            dia = PostUtils.GCodeEditorDialog()
-            dia.editor.setText(gcode)
-            result = dia.exec_()
-            if result:
-                final = dia.editor.toPlainText()
-    else:
-        final = gcode
-
-    print("done postprocessing.")
+def write_gcode(lines, stream):
+    """Write lines to stream separated by newlines and return the character count."""
+    written = 0
+    separator = ""
+    for line in lines:
+        stream.write(separator)
+        stream.write(line)
+        written += len(separator) + len(line)
+        separator = "\n"
+    return written
 
-    if not filename == "-":
-        gfile = pythonopen(filename, "w")
-        gfile.write(final)
-        gfile.close()
 
-    if REMOTE_POST:
-        if prompt_and_upload(final, filename):
-            return final
-        else:
-            return final
+def read_gcode(filename):
+    with profile_stage("read"), pythonopen(filename, "r") as gfile:
+        return gfile.read()
 
-    return final
 
+def profile_stage(name):
+    """Profile the with block as stage name when --profile is on."""
+    if PROFILER is None:
+        return contextlib.nullcontext()
+    return PROFILER.stage(name)
 
-def linenumber():
-    global LINENR
-    if OUTPUT_LINE_NUMBERS is True:
-        LINENR += 10
-        return "N" + str(LINENR) + " "
-    return ""
 
+def profile_stream(name, lines, per_operation=False):
+    """Profile producing lines as stage name when --profile is on."""
+    if PROFILER is None:
+        return lines
+    return PROFILER.stream(name, lines, per_operation)
 
-def parse(pathobj):
-    global PRECISION
-    global MODAL
-    global OUTPUT_DOUBLES
-    global UNIT_FORMAT
-    global UNIT_SPEED_FORMAT
-    global blockDelete
 
-    out = ""
-
-    lastcommand = None
-    precision_string = "." + str(PRECISION) + "f"
-    currLocation = {}  # keep track for no doubles
-
-    # the order of parameters
-    # linuxcnc doesn't want K properties on XY plane  Arcs need work.
-    params = [
-        "X",
-        "Y",
-        "Z",
-        "A",
-        "B",
-        "C",
-        "I",
-        "J",
-        "F",
-        "S",
-        "T",
-        "Q",
-        "R",
-        "L",
-        "H",
-        "D",
-        "P",
-    ]
-    firstmove = Path.Command("G0", {"X": -1, "Y": -1, "Z": -1, "F": 0.0})
-    currLocation.update(firstmove.Parameters)  # set First location Parameters
+def profile_operation(label, **counts):
+    """Charge what follows to operation label when --profile is on."""
+    if PROFILER is not None:
+        PROFILER.operation(label, **counts)
 
-    if hasattr(pathobj, "Group"):  # We have a compound or project.
-        # if OUTPUT_COMMENTS:
-        #     out += linenumber() + "(compound: " + pathobj.Label + ")\n"
-        for p in pathobj.Group:
-            out += parse(p)
-        return out
-    else:  # parsing simple path
-        # groups might contain non-path things like stock.
-        if not hasattr(pathobj, "Path"):
-            return out
 
-        # if OUTPUT_COMMENTS:
-        #     out += linenumber() + "(" + pathobj.Label + ")\n"
+def report_profile(profiler, filename):
+    """Print the profile summary and save it next to the output file."""
+    print("\n".join(profiler.summary()))
+    if filename == "-":
+        return
+    base = os.path.splitext(filename)[0]
+    cprofile_file = None
+    if profiler.cprofile is not None:
+        cprofile_file = base + ".prof"
+        profiler.dump_cprofile(cprofile_file)
+        print("cProfile statistics written to " + cprofile_file)
+    profiler.write(base + ".profile.json", filename, cprofile_file)
+    print("Profile written to " + base + ".profile.json")
 
-        for c in PathUtils.getPathWithPlacement(pathobj).Commands:
-            outstring = []
-            if blockDelete:
-                outstring.append("/ ")
 
-            command = c.Name
-            outstring.append(command)
+def linenumber():
+    """Return the line number slot for a new line.
 
-            # if modal: suppress the command if it is the same as the last one
-            if MODAL is True:
-                if command == lastcommand:
-                    outstring.pop(0)
+    The real numbers are filled in by number_lines() once the program is in
+    its final order, so operations can be formatted out of order or in
+    parallel and lines moved by the optimizer still count up.
+    """
+    if OUTPUT_LINE_NUMBERS is True:
+        return LINE_NUMBER_MARK + " "
+    return ""
 
-            if c.Name[0] == "(" and not OUTPUT_COMMENTS:  # command is a comment
-                continue
 
-            # Now add the remaining parameters in order
-            for param in params:
-                if param in c.Parameters:
-                    if param == "F" and (
-                        currLocation[param] != c.Parameters[param] or OUTPUT_DOUBLES
-                    ):
-                        if c.Name not in [
-                            "G0",
-                            "G00",
-                        ]:  # linuxcnc doesn't use rapid speeds
-                            speed = Units.Quantity(
-                                c.Parameters["F"], FreeCAD.Units.Velocity
-                            )
-                            if speed.getValueAs(UNIT_SPEED_FORMAT) > 0.0:
-                                outstring.append(
-                                    param
-                                    + format(
-                                        float(speed.getValueAs(UNIT_SPEED_FORMAT)),
-                                        precision_string,
-                                    )
-                                )
-                        else:
-                            continue
-                    elif param == "T":
-                        outstring.append(param + str(int(c.Parameters["T"])))
-                    elif param == "H":
-                        outstring.append(param + str(int(c.Parameters["H"])))
-                    elif param == "D":
-                        outstring.append(param + str(int(c.Parameters["D"])))
-                    elif param == "S":
-                        outstring.append(param + str(int(c.Parameters["S"])))
-                    else:
-                        if (
-                            (not OUTPUT_DOUBLES)
-                            and (param in currLocation)
-                            and (currLocation[param] == c.Parameters[param])
-                        ):
-                            continue
-                        else:
-                            pos = Units.Quantity(
-                                c.Parameters[param], FreeCAD.Units.Length
-                            )
-                            outstring.append(
-                                param
-                                + format(
-                                    float(pos.getValueAs(UNIT_FORMAT)), precision_string
-                                )
-                            )
-
-            # store the latest command
-            lastcommand = command
-            currLocation.update(c.Parameters)
-
-            # Check for Tool Change:
-            if command == "M6":
-                if blockDelete:
-                    out += "/ "
-
-                # outstring.pop(0)
-
-                # stop the spindle
-
-                out += linenumber() + "M5\n"
-                for line in TOOL_CHANGE.splitlines(True):
-                    out += linenumber() + line
-
-                # outstring.append( "M6".format(int(c.Parameters["T"])) )
-
-                # add height offset
-                if USE_TLO:
-                    tool_height = "G43 H" + str(int(c.Parameters["T"]))
-                    outstring.append(tool_height)
-
-            if command == "message":
-                if OUTPUT_COMMENTS is False:
-                    out = []
+def number_lines(lines):
+    """Replace the line number slots left by linenumber() in output order."""
+    global LINENR
+    if not OUTPUT_LINE_NUMBERS:
+        yield from lines
+        return
+    blocked = "/ " + LINE_NUMBER_MARK
+    for line in lines:
+        if line.startswith(LINE_NUMBER_MARK):
+            LINENR += 10
+            line = "N" + str(LINENR) + line[len(LINE_NUMBER_MARK) :]
+        elif line.startswith(blocked):
+            LINENR += 10
+            line = "/ N" + str(LINENR) + line[len(blocked) :]
+        yield line
+
+
+# the order of parameters
+# linuxcnc doesn't want K properties on XY plane  Arcs need work.
+PARAMETER_ORDER = [
+    "X",
+    "Y",
+    "Z",
+    "A",
+    "B",
+    "C",
+    "I",
+    "J",
+    "F",
+    "S",
+    "T",
+    "Q",
+    "R",
+    "L",
+    "H",
+    "D",
+    "P",
+]
+
+# Size of one output unit expressed in FreeCAD's internal units (mm, mm/s),
+# i.e. what Units.Quantity(unit).Value returns for each UNIT_FORMAT choice.
+UNIT_SCALE = {
+    "mm": 1.0,
+    "in": 25.4,
+    "mm/min": 1.0 / 60.0,
+    "in/min": 25.4 / 60.0,
+}
+
+
+class CommandFormatter:
+    """Parameter word formatter compiled once per export.
+
+    Captures UNITS, PRECISION and OUTPUT_DOUBLES when it is created, converts
+    with plain divisions instead of building a Units.Quantity for every word,
+    and remembers the emission order for every parameter set it has seen so
+    a command only visits the parameters it actually carries.
+    """
+
+    FEED, INTEGER, AXIS = range(3)
+
+    def __init__(self):
+        precision = int(PRECISION)
+        self.output_doubles = OUTPUT_DOUBLES
+        self.length_scale = UNIT_SCALE[UNIT_FORMAT]
+        self.speed_scale = UNIT_SCALE[UNIT_SPEED_FORMAT]
+        self.templates = {
+            param: "%s%%.%df" % (param, precision) for param in PARAMETER_ORDER
+        }
+        self.orders = {}
+
+    def emission_order(self, keys):
+        order = self.orders.get(keys)
+        if order is None:
+            order = []
+            for param in PARAMETER_ORDER:
+                if param not in keys:
+                    continue
+                if param == "F":
+                    kind = self.FEED
+                elif param in ("T", "H", "D", "S"):
+                    kind = self.INTEGER
                 else:
-                    outstring.pop(0)  # remove the command
+                    kind = self.AXIS
+                order.append((param, kind, self.templates[param]))
+            order = tuple(order)
+            self.orders[keys] = order
+        return order
+
+    def words(self, name, parameters, currLocation):
+        """Return the formatted parameter words of one command.
+
+        currLocation holds the previously emitted values and is only read;
+        the caller updates it once the command has been emitted.
+        """
+        words = []
+        output_doubles = self.output_doubles
+        for param, kind, template in self.emission_order(tuple(parameters)):
+            value = parameters[param]
+            if kind == self.AXIS:
+                if (
+                    not output_doubles
+                    and param in currLocation
+                    and currLocation[param] == value
+                ):
+                    continue
+                words.append(template % (value / self.length_scale))
+            elif kind == self.INTEGER:
+                words.append(param + str(int(value)))
+            elif output_doubles or currLocation[param] != value:
+                # linuxcnc doesn't use rapid speeds
+                if name in ("G0", "G00"):
+                    continue
+                speed = value / self.speed_scale
+                if speed > 0.0:
+                    words.append(template % speed)
+        return words
+
+
+def parse(pathobj, formatter=None):
+    """Yield the G-code lines for pathobj, each terminated by a newline."""
+    if formatter is None:
+        formatter = CommandFormatter()
+
+    # if OUTPUT_COMMENTS:
+    #     out += linenumber() + "(compound: " + pathobj.Label + ")\n"
+    for leaf in path_leaves(pathobj):
+        # if OUTPUT_COMMENTS:
+        #     out += linenumber() + "(" + leaf.Label + ")\n"
+        yield from number_lines(
+            parse_commands(host.current().placed_commands(leaf), formatter)
+        )
 
-            # prepend a line number and append a newline
 
-            if len(outstring) >= 1:
-                if OUTPUT_LINE_NUMBERS:
-                    outstring.insert(0, (linenumber()))
+def parse_commands(commands, formatter):
+    """Yield the G-code lines for one list of placed Path commands."""
+    return format_table(toolpath.CommandTable.from_commands(commands), formatter)
+
+
+# Location the doubles suppression starts from, same as
+# Path.Command("G0", ...).Parameters; I and J start out unset
+FIRST_LOCATION = {"X": -1.0, "Y": -1.0, "Z": -1.0, "F": 0.0}
+
+
+def format_table(table, formatter):
+    """Yield the G-code lines for one CommandTable.
+
+    Modal and doubles suppression and unit conversion run on whole columns,
+    and the moves are turned into text with one template per command and
+    word pattern.  Commands with words outside the table columns, tool
+    changes and messages go through format_command() one at a time.
+    """
+    count = len(table)
+    if not count:
+        return
+    names = table.names
+    codes = table.codes
+    values = table.values
+    columns = toolpath.TABLE_WORDS
+
+    # comments are dropped without touching the modal state
+    kept = np.ones(count, bool)
+    if not OUTPUT_COMMENTS:
+        kept = ~table.rows_of([name for name in names if name[0] == "("])
+        values = np.where(kept[:, None], values, np.nan)
+    kept_rows = np.flatnonzero(kept)
+    last_code = np.full(count, -1, np.int32)
+    last_code[kept_rows[1:]] = codes[kept_rows[:-1]]
+    repeated = (last_code == codes) if MODAL else np.zeros(count, bool)
+
+    # what the previous commands left in currLocation, column by column
+    first = [FIRST_LOCATION.get(word, np.nan) for word in columns]
+    location = toolpath.carry_forward(np.vstack((first, values)))[:-1]
+
+    present = ~np.isnan(values)
+    emitted = present if formatter.output_doubles else present & (location != values)
+    scale = np.array([formatter.length_scale] * 5 + [formatter.speed_scale])
+    scaled = values / scale
+    # linuxcnc doesn't use rapid speeds
+    emitted[:, 5] &= ~table.rows_of(toolpath.RAPIDS) & (scaled[:, 5] > 0.0)
+
+    special = table.rows_of(("M6", "message"))
+    special[list(table.side)] = True
+    plain = np.flatnonzero(kept & ~special)
+
+    # group the plain rows by command and emitted words, then fill in one
+    # template per group
+    pattern = (emitted[plain] * (1 << np.arange(len(columns)))).sum(axis=1)
+    keys = (codes[plain].astype(np.int64) << 8) | (repeated[plain] << 7) | pattern
+    order = np.argsort(keys, kind="stable")
+    groups, starts = np.unique(keys[order], return_index=True)
+    lines = [None] * count
+    for key, rows in zip(groups.tolist(), np.split(plain[order], starts[1:])):
+        words = [column for column in range(len(columns)) if key >> column & 1]
+        template = format_template(names[key >> 8], key >> 7 & 1, words, formatter)
+        if template is None:
+            continue
+        texts = fill_template(template, scaled[rows][:, words])
+        for row, text in zip(rows.tolist(), texts):
+            lines[row] = text
+
+    # the few special commands need the complete location, which includes
+    # words only they carry
+    other_words = {}
+    done = 0
+    for row in np.flatnonzero(kept & special).tolist():
+        yield from filter(None, lines[done:row])
+        done = row + 1
+        parameters = table.parameters(row)
+        currLocation = dict(other_words)
+        for word, value in zip(columns, location[row].tolist()):
+            if value == value:  # not NaN
+                currLocation[word] = value
+        last = last_code[row]
+        yield from format_command(
+            names[codes[row]],
+            parameters,
+            names[last] if last >= 0 else None,
+            currLocation,
+            formatter,
+        )
+        other_words.update(
+            (word, value)
+            for word, value in parameters.items()
+            if word not in toolpath.TABLE_COLUMNS
+        )
+    yield from filter(None, lines[done:])
+
+
+# Rows filled in by a single % operation
+FILL_CHUNK = 4096
+
+
+def fill_template(template, values):
+    """Return template % row for every row of values, as lines."""
+    count, width = values.shape
+    if not width:
+        return [template % ()] * count
+    flat = values.ravel().tolist()
+    if len(template.splitlines()) > 1:
+        return [
+            template % tuple(flat[i : i + width]) for i in range(0, len(flat), width)
+        ]
+    lines = []
+    step = FILL_CHUNK * width
+    for start in range(0, len(flat), step):
+        chunk = flat[start : start + step]
+        lines.extend(
+            ((template * (len(chunk) // width)) % tuple(chunk)).splitlines(True)
+        )
+    return lines
+
+
+def format_template(name, repeated, words, formatter):
+    """Return the % template for a plain command, or None if it prints nothing.
+
+    words are the indices of the emitted TABLE_WORDS columns.
+    """
+    outstring = []
+    if blockDelete:
+        outstring.append("/ ")
+    outstring.append(name.replace("%", "%%"))
+    if repeated:
+        outstring.pop(0)
+    outstring.extend(formatter.templates[toolpath.TABLE_WORDS[w]] for w in words)
+    if not outstring:
+        return None
+    if OUTPUT_LINE_NUMBERS:
+        outstring.insert(0, linenumber())
+    return COMMAND_SPACE.join(outstring) + COMMAND_SPACE + "\n"
 
-                # append the line to the final output
-                for w in outstring:
-                    out += w + COMMAND_SPACE
-                # Note: Do *not* strip `out`, since that forces the allocation
-                # of a contiguous string & thus quadratic complexity.
-                out += "\n"
 
-        return out
+def format_command(command, parameters, lastcommand, currLocation, formatter):
+    """Yield the G-code lines for a single command.
 
+    currLocation holds the previously emitted values and lastcommand the
+    name of the previous command, for doubles and modal suppression.
+    """
+    outstring = []
+    if blockDelete:
+        outstring.append("/ ")
 
-def optimize_gcode(gcode_string, optimize=True, xy_before_z=True):
-    lines = gcode_string.strip().split('\n')
-    modified_lines = []
-    i = 0
-    process_moves = False
-    buffer = []  # To store Z moves temporarily
-    last_feed_rate = None  # To store the last feed rate
-    last_z_position = None  # To store the last Z position
+    outstring.append(command)
 
-    while i < len(lines):
-        line = lines[i].strip()
+    # if modal: suppress the command if it is the same as the last one
+    if MODAL is True:
+        if command == lastcommand:
+            outstring.pop(0)
 
-        # Check if the line is a comment
-        is_comment = line.startswith('(') and line.endswith(')')
+    if command[0] == "(" and not OUTPUT_COMMENTS:  # command is a comment
+        return
 
-        # Handle tool change detection
-        if 'M6' in line or ('T' in line and 'M6' in line) and not is_comment:
-            process_moves = True
-            modified_lines.append(line)
-        elif process_moves and xy_before_z:
-            # Handle combined X/Y/Z moves
-            if 'Z' in line and ('X' in line or 'Y' in line) and not is_comment:
-                g_code_prefix = line.split()[0]
-                parts = line.split()
-                xy_parts = ' '.join(
-                    [part for part in parts if 'X' in part or 'Y' in part]
-                )
-                z_part = ' '.join([part for part in parts if 'Z' in part])
-                modified_lines.append(f"{g_code_prefix} {xy_parts}")
-                modified_lines.append(f"{g_code_prefix} {z_part}")
-                process_moves = False
-            elif 'Z' in line and not is_comment:
-                buffer.append(line)
-            elif 'X' in line or 'Y' in line and not is_comment:
-                modified_lines.append(line)
-                modified_lines.extend(buffer)
-                buffer = []
-                process_moves = False
-            else:
-                if line.strip() != '' and line.strip() not in ['G0', 'G1']:
-                    modified_lines.append(line)
-        else:
-            if optimize and not is_comment:
-                if 'F' in line:
-                    feed_rate_index = line.find('F')
-                    if feed_rate_index != -1:
-                        feed_rate = line[feed_rate_index:].split()[0]
-                        current_feed_rate = ''.join(filter(str.isdigit, feed_rate))
-                        if current_feed_rate == last_feed_rate:
-                            line = line.replace(' ' + feed_rate, '')
-                        else:
-                            last_feed_rate = current_feed_rate
-                if 'Z' in line:
-                    z_index = line.find('Z')
-                    if z_index != -1:
-                        z_position = line[z_index:].split()[0]
-                        current_z_position = ''.join(filter(str.isdigit, z_position))
-                        if current_z_position == last_z_position:
-                            line = line.replace(' ' + z_position, '')
-                        else:
-                            last_z_position = current_z_position
-
-            if line.strip() != '' and line.strip() not in ['G0', 'G1']:
-                modified_lines.append(line)
-        i += 1
+    # Now add the remaining parameters in order
+    outstring.extend(formatter.words(command, parameters, currLocation))
 
-    # Append any remaining buffered Z moves
-    if buffer:
-        modified_lines.extend(buffer)
+    # Check for Tool Change:
+    if command == "M6":
+        # outstring.pop(0)
 
-    return '\n'.join(modified_lines)
-
-
-def prompt_username_selection(usernames):
-    global selected_username
-
-    dialog = QtWidgets.QDialog()
-    dialog.setWindowTitle("Select Remote User Folder")
-    # dialog.setMinimumWidth(265)  # Adjusted minimum width to better fit the title
+        # stop the spindle
+        if blockDelete:
+            yield "/ " + linenumber() + "M5\n"
+        else:
+            yield linenumber() + "M5\n"
+        for line in TOOL_CHANGE.splitlines(True):
+            yield linenumber() + line
 
-    # Create layout for the dialog
-    layout = QtWidgets.QVBoxLayout(dialog)
+        # outstring.append( "M6".format(int(c.Parameters["T"])) )
 
-    # Add a label
-    label = QtWidgets.QLabel("Please select your user folder:")
-    layout.addWidget(label)
+        # add height offset
+        if USE_TLO:
+            tool_height = "G43 H" + str(int(parameters["T"]))
+            outstring.append(tool_height)
 
-    # Add a combo box with search functionality
-    combo_box = ComboBoxWithSearch()
-    combo_box.addItem("")  # Add blank entry at the beginning
-    combo_box.addItems(usernames)
+    if command == "message":
+        if OUTPUT_COMMENTS is False:
+            return
+        else:
+            outstring.pop(0)  # remove the command
 
-    # Set the initial value of the combo box to the stored username
-    if selected_username in usernames:
-        combo_box.setCurrentText(selected_username)
+    # prepend a line number and append a newline
 
-    layout.addWidget(combo_box)
+    if len(outstring) >= 1:
+        if OUTPUT_LINE_NUMBERS:
+            outstring.insert(0, (linenumber()))
 
-    # Add the button box with centered buttons
-    button_box = QtWidgets.QDialogButtonBox(
-        QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
-    )
-    button_box.accepted.connect(dialog.accept)
-    button_box.rejected.connect(dialog.reject)
+        # emit the finished line; the caller decides where it goes
+        yield COMMAND_SPACE.join(outstring) + COMMAND_SPACE + "\n"
 
-    # Customize the button text
-    button_box.button(QtWidgets.QDialogButtonBox.Ok).setText("Select")
 
-    # Add button box to layout, center it horizontally
-    layout.addWidget(button_box, alignment=QtCore.Qt.AlignHCenter)
+# One block is split into block delete, words, comments and anything else
+GCODE_TOKEN = re.compile(r"\([^)]*\)?|;.*|/|[A-Za-z][-+.0-9]*|\S+")
 
-    # Set the layout and execute the dialog
-    dialog.setLayout(layout)
+# Straight moves that do nothing without an axis word
+EMPTY_MOVE_CODES = {"G0", "G1"}
+MOTION_CODES = {"G0", "G1", "G2", "G3"}
+PLAIN_MOTION_WORDS = {
+    word: "G" + word[-1]
+    for word in ("G0", "G1", "G2", "G3", "G00", "G01", "G02", "G03")
+}
 
-    if dialog.exec_():
-        # Retrieve the selected username
-        selected_username = combo_box.currentText()
-    else:
-        selected_username = None
-
-    return selected_username
-
-
-class FileManagerDialog(QtWidgets.QDialog):
-    def __init__(self, username, file_content, filename):
-        super().__init__()
-        self.username = username
-        self.file_content = file_content
-        self.filename = filename
-        self.current_path = "/"
-
-        self.setWindowTitle("Select Directory and File Name")
-        self.setLayout(QtWidgets.QVBoxLayout())
-
-        # # Navigate Up Button
-        # self.navigate_up_button = QtWidgets.QPushButton()
-        # self.navigate_up_button.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_ArrowUp))
-        # self.navigate_up_button.setFixedSize(24, 24)  # Button size matches icon size
-        # self.navigate_up_button.clicked.connect(self.navigate_up)
-        # self.layout().addWidget(self.navigate_up_button, alignment=QtCore.Qt.AlignLeft)
-
-        # File Manager Tree View
-        self.file_list = QtWidgets.QTreeView()
-        self.file_list.setRootIsDecorated(False)  # No tree expand/collapse indicators
-        self.file_list.setAlternatingRowColors(True)  # For better row visibility
-        self.file_list.setSelectionBehavior(
-            QtWidgets.QAbstractItemView.SelectRows
-        )  # Row-based selection
-        self.file_list.setEditTriggers(
-            QtWidgets.QAbstractItemView.NoEditTriggers
-        )  # Disable editing
-        self.layout().addWidget(self.file_list)
-
-        # Connect double-click signal to handler
-        self.file_list.doubleClicked.connect(self.handle_item_double_click)
-        self.file_list.clicked.connect(self.handle_single_click)
-
-        # Custom Sort Model for Sorting
-        self.model = QtGui.QStandardItemModel()
-        self.model.setHorizontalHeaderLabels(["Name", "Date Modified", "Size"])
-
-        self.proxy_model = CustomSortModel()
-        self.proxy_model.setSourceModel(self.model)
-        self.file_list.setModel(self.proxy_model)
-
-        self.file_list.setColumnWidth(0, 300)  # Name column
-        self.file_list.setColumnWidth(1, 150)  # Date Modified column
-        self.file_list.setColumnWidth(2, 100)  # Size column
-
-        # Enable sorting and set default sort order
-        self.file_list.setSortingEnabled(True)
-        self.file_list.sortByColumn(
-            1, QtCore.Qt.DescendingOrder
-        )  # Default to sorting by "Date Modified" in descending order
-
-        # File Name Input
-        self.file_name_input = QtWidgets.QLineEdit(self.filename)
-        self.layout().addWidget(QtWidgets.QLabel("File Name:"))
-        self.layout().addWidget(self.file_name_input)
-
-        # Buttons
-        button_box = QtWidgets.QDialogButtonBox(
-            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
-        )
-        button_box.accepted.connect(self.handle_save)
-        button_box.rejected.connect(self.reject)
-        self.layout().addWidget(button_box)
+# Codes after which the last programmed Z can no longer be trusted
+Z_RESET_CODES = {"M6", "G28", "G30", "G43", "G49", "G53", "G92"}
 
-        self.resize(650, 400)  # Initial size of the dialog
-        self.refresh_file_list()
 
-    def fetch_files(self):
-        url = f"{BASE_URL}api/v1/files/list.php"
-        data = {'user': self.username, 'location': self.current_path}
-        try:
-            response = requests.post(url, data=data)
-            response.raise_for_status()
-            data = response.json()
-            if isinstance(data, dict) and 'data' in data:
-                return data['data']
-        except requests.RequestException as e:
-            QtWidgets.QMessageBox.critical(self, "Error", f"Error fetching files: {e}")
-        return {}
-
-    def refresh_file_list(self):
-        self.model.removeRows(0, self.model.rowCount())  # Clear the model
-
-        data = self.fetch_files()
-        if not isinstance(data, dict):
-            QtWidgets.QMessageBox.critical(
-                self, "Error", "Invalid data format received from API."
-            )
-            return
+def word_code(token):
+    """Normalize a G/M word so that e.g. G00 and G0 compare equal."""
+    try:
+        return token[0].upper() + "%g" % float(token[1:])
+    except ValueError:
+        return token
+
+
+def gcode_tokens(line):
+    """Split one block into tokens, keeping comments whole."""
+    if "(" in line or ";" in line:
+        return GCODE_TOKEN.findall(line)
+    return line.split()
+
+
+# What the optimizer cares about in a word, keyed by its letter
+CODE_WORD, Z_WORD, AXIS_WORD, FEED_WORD, PREFIX_WORD = range(5)
+WORD_KINDS = {"/": PREFIX_WORD}
+for _letters, _kind in (
+    ("GM", CODE_WORD),
+    ("Z", Z_WORD),
+    ("XYABCIJKR", AXIS_WORD),
+    ("F", FEED_WORD),
+    ("N", PREFIX_WORD),
+):
+    for _letter in _letters:
+        WORD_KINDS[_letter] = WORD_KINDS[_letter.lower()] = _kind
+
+
+class GCodeBlock:
+    """A tokenized block together with the words the optimizer looks at."""
+
+    __slots__ = ("line", "tokens", "codes", "motion", "feed", "z", "xy", "other")
+
+    def __init__(self, line, tokens, code_cache):
+        self.line = line
+        self.tokens = tokens
+        self.codes = codes = set()
+        self.motion = None  # index of the motion word
+        self.feed = None  # index of the F word
+        self.z = None  # index of the Z word
+        self.xy = False  # any axis word other than Z
+        self.other = False  # anything that keeps an empty move meaningful
+        index = 0
+        for token in tokens:
+            kind = WORD_KINDS.get(token[0])
+            if kind == AXIS_WORD:
+                self.xy = True
+            elif kind == Z_WORD:
+                self.z = index
+            elif kind == CODE_WORD:
+                code = code_cache.get(token)
+                if code is None:
+                    code = code_cache[token] = word_code(token)
+                codes.add(code)
+                if code in MOTION_CODES:
+                    self.motion = index
+                else:
+                    self.other = True
+            elif kind == FEED_WORD:
+                self.feed = index
+            elif kind is None:
+                self.other = True
+            index += 1
 
-        dirs = data.get('dirs', [])
-        files = data.get('files', [])
+    def without(self, *indices):
+        tokens = [t for i, t in enumerate(self.tokens) if i not in indices]
+        return " ".join(tokens), tokens
 
-        folder_icon = self.style().standardIcon(QtWidgets.QStyle.SP_DirIcon)
-        file_icon = self.style().standardIcon(QtWidgets.QStyle.SP_FileIcon)
 
-        # Add "Navigate Up" row if not at the root level
-        if self.current_path != "/":
-            navigate_up_item = QtGui.QStandardItem(folder_icon, "..")
-            navigate_up_item.setEditable(False)
-            self.model.appendRow(
-                [navigate_up_item, QtGui.QStandardItem(""), QtGui.QStandardItem("")]
-            )
+def optimize_gcode(gcode_string, optimize=True, xy_before_z=True):
+    return '\n'.join(
+        optimize_lines(
+            gcode_string.strip().split('\n'),
+            optimize=optimize,
+            xy_before_z=xy_before_z,
+        )
+    )
 
-        # Sort directories alphabetically
-        dirs.sort(key=str.lower)
 
-        # Add directories
-        for directory in dirs:
-            folder_item = QtGui.QStandardItem(folder_icon, directory)
-            folder_item.setEditable(False)
-            # Size column intentionally left empty for folders
-            self.model.appendRow(
-                [folder_item, QtGui.QStandardItem(""), QtGui.QStandardItem("")]
-            )
+def optimize_lines(lines, optimize=True, xy_before_z=True):
+    """Single pass G-code optimizer working on tokenized blocks.
+
+    Consumes lines and yields stripped lines, so it can sit anywhere in a
+    streaming pipeline.  After a tool change, rapid Z-only moves are held
+    back until the first XY rapid and a combined XYZ rapid is split into XY
+    then Z (xy_before_z).  With optimize, F and Z words repeating the modal
+    value are dropped.  Straight moves left without any axis word are always
+    removed; their motion word is carried over to the next move that relies
+    on it so modal output stays correct.
+    """
+    code_cache = {}
+    after_tool_change = False
+    deferred = []  # Z-only rapids held back until the first XY rapid
+    last_feed = None
+    last_z = None
+    absolute = True
+    motion = None  # motion code of the last emitted block
+    pending_motion = None  # motion word of a dropped empty move
+
+    def block(line, tokens=None):
+        if tokens is None:
+            tokens = gcode_tokens(line)
+        return GCodeBlock(line, tokens, code_cache)
+
+    def finish(b):
+        """Apply the modal bookkeeping to a block and return its text or None."""
+        nonlocal last_feed, last_z, absolute, motion, pending_motion
+
+        codes = b.codes
+        if codes:
+            if "G90" in codes:
+                absolute = True
+            if "G91" in codes:
+                absolute = False
+            if not codes.isdisjoint(Z_RESET_CODES):
+                last_z = None
+
+        dropped = []
+        if b.feed is not None:
+            feed = b.tokens[b.feed][1:]
+            if optimize and feed == last_feed:
+                dropped.append(b.feed)
+            else:
+                last_feed = feed
+        if b.z is not None:
+            z = b.tokens[b.z][1:]
+            if optimize and absolute and z == last_z:
+                dropped.append(b.z)
+            else:
+                last_z = z if absolute else None
+
+        line = b.line
+        tokens = b.tokens
+        if dropped:
+            line, tokens = b.without(*dropped)
+        has_feed = b.feed is not None and b.feed not in dropped
+        has_axis = b.xy or (b.z is not None and b.z not in dropped)
+
+        if b.motion is not None:
+            block_motion = code_cache[b.tokens[b.motion]]
+            # drop straight moves that are left without anything to do
+            if (
+                not has_axis
+                and not has_feed
+                and not b.other
+                and block_motion in EMPTY_MOVE_CODES
+            ):
+                if block_motion != motion:
+                    pending_motion = b.tokens[b.motion]
+                return None
+            motion = block_motion
+            pending_motion = None
+        elif pending_motion is not None and has_axis:
+            position = 0
+            while position < len(tokens) and tokens[position][0] in "/Nn":
+                position += 1
+            tokens = tokens[:position] + [pending_motion] + tokens[position:]
+            line = " ".join(tokens)
+            motion = code_cache[pending_motion]
+            pending_motion = None
+        return line
+
+    def release(blocks):
+        for b in blocks:
+            line = finish(b)
+            if line is not None:
+                yield line
+
+    for line in lines:
+        line = line.strip()
+        if line == '':
+            continue
+
+        # Fast path: plain motion blocks outside the tool change approach.
+        # Without optimize nothing but the modal motion needs tracking.
+        if (
+            not optimize
+            and not after_tool_change
+            and not deferred
+            and "(" not in line
+            and ";" not in line
+            and "M" not in line
+            and "m" not in line
+        ):
+            tokens = line.split()
+            if len(tokens) > 1 and tokens[0] in PLAIN_MOTION_WORDS:
+                motion = PLAIN_MOTION_WORDS[tokens[0]]
+                pending_motion = None
+                yield line
+                continue
+            b = block(line, tokens)
+        else:
+            b = block(line)
 
-        # Add files
-        for file in files:
-            name = file.get('name', 'Unknown')
-            date = file.get('date', '')
-            time = file.get('time', '')
-            size = file.get('size', '')
-
-            date_modified = f"{date} {time}".strip()
-
-            file_item = QtGui.QStandardItem(file_icon, name)
-            file_item.setEditable(False)
-            date_item = QtGui.QStandardItem(date_modified)
-            size_str = file.get('size', '')
-            # Add space between digits and size indicator
-            size_str = re.sub(r'(\d)([a-zA-Z])', r'\1 \2', size_str.strip())
-            # size_str = re.sub(r'(\d)([a-zA-Z])', r'\1 \2', size_str.strip()).lower().replace('b', 'bytes')
-            size_str = re.sub(
-                r'\bB\b', 'bytes', size_str
-            )  # Replace standalone 'B' with 'BYTES'
-            size_item = QtGui.QStandardItem(size_str)
-            self.model.appendRow([file_item, date_item, size_item])
-
-        self.file_list.clearSelection()
-        self.file_name_input.setFocus()
-
-    def handle_item_double_click(self, index):
-        source_index = self.proxy_model.mapToSource(
-            index
-        )  # Map proxy index to source model index
-        row = source_index.row()  # Get the row number
-
-        # Retrieve the first column item (representing the main identifier, e.g., folder or file name)
-        item = self.model.item(
-            row, 0
-        )  # Assuming column 0 is where the main name or ".." resides
-        if not item:
-            return
+        # Handle tool change detection
+        if "M6" in b.codes:
+            yield from release(deferred)
+            deferred = []
+            after_tool_change = xy_before_z
+        elif after_tool_change and (b.xy or b.z is not None):
+            if b.motion is not None:
+                rapid = code_cache[b.tokens[b.motion]] == "G0"
+            else:
+                rapid = motion == "G0"
+            if not rapid:
+                # a cutting move ends the approach; keep everything in order
+                after_tool_change = False
+            elif not b.xy:
+                deferred.append(b)
+                continue
+            else:
+                after_tool_change = False
+                if b.z is None:
+                    blocks = [b]
+                else:
+                    # Handle combined X/Y/Z moves
+                    blocks = [block(*b.without(b.z))]
+                    keep = [
+                        i
+                        for i, token in enumerate(b.tokens)
+                        if token != "/" and i != b.motion and i != b.z
+                    ]
+                    z_block = block(*b.without(*keep))
+                yield from release(blocks + deferred)
+                deferred = []
+                if b.z is not None:
+                    yield from release([z_block])
+                continue
 
-        item_name = item.text()
+        if deferred and not after_tool_change:
+            yield from release(deferred)
+            deferred = []
 
-        # Check if it's the "Navigate Up" row
-        if item_name == "..":
-            if self.current_path != "/":
-                self.current_path = os.path.dirname(self.current_path.rstrip("/"))
-                if not self.current_path:
-                    self.current_path = "/"
-                self.refresh_file_list()
-        else:
-            # Handle folder or file selection
-            # Assume column 2 contains the "Date Modified" to differentiate folders from files
-            is_folder = not self.model.item(row, 1).text()
-            if is_folder:
-                self.current_path = os.path.join(self.current_path, item_name).replace(
-                    "\\", "/"
-                )
-                self.refresh_file_list()
-            else:
-                self.file_name_input.setText(item_name)
-                self.handle_save()
-
-    def handle_single_click(self, index):
-        source_index = self.proxy_model.mapToSource(
-            index
-        )  # Map proxy index to source model index
-        row = source_index.row()  # Get the row number
-
-        # Retrieve the first column item (representing the main identifier, e.g., folder or file name)
-        item = self.model.item(
-            row, 0
-        )  # Assuming column 0 is where the main name or ".." resides
-        if not item:
-            return
+        line = finish(b)
+        if line is not None:
+            yield line
 
-        item_name = item.text()
-
-        # Handle folder or file selection
-        # Assume column 2 contains the "Date Modified" to differentiate folders from files
-        is_folder = not self.model.item(row, 1).text()
-        if not is_folder:
-            self.file_name_input.setText(item_name)
-            self.file_name_input.setFocus()
-
-    def navigate_up(self):
-        if self.current_path != "/":
-            self.current_path = os.path.dirname(self.current_path.rstrip("/"))
-            if not self.current_path:
-                self.current_path = "/"
-            self.refresh_file_list()
-
-    def prompt_overwrite(self):
-        response = QtWidgets.QMessageBox.question(
-            self,
-            "Overwrite File",
-            "File already exists. Do you want to overwrite it?",
-            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-        )
-        if response == QtWidgets.QMessageBox.Yes:
-            self.accept()
-
-    def handle_save(self):
-        proxy_model = self.file_list.model()  # Get the proxy model
-        source_model = proxy_model.sourceModel()  # Access the underlying source model
-        root_node = (
-            source_model.invisibleRootItem()
-        )  # Get the root node of the source model
-        number_of_files = root_node.rowCount()
-
-        existing_files = []
-        for i in range(number_of_files):
-            file_item = root_node.child(
-                i, 0
-            )  # Assuming file names are in the second column
-            if file_item:
-                file_name = file_item.text()
-                existing_files.append(file_name)
-
-        input_file_name = self.file_name_input.text()
-        if input_file_name in existing_files:
-            self.prompt_overwrite()
-        else:
-            self.accept()
+    # Append any remaining buffered Z moves
+    yield from release(deferred)
 
 
 def prompt_and_upload(file_content, filename):
     # app = QtWidgets.QApplication([])
 
+    if not dialogs_enabled():
+        return upload_unattended(file_content, filename)
+
+    import NibblerBOT_dialogs as dialogs
+
     usernames = fetch_usernames()
     if not usernames:
         print("Error fetching usernames or no usernames available.")
@@ -1036,7 +2106,7 @@ def prompt_and_upload(file_content, filename):
     # Prompt for username
     # username = simpledialog.askstring("Input", "Please enter your username:", parent=root)
     if JOB_AUTHOR == "":
-        username = prompt_username_selection(usernames)
+        username = dialogs.prompt_username_selection(usernames)
     else:
         username = JOB_AUTHOR
 
@@ -1044,14 +2114,16 @@ def prompt_and_upload(file_content, filename):
         print("No username provided. Upload cancelled.")
         return False
 
-    filename = FreeCAD.ActiveDocument.FileName
+    filename = host.current().document_filename()
     filename = filename.split('/')[-1] if '/' in filename else filename.split('\\')[-1]
     if filename.endswith('.FCStd'):
         filename = filename.replace('.FCStd', '.ngc')
 
     print("Filename:", filename)
 
-    dialog = FileManagerDialog(username, file_content, filename)
+    dialog = dialogs.FileManagerDialog(
+        remote_client(), username, file_content, filename
+    )
     if dialog.exec_():
         selected_path = dialog.current_path
         selected_file_name = dialog.file_name_input.text()
@@ -1059,161 +2131,104 @@ def prompt_and_upload(file_content, filename):
             print("No file name provided. Upload cancelled.")
             return False
 
-        response = upload_file(
-            username, file_content, selected_file_name, selected_path
+        # the transfer runs in the background so FreeCAD stays usable
+        progress = dialogs.UploadProgress(
+            selected_file_name, remote_client(), queue_upload, report_latency
         )
-        if response.status_code == 200:
-            print("Upload successful!")
-            return True
-        else:
-            print("Upload failed!", response.status_code, response.text)
-            return False
+        progress.start(
+            username, file_content, selected_path, COMPRESS_UPLOAD, DELTA_UPLOAD
+        )
+        return True
 
 
-def upload_file(username, file_content, filename, path):
-    url = f"{BASE_URL}api/v1/plugins/upload"
-    files = {'fileUpload': (filename, file_content, 'text/plain')}
-    data = {
-        'user': username,
-        'location': path,
-        'uploader': 'direct',
-        'filename': filename,
-        'config': '{}',
-        'options': '{}',
-    }
-    return requests.post(url, files=files, data=data)
+def upload_unattended(file_content, filename):
+    """Upload without any dialog using --job-author and --remote-path."""
+    if not JOB_AUTHOR:
+        print("No job author given. Upload skipped.")
+        return False
 
+    if filename == "-":
+        filename = host.current().document_filename() or "untitled.ngc"
+    filename = os.path.basename(filename.replace('\\', '/'))
+    if filename.endswith('.FCStd'):
+        filename = filename.replace('.FCStd', '.ngc')
+    path = REMOTE_PATH or "/"
+
+    print("Uploading", filename, "to", JOB_AUTHOR + ":" + path)
+    import requests
 
-def fetch_usernames():
-    url = f"{BASE_URL}api/v1/users/list"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if data['status'] == 1:
-            return data['data']
+        response = upload_file(JOB_AUTHOR, file_content, filename, path)
     except requests.RequestException as e:
-        print(f"Error fetching usernames: {e}")
-    return []
-
-
-class CustomSortModel(QtCore.QSortFilterProxyModel):
-    def __init__(self, sort_column=1, *args, **kwargs):  # Default sort by name
-        super(CustomSortModel, self).__init__(*args, **kwargs)
-        self.sort_column = 1  # Default sort by name
-
-    def sort(self, column, order=QtCore.Qt.AscendingOrder):
-        self.sort_column = column
-        super().sort(column, order)  # Call
-
-    def lessThan(self, left, right):
-        # Check if the item is a folder or a file based on the 'Date Modified' (typically, folders might have this empty)
-        left_date = self.sourceModel().data(
-            left.sibling(left.row(), 1), QtCore.Qt.DisplayRole
-        )
-        right_date = self.sourceModel().data(
-            right.sibling(right.row(), 1), QtCore.Qt.DisplayRole
-        )
-
-        left_is_folder = not left_date
-        right_is_folder = not right_date
-
-        # Folders come before files
-        if left_is_folder or right_is_folder:
-            return False
-
-        # Sorting by the designated column when both are either files or folders
-        if self.sort_column == 0:  # Sort by name
-            left_data = self.sourceModel().data(
-                left.sibling(left.row(), 0), QtCore.Qt.DisplayRole
-            )
-            right_data = self.sourceModel().data(
-                right.sibling(right.row(), 0), QtCore.Qt.DisplayRole
-            )
-        elif self.sort_column == 1:  # Sort by date
-            left_data = QtCore.QDateTime.fromString(left_date, "yyyy-MM-dd HH:mm:ss")
-            right_data = QtCore.QDateTime.fromString(right_date, "yyyy-MM-dd HH:mm:ss")
-        elif self.sort_column == 2:  # Sort by size
-            left_data = self.extract_size(
-                self.sourceModel().data(
-                    left.sibling(left.row(), 2), QtCore.Qt.DisplayRole
-                )
-            )
-            right_data = self.extract_size(
-                self.sourceModel().data(
-                    right.sibling(right.row(), 2), QtCore.Qt.DisplayRole
-                )
-            )
-        else:
-            return False  # Default fallback
-
-        return left_data < right_data
-
-    def extract_size(self, size_str):
-        if not size_str:
-            return 0  # Assume empty or 'N/A' for folders
-
-        size_str = size_str.strip().upper()
-        if 'KB' in size_str:
-            return float(size_str.replace('KB', '').strip()) * 1024
-        elif 'MB' in size_str:
-            return float(size_str.replace('MB', '').strip()) * 1024 * 1024
-        elif 'GB' in size_str:
-            return float(size_str.replace('GB', '').strip()) * 1024 * 1024 * 1024
-        elif 'TB' in size_str:
-            return float(size_str.replace('TB', '').strip()) * 1024 * 1024 * 1024 * 1024
-        elif 'BYTES' in size_str:
-            return float(size_str.replace('BYTES', '').strip())
-        else:
-            return float(size_str)  # Assume bytes if no unit is specified
+        print(f"Upload failed! {e}")
+        return queue_upload(JOB_AUTHOR, file_content, filename, path, e)
+    finally:
+        report_latency()
+    if response.status_code == 200:
+        print("Upload successful!")
+        return True
+    print("Upload failed!", response.status_code, response.text)
+    return queue_upload(JOB_AUTHOR, file_content, filename, path, response=response)
+
+
+def queue_upload(username, file_content, filename, path, error=None, response=None):
+    """Keep an upload that failed because the server is away in the outbox.
+
+    Returns True if it was queued; it is then sent in the background as soon
+    as the server answers again.
+    """
+    client = remote_client()
+    if client.outbox is None or not client.server_offline(error, response):
+        return False
+    if error is None:
+        error = f"{response.status_code} {response.reason}"
+    else:
+        error = type(error).__name__
+    client.queue_upload(username, file_content, filename, path, COMPRESS_UPLOAD, error)
+    print(f"Queued {filename} in the outbox, it is sent once the server is back.")
+    return True
 
 
-class ComboBoxWithSearch(QtWidgets.QComboBox):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.setEditable(True)
-        self.setInsertPolicy(QtWidgets.QComboBox.NoInsert)
+def report_outbox():
+    """Show what the outbox still holds and try to deliver it."""
+    client = remote_client()
+    if client.outbox is None:
+        return
+    lines = client.outbox.status()
+    if lines:
+        print(f"{len(lines)} upload(s) in the outbox:")
+        for line in lines:
+            print("  " + line)
+        client.start_flusher()
 
-        self.completer = QtWidgets.QCompleter(self)
-        self.setCompleter(self.completer)
-        self.completer.setCompletionMode(QtWidgets.QCompleter.PopupCompletion)
 
-        self.set_model(QtGui.QStandardItemModel())
-        self.completer.setModel(self.model())
+def remote_client():
+    """Return the shared client for BASE_URL with this post's timeouts."""
+    import NibblerBOT_remote as remote
 
-    def set_model(self, model):
-        self.clear()
-        self.setModel(model)
+    client = remote.shared_client(BASE_URL)
+    cache_dir = os.path.join(host.current().user_data_dir(), "NibblerBOT")
+    client.configure(CONNECT_TIMEOUT, READ_TIMEOUT, RETRIES, cache_dir)
+    return client
 
-    def addItems(self, items):
-        for item in items:
-            self.addItem(item)
 
+def report_latency():
+    print("Server latency:")
+    for line in remote_client().report():
+        print("  " + line)
 
-class DustCollectionOptionsDialog(QtWidgets.QDialog):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Dust Collection Options")
-        self.setLayout(QtWidgets.QVBoxLayout())
 
-        self.start_checkbox = QtWidgets.QCheckBox(
-            "Turn Dust Collection ON at Start (M208)"
-        )
-        self.start_checkbox.setChecked(True)
-        self.layout().addWidget(self.start_checkbox)
+def upload_file(username, file_content, filename, path):
+    return remote_client().upload(
+        username, file_content, filename, path, COMPRESS_UPLOAD, delta=DELTA_UPLOAD
+    )
 
-        self.end_checkbox = QtWidgets.QCheckBox(
-            "Turn Dust Collection OFF at End (M209)"
-        )
-        self.end_checkbox.setChecked(False)
-        self.layout().addWidget(self.end_checkbox)
 
-        button_box = QtWidgets.QDialogButtonBox(
-            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
-        )
-        button_box.accepted.connect(self.accept)
-        button_box.rejected.connect(self.reject)
-        self.layout().addWidget(button_box)
+def fetch_usernames():
+    import requests
 
-    def get_options(self):
-        return self.start_checkbox.isChecked(), self.end_checkbox.isChecked()
+    try:
+        return remote_client().usernames()
+    except requests.RequestException as e:
+        print(f"Error fetching usernames: {e}")
+    return []
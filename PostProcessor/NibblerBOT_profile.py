@@ -0,0 +1,265 @@
+"""Stage and operation profile of one export, for --profile.
+
+PostProfiler splits the run into stages, e.g. collect, tabulate or upload,
+and into operations.  Time goes to the innermost open stage and the current
+operation, so nested and streamed stages are not counted twice: the output
+stages hand lines to each other one at a time and each only gets the time
+spent in its own code.  Peak traced memory comes from tracemalloc, lines
+and bytes from the streams, and optionally the whole run is wrapped in
+cProfile.  Only the standard library is used.
+"""
+
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+# Functions listed in the console summary of a cProfile run
+CPROFILE_TOP = 15
+
+
+class StageRecord:
+    __slots__ = ("name", "seconds", "wall", "lines", "bytes", "peak", "streamed")
+
+    def __init__(self, name, streamed=False):
+        self.name = name
+        self.seconds = 0.0  # spent in the stage itself
+        self.wall = 0.0  # from entering to leaving, nested stages included
+        self.lines = 0
+        self.bytes = 0
+        self.peak = None  # bytes traced at most, not kept for streams
+        self.streamed = streamed
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class OperationRecord:
+    __slots__ = ("label", "counts", "seconds", "lines", "bytes", "peak")
+
+    def __init__(self, label):
+        self.label = label
+        self.counts = {}  # e.g. placed and tabulated commands
+        self.seconds = {}  # stage name -> seconds
+        self.lines = 0
+        self.bytes = 0
+        self.peak = None
+
+    def as_dict(self):
+        record = {name: getattr(self, name) for name in self.__slots__}
+        record["total_seconds"] = sum(self.seconds.values())
+        return record
+
+
+class PostProfiler:
+    """Collects the profile of one export.
+
+    Use running() around the run, stage() around each stage, stream() on
+    each stage that yields lines and operation() whenever work for another
+    operation starts.  tracemalloc slows posting down about tenfold, so
+    memory can be left out when only the times matter.
+    """
+
+    def __init__(self, memory=True, use_cprofile=False):
+        self.stages = {}
+        self.operations = {}
+        self.stack = [self.record("other")]  # open stages, innermost last
+        self.current = None  # OperationRecord being worked on
+        self.counted = None  # stream whose lines count for the operations
+        self.marks = {}  # stage totals when the current operation started
+        self.windows = []  # stages and operations whose peak is tracked
+        self.memory = memory
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+        self.started_tracing = False
+        self.last = None
+        self.seconds = 0.0
+        self.peak = None
+
+    @contextlib.contextmanager
+    def running(self):
+        if self.memory:
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.peak = 0
+        start = self.last = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        try:
+            yield self
+        finally:
+            if self.cprofile is not None:
+                self.cprofile.disable()
+            self.operation(None)
+            self.seconds = time.perf_counter() - start
+            if self.started_tracing:
+                tracemalloc.stop()
+
+    def record(self, name, streamed=False):
+        if name not in self.stages:
+            self.stages[name] = StageRecord(name, streamed)
+        return self.stages[name]
+
+    def credit(self):
+        """Give the time since the last event to the innermost stage."""
+        now = time.perf_counter()
+        self.stack[-1].seconds += now - self.last
+        self.last = now
+
+    def fold_peak(self):
+        """Hand the peak since the last fold to every tracked window."""
+        if not self.memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        for window in self.windows:
+            window.peak = max(window.peak or 0, peak)
+        self.peak = max(self.peak, peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = self.record(name)
+        self.credit()
+        self.fold_peak()
+        self.stack.append(record)
+        self.windows.append(record)
+        start = self.last
+        try:
+            yield record
+        finally:
+            self.credit()
+            self.fold_peak()
+            self.windows.remove(record)
+            self.stack.pop()
+            record.wall += self.last - start
+
+    def stream(self, name, lines, per_operation=False):
+        """Yield lines, timing the work of producing each one as stage name.
+
+        This runs for every line of the program, so it keeps to the bare
+        minimum.  With per_operation the lines and bytes of this stream are
+        the ones counted for each operation.
+        """
+        record = self.record(name, streamed=True)
+        if per_operation:
+            self.counted = record
+        clock = time.perf_counter
+        stack = self.stack
+        self.credit()
+        stack.append(record)
+        try:
+            for line in lines:
+                now = clock()
+                record.seconds += now - self.last
+                self.last = now
+                stack.pop()
+                record.lines += 1
+                record.bytes += len(line)
+                yield line
+                now = clock()
+                stack[-1].seconds += now - self.last
+                self.last = now
+                stack.append(record)
+        finally:
+            if stack[-1] is record:  # not when closed while at the yield
+                self.credit()
+                stack.pop()
+
+    def operation(self, label, **counts):
+        """Start charging to operation label, None for the program itself.
+
+        What an operation spent is the difference of the stage totals
+        between its start and the next call.
+        """
+        current = self.current
+        if current is not None and current.label == label:
+            current.counts.update(counts)
+            return
+        self.credit()
+        self.fold_peak()
+        if current is not None:
+            for record in self.stages.values():
+                seconds, lines, size = self.marks.get(record.name, (0.0, 0, 0))
+                if record.seconds > seconds:
+                    spent = current.seconds.get(record.name, 0.0)
+                    current.seconds[record.name] = spent + record.seconds - seconds
+                if record is self.counted:
+                    current.lines += record.lines - lines
+                    current.bytes += record.bytes - size
+            self.windows.remove(current)
+        self.current = None
+        if label is None:
+            return
+        if label not in self.operations:
+            self.operations[label] = OperationRecord(label)
+        self.current = self.operations[label]
+        self.current.counts.update(counts)
+        self.windows.append(self.current)
+        self.marks = {
+            record.name: (record.seconds, record.lines, record.bytes)
+            for record in self.stages.values()
+        }
+
+    def report(self, filename=None, cprofile_file=None):
+        """Return the profile as a dict ready for json."""
+        return {
+            "file": filename,
+            "seconds": self.seconds,
+            "peak": self.peak,
+            "stages": [record.as_dict() for record in self.stages.values()],
+            "operations": [record.as_dict() for record in self.operations.values()],
+            "cprofile": cprofile_file,
+        }
+
+    def write(self, path, filename=None, cprofile_file=None):
+        with open(path, "w") as file:
+            json.dump(self.report(filename, cprofile_file), file, indent=1)
+
+    def dump_cprofile(self, path):
+        self.cprofile.dump_stats(path)
+
+    def summary(self, slowest=5):
+        """Return console lines: stages, the slowest operations, cProfile."""
+        lines = ["Profile: %.2f s%s" % (self.seconds, megabytes(self.peak, " traced"))]
+        for record in self.stages.values():
+            line = "  %-10s %8.3f s" % (record.name, record.seconds)
+            if record.wall > record.seconds + 0.0005:
+                line += " (%.3f s with nested stages)" % record.wall
+            if record.lines:
+                line += ", %d lines, %d bytes" % (record.lines, record.bytes)
+            lines.append(line + megabytes(record.peak))
+        operations = sorted(
+            self.operations.values(), key=lambda r: -sum(r.seconds.values())
+        )
+        if operations:
+            lines.append("Slowest operations:")
+        for record in operations[:slowest]:
+            stages = sorted(record.seconds.items(), key=lambda item: -item[1])
+            lines.append(
+                "  %s: %.3f s (%s), %d lines%s"
+                % (
+                    record.label,
+                    sum(record.seconds.values()),
+                    ", ".join("%s %.3f" % item for item in stages[:3]),
+                    record.lines,
+                    megabytes(record.peak),
+                )
+            )
+        if self.cprofile is not None:
+            text = io.StringIO()
+            stats = pstats.Stats(self.cprofile, stream=text)
+            stats.sort_stats("cumulative").print_stats(CPROFILE_TOP)
+            lines.append("cProfile, by cumulative time:")
+            lines.extend("  " + line for line in text.getvalue().splitlines() if line)
+        return lines
+
+
+def megabytes(peak, suffix=""):
+    """Format a traced peak for the summary, nothing if memory was off."""
+    if peak is None:
+        return ""
+    return ", peak %.1f MB%s" % (peak / (1 << 20), suffix)
@@ -0,0 +1,967 @@
+"""HTTP client for the NibblerBOT server.
+
+FreeCAD reloads the post processor for every post, so the client lives in
+this module instead: one RemoteClient per server keeps its pooled
+keep-alive connections, learned capabilities and latency numbers for the
+whole FreeCAD session.  Nothing here needs FreeCAD or Qt.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import os
+import posixpath
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+USERS_ENDPOINT = "api/v1/users/list"
+LIST_ENDPOINT = "api/v1/files/list.php"
+UPLOAD_ENDPOINT = "api/v1/plugins/upload"
+SIGNATURE_ENDPOINT = "api/v1/files/signature.php"
+
+# Header of the upload endpoint's OPTIONS response that offers delta uploads;
+# without it SIGNATURE_ENDPOINT is never asked
+DELTA_HEADER = "X-NibblerBOT-Delta"
+
+# Responses worth another try on calls that are safe to repeat
+RETRY_STATUS = {502, 503, 504}
+
+# The user list rarely changes; after this many seconds it is revalidated
+USERS_TTL = 15 * 60
+
+# Folder listings change whenever someone uploads, so they are kept briefly
+LISTING_TTL = 30
+# Folders next to the open one loaded ahead of a double-click
+MAX_PREFETCH = 8
+
+# Failures that mean the server is away rather than that the upload is bad
+OFFLINE_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+# Queued uploads are retried this many at a time, concurrently
+OUTBOX_BATCH = 8
+# Seconds between outbox flushes, doubled while the server stays away
+FLUSH_INTERVAL = 15
+MAX_FLUSH_INTERVAL = 5 * 60
+# An upload the server keeps rejecting is given up after this many tries
+MAX_ATTEMPTS = 5
+# A claim older than this belongs to a FreeCAD that died mid-upload
+STALE_CLAIM = 10 * 60
+
+
+def zstd_compressor():
+    try:
+        from compression import zstd  # Python 3.14+
+
+        return zstd.compress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress
+    except ImportError:
+        return None
+
+
+# Request content codings this client can send, best first
+UPLOAD_COMPRESSORS = {}
+if zstd_compressor() is not None:
+    UPLOAD_COMPRESSORS["zstd"] = zstd_compressor()
+# level 6 keeps nearly all of the ratio of 9 at a quarter of the time
+UPLOAD_COMPRESSORS["gzip"] = lambda data: gzip.compress(data, compresslevel=6)
+
+
+# Delta uploads: blocks are about the square root of the file size, and a
+# delta is only sent when it is clearly smaller than the file
+MIN_BLOCK_SIZE = 512
+DELTA_WORTHWHILE = 0.5
+
+
+def delta_block_size(size):
+    return max(MIN_BLOCK_SIZE, int(math.sqrt(size)))
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=8).hexdigest()
+
+
+def weak_checksums(data, block_size):
+    """Return the rsync rolling checksum of every block_size window of data.
+
+    Entry k covers data[k:k + block_size].  With a the sum of the bytes and b
+    the sum of (block_size - i) * byte i, the checksum is a + 2**16 * b, each
+    mod 2**16.  Prefix sums give every window at once instead of rolling the
+    sums along byte by byte; they may wrap around in uint32 since only the
+    low 16 bits are kept.
+    """
+    x = np.frombuffer(data, np.uint8).astype(np.uint32)
+    count = len(x) - block_size + 1
+    if count <= 0:
+        return np.zeros(0, np.uint32)
+    k = np.arange(len(x), dtype=np.uint32)
+    s = np.zeros(len(x) + 1, np.uint32)
+    np.cumsum(x, out=s[1:])
+    t = np.zeros(len(x) + 1, np.uint32)
+    np.cumsum(x * k, out=t[1:])
+    a = s[block_size:] - s[:count]
+    b = (k[:count] + np.uint32(block_size)) * a - (t[block_size:] - t[:count])
+    return (a & 0xFFFF) | ((b & 0xFFFF) << 16)
+
+
+def block_signatures(data, block_size):
+    """Return [weak, strong] for every whole block of data.
+
+    This is what a server answers for its copy of a file; make_delta
+    matches the new content against it.
+    """
+    weak = weak_checksums(data, block_size)
+    return [
+        [int(weak[start]), strong_checksum(data[start : start + block_size])]
+        for start in range(0, len(data) - block_size + 1, block_size)
+    ]
+
+
+def make_delta(data, blocks, block_size):
+    """Return (ops, literals) that rebuild data from the blocks of a file.
+
+    ops is a list of ["copy", first block, block count] and ["data", length]
+    steps; the data steps take their bytes from literals in turn.  Only
+    windows whose weak checksum matches some block are hashed, so the scan
+    costs a few numpy passes plus a little work per matching block.
+    """
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    weak = weak_checksums(data, block_size)
+    keys = np.array(list(table), np.uint32)
+    # a bitmap on the low 20 bits rules out almost every window cheaply
+    bitmap = np.zeros(1 << 20, bool)
+    bitmap[keys & 0xFFFFF] = True
+    candidates = np.flatnonzero(bitmap[weak & 0xFFFFF])
+    candidates = candidates[np.isin(weak[candidates], keys)]
+
+    ops = []
+    literals = []
+    position = 0  # scan position
+    pending = 0  # start of the bytes not yet in a step
+    while True:
+        i = candidates.searchsorted(position)
+        if i == len(candidates):
+            break
+        start = int(candidates[i])
+        index = table[int(weak[start])].get(
+            strong_checksum(data[start : start + block_size])
+        )
+        if index is None:
+            position = start + 1
+            continue
+        if start > pending:
+            ops.append(["data", start - pending])
+            literals.append(data[pending:start])
+        if ops and ops[-1][0] == "copy" and sum(ops[-1][1:]) == index:
+            ops[-1][2] += 1
+        else:
+            ops.append(["copy", index, 1])
+        position = pending = start + block_size
+    if pending < len(data):
+        ops.append(["data", len(data) - pending])
+        literals.append(data[pending:])
+    return ops, b"".join(literals)
+
+
+def apply_delta(base, ops, literals, block_size):
+    """Rebuild a file from make_delta output; the server side of a delta."""
+    parts = []
+    offset = 0
+    for op in ops:
+        if op[0] == "copy":
+            parts.append(base[op[1] * block_size : (op[1] + op[2]) * block_size])
+        else:
+            parts.append(literals[offset : offset + op[1]])
+            offset += op[1]
+    return b"".join(parts)
+
+
+class UploadCancelled(Exception):
+    """Raised by an upload whose cancel event was set."""
+
+
+class UploadBody:
+    """Request body that reports progress and can be cancelled mid-transfer.
+
+    requests sizes it with len() and the HTTP connection pulls it in blocks
+    through read(), so Content-Length stays exact and nothing is chunked.
+    """
+
+    def __init__(self, data, progress=None, cancel=None):
+        self.data = memoryview(data)
+        self.sent = 0
+        self.progress = progress
+        self.cancel = cancel
+
+    def __len__(self):
+        return len(self.data) - self.sent
+
+    def read(self, size=-1):
+        if self.cancel is not None and self.cancel.is_set():
+            raise UploadCancelled()
+        if size is None or size < 0:
+            size = len(self.data)
+        block = self.data[self.sent : self.sent + size].tobytes()
+        self.sent += len(block)
+        if self.progress is not None:
+            self.progress(self.sent, len(self.data))
+        return block
+
+
+class EndpointStats:
+    """Latency of the calls to one endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.slowest = 0.0
+
+    def add(self, seconds, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total += seconds
+        self.slowest = max(self.slowest, seconds)
+
+    def __str__(self):
+        mean = self.total / self.calls if self.calls else 0.0
+        return "%d calls, mean %.0f ms, max %.0f ms, %d errors" % (
+            self.calls,
+            mean * 1000,
+            self.slowest * 1000,
+            self.errors,
+        )
+
+
+class Outbox:
+    """Uploads waiting for the server, kept on disk until delivered.
+
+    Every entry is a pair of files: <id>.ngc with the program and <id>.json
+    with the user, location and filename.  The .json is written last, so an
+    entry exists only once it is complete.  A sender claims an entry by
+    renaming its .json to .sending, which keeps two FreeCADs, or a batch
+    run, from delivering the same upload twice.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, entry_id, suffix):
+        return os.path.join(self.directory, entry_id + suffix)
+
+    def write(self, path, data):
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def add(self, username, file_content, filename, location, compress, error=""):
+        os.makedirs(self.directory, exist_ok=True)
+        entry_id = "%d-%s" % (time.time_ns(), uuid.uuid4().hex[:8])
+        self.write(self.path(entry_id, ".ngc"), file_content.encode())
+        entry = {
+            "user": username,
+            "location": location,
+            "filename": filename,
+            "compress": compress,
+            "queued": time.time(),
+            "attempts": 0,
+            "last_error": error,
+        }
+        self.write(self.path(entry_id, ".json"), json.dumps(entry).encode())
+        return entry_id
+
+    def entries(self):
+        """Return every queued upload, oldest first, with its id added."""
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            entry_id, suffix = os.path.splitext(name)
+            if suffix == ".sending":
+                path = os.path.join(self.directory, name)
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_CLAIM:
+                        os.replace(path, self.path(entry_id, ".json"))
+                        suffix = ".json"
+                except OSError:
+                    pass
+            if suffix != ".json":
+                continue
+            try:
+                with open(self.path(entry_id, ".json"), "r") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            entry["id"] = entry_id
+            entries.append(entry)
+        return entries
+
+    def waiting(self):
+        """Return the queued uploads that will still be tried."""
+        return [e for e in self.entries() if e["attempts"] < MAX_ATTEMPTS]
+
+    def claim(self, entry_id):
+        try:
+            os.rename(self.path(entry_id, ".json"), self.path(entry_id, ".sending"))
+            return True
+        except OSError:
+            return False
+
+    def content(self, entry_id):
+        with open(self.path(entry_id, ".ngc"), "rb") as f:
+            return f.read().decode()
+
+    def release(self, entry, error, counted):
+        """Put a claimed entry back after a failed try."""
+        entry = dict(entry)
+        entry_id = entry.pop("id")
+        entry["attempts"] += counted
+        entry["last_error"] = error
+        self.write(self.path(entry_id, ".json"), json.dumps(entry).encode())
+        os.remove(self.path(entry_id, ".sending"))
+
+    def remove(self, entry_id):
+        os.remove(self.path(entry_id, ".sending"))
+        os.remove(self.path(entry_id, ".ngc"))
+
+    def status(self):
+        """Return one line per queued upload."""
+        lines = []
+        for entry in self.entries():
+            queued = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["queued"]))
+            state = "waiting"
+            if entry["attempts"] >= MAX_ATTEMPTS:
+                state = "given up"
+            lines.append(
+                "%s  %s:%s/%s  %s, %d tries  %s"
+                % (
+                    queued,
+                    entry["user"],
+                    entry["location"].rstrip("/"),
+                    entry["filename"],
+                    state,
+                    entry["attempts"],
+                    entry["last_error"],
+                )
+            )
+        return lines
+
+
+class RemoteClient:
+    """Pooled session to one NibblerBOT server.
+
+    Every call has a connect and a read timeout.  Calls marked idempotent
+    are retried with exponential backoff on connection errors, timeouts
+    and gateway errors; uploads are never repeated behind the user's back.
+    """
+
+    def __init__(
+        self, base_url, connect_timeout=5.0, read_timeout=60.0, retries=3, backoff=0.5
+    ):
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.options = {}  # endpoint -> headers of its OPTIONS response
+        self.encodings = {}  # endpoint -> request codings the server accepts
+        self.cache_dir = None
+        self.users_ttl = USERS_TTL
+        self.pending_users = None
+        self.listing_ttl = LISTING_TTL
+        self.listings = {}  # (user, path) -> (fetched, listing)
+        self.pending_listings = {}  # (user, path) -> future
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        # speculative work gets its own threads so it never delays a click
+        self.prefetcher = ThreadPoolExecutor(max_workers=2)
+        self.delta_supported = None  # unknown until the server offers it
+        self.outbox = None
+        self.flush_interval = FLUSH_INTERVAL
+        self.flush_lock = threading.Lock()
+        self.flusher = None
+
+    def configure(self, connect_timeout, read_timeout, retries, cache_dir=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        if cache_dir != self.cache_dir:
+            self.cache_dir = cache_dir
+            self.outbox = None
+            if cache_dir:
+                self.outbox = Outbox(self.cache_path("outbox", ""))
+
+    def server_offline(self, error=None, response=None):
+        """Tell whether a failed call means the server could not be reached."""
+        if error is not None:
+            return isinstance(error, OFFLINE_ERRORS)
+        return response is not None and response.status_code in RETRY_STATUS
+
+    def record(self, endpoint, start, failed):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.add(time.perf_counter() - start, failed)
+
+    def request(self, method, endpoint, idempotent=False, **kwargs):
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            last = attempt + 1 == attempts
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, self.base_url + endpoint, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                self.record(endpoint, start, True)
+                if last:
+                    raise
+            else:
+                self.record(endpoint, start, response.status_code >= 500)
+                if last or response.status_code not in RETRY_STATUS:
+                    return response
+            time.sleep(self.backoff * 2**attempt)
+
+    def send(self, prepared, endpoint):
+        """Send a prepared request once, e.g. a compressed upload."""
+        start = time.perf_counter()
+        try:
+            response = self.session.send(
+                prepared, timeout=(self.connect_timeout, self.read_timeout)
+            )
+        except requests.RequestException:
+            self.record(endpoint, start, True)
+            raise
+        self.record(endpoint, start, response.status_code >= 500)
+        return response
+
+    def report(self):
+        """Return one line of latency numbers per endpoint."""
+        with self.lock:
+            return [
+                "%s: %s" % (endpoint, stats) for endpoint, stats in self.stats.items()
+            ]
+
+    def cache_path(self, name, suffix=".json"):
+        """Return the cache file for name on this server, or None."""
+        if not self.cache_dir:
+            return None
+        server = hashlib.sha1(self.base_url.encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"{name}-{server}{suffix}")
+
+    def read_cache(self, name):
+        path = self.cache_path(name)
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (TypeError, OSError, ValueError):
+            return None
+
+    def write_cache(self, name, entry):
+        path = self.cache_path(name)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write aside and rename so a reader never sees half a file
+            with open(path + ".tmp", "w") as f:
+                json.dump(entry, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not write {path}: {e}")
+
+    def prefetch_usernames(self):
+        """Start loading the user list in the background."""
+        with self.lock:
+            if self.pending_users is None:
+                self.pending_users = self.executor.submit(self.load_usernames)
+
+    def usernames(self):
+        """Return the user list, waiting for a prefetch if one is running."""
+        with self.lock:
+            pending, self.pending_users = self.pending_users, None
+        if pending is not None:
+            return pending.result()
+        return self.load_usernames()
+
+    def load_usernames(self):
+        """Return the user list from the disk cache or the server.
+
+        A cached list younger than users_ttl is used as is.  An older one is
+        revalidated with its ETag or Last-Modified date, and it is still
+        used when the server cannot be reached.
+        """
+        cached = self.read_cache("users")
+        if cached and time.time() - cached["fetched"] < self.users_ttl:
+            return cached["users"]
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            response = self.request(
+                "GET", USERS_ENDPOINT, idempotent=True, headers=headers
+            )
+            if response.status_code == 304 and cached:
+                cached["fetched"] = time.time()
+                self.write_cache("users", cached)
+                return cached["users"]
+            response.raise_for_status()
+            data = response.json()
+        except requests.RequestException as e:
+            if not cached:
+                raise
+            print(f"Using cached usernames, server unreachable: {e}")
+            return cached["users"]
+
+        users = data["data"] if data["status"] == 1 else []
+        self.write_cache(
+            "users",
+            {
+                "users": users,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched": time.time(),
+            },
+        )
+        return users
+
+    def list_files(self, username, location):
+        data = {"user": username, "location": location}
+        response = self.request("POST", LIST_ENDPOINT, idempotent=True, data=data)
+        response.raise_for_status()
+        data = response.json()
+        if isinstance(data, dict) and "data" in data:
+            return data["data"]
+        return {}
+
+    def cached_listing(self, username, path):
+        """Return the listing of path if a fresh one is cached, else None."""
+        with self.lock:
+            entry = self.listings.get((username, path))
+        if entry and time.time() - entry[0] < self.listing_ttl:
+            return entry[1]
+        return None
+
+    def forget_listing(self, username, path):
+        with self.lock:
+            self.listings.pop((username, path), None)
+
+    def listing_async(self, username, path, prefetch=False):
+        """Return a future for the listing of path.
+
+        Concurrent callers for the same folder share one request.
+        """
+        key = (username, path)
+        with self.lock:
+            future = self.pending_listings.get(key)
+            if future is None:
+                executor = self.prefetcher if prefetch else self.executor
+                future = executor.submit(self.load_listing, username, path)
+                self.pending_listings[key] = future
+        return future
+
+    def listing(self, username, path):
+        return self.listing_async(username, path).result()
+
+    def load_listing(self, username, path):
+        key = (username, path)
+        try:
+            data = self.cached_listing(username, path)
+            if data is None:
+                data = self.list_files(username, path)
+                with self.lock:
+                    self.listings[key] = (time.time(), data)
+            return data
+        finally:
+            with self.lock:
+                self.pending_listings.pop(key, None)
+
+    def prefetch_listings(self, username, path, data):
+        """Start loading the folders around path, given its listing data.
+
+        Child folders come first, then the parent and, when the parent is
+        already known, the siblings.
+        """
+        paths = [posixpath.join(path, name) for name in data.get("dirs", [])]
+        if path != "/":
+            parent = posixpath.dirname(path.rstrip("/")) or "/"
+            paths.append(parent)
+            siblings = self.cached_listing(username, parent) or {}
+            paths += [
+                posixpath.join(parent, name)
+                for name in siblings.get("dirs", [])
+                if posixpath.join(parent, name) != path
+            ]
+        started = 0
+        for folder in paths:
+            if started == MAX_PREFETCH:
+                break
+            if self.cached_listing(username, folder) is None:
+                self.listing_async(username, folder, prefetch=True)
+                started += 1
+
+    def endpoint_options(self, endpoint):
+        """Return the headers the server answers an OPTIONS request with.
+
+        This is where the server announces its capabilities; each endpoint
+        is asked once.
+        """
+        if endpoint not in self.options:
+            try:
+                response = self.request("OPTIONS", endpoint, idempotent=True)
+                headers = response.headers
+            except requests.RequestException:
+                headers = CaseInsensitiveDict()
+            self.options[endpoint] = headers
+        return self.options[endpoint]
+
+    def accepted_encodings(self, endpoint):
+        """Return the request content codings the server accepts at endpoint.
+
+        Servers announce them in the Accept-Encoding header of their
+        responses (RFC 7694).
+        """
+        if endpoint not in self.encodings:
+            header = self.endpoint_options(endpoint).get("Accept-Encoding", "")
+            self.encodings[endpoint] = {
+                coding.split(";")[0].strip().lower()
+                for coding in header.split(",")
+                if coding.strip()
+            }
+        return self.encodings[endpoint]
+
+    def upload_encoding(self, endpoint, compress):
+        """Return the coding to compress an upload with, or None.
+
+        compress is none, auto or the name of a coding.
+        """
+        if compress == "none":
+            return None
+        wanted = [compress]
+        if compress == "auto":
+            wanted = list(UPLOAD_COMPRESSORS)
+        accepted = self.accepted_encodings(endpoint)
+        for coding in wanted:
+            if coding in UPLOAD_COMPRESSORS and coding in accepted:
+                return coding
+        return None
+
+    def signature(self, username, path, filename, block_size):
+        """Return (response, signature) for the server's copy of a file.
+
+        signature holds the sha256 of the file and the block checksums for
+        a delta; it is None if the file is missing or the server does not
+        offer deltas with DELTA_HEADER, in which case nothing is asked.
+        """
+        if self.delta_supported is None:
+            offered = DELTA_HEADER in self.endpoint_options(UPLOAD_ENDPOINT)
+            self.delta_supported = offered
+        if not self.delta_supported:
+            return None, None
+        data = {
+            "user": username,
+            "location": path,
+            "filename": filename,
+            "block_size": block_size,
+        }
+        try:
+            # optional, so one try; the upload itself reports an outage
+            response = self.request("POST", SIGNATURE_ENDPOINT, data=data)
+        except requests.RequestException:
+            return None, None
+        if response.status_code in (404, 405, 501):
+            # offered but not there after all
+            self.delta_supported = False
+            return None, None
+        try:
+            data = response.json()
+        except ValueError:
+            return None, None
+        if response.status_code != 200 or data.get("status") != 1:
+            return None, None
+        return response, data["data"]
+
+    def upload(
+        self,
+        username,
+        file_content,
+        filename,
+        path,
+        compress="none",
+        progress=None,
+        cancel=None,
+        delta=False,
+    ):
+        """Upload file_content and return the response.
+
+        With delta, and if the server offers it, a file the server already
+        holds unchanged is not sent again, and when it holds an older
+        version only the changed blocks go out.  progress(sent, total) is
+        called as the body goes out, and setting the cancel event aborts the
+        transfer with UploadCancelled.
+        """
+        content = file_content.encode()
+        data = {
+            "user": username,
+            "location": path,
+            "uploader": "direct",
+            "filename": filename,
+            "config": "{}",
+            "options": "{}",
+        }
+        listed = self.cached_listing(username, path)
+        if listed is not None:
+            # no need to ask for the signature of a file that is not there
+            names = {f.get("name") for f in listed.get("files", [])}
+            delta = delta and filename in names
+        if delta:
+            block_size = delta_block_size(len(content))
+            response, signature = self.signature(username, path, filename, block_size)
+            if signature is not None:
+                digest = hashlib.sha256(content).hexdigest()
+                if signature["sha256"] == digest:
+                    print(f"Skipped upload, {filename} on the server is identical")
+                    return response
+                block_size = signature["block_size"]
+                ops, literals = make_delta(content, signature["blocks"], block_size)
+                if len(literals) < len(content) * DELTA_WORTHWHILE:
+                    delta_data = dict(data)
+                    delta_data["delta"] = json.dumps(
+                        {"block_size": block_size, "ops": ops}
+                    )
+                    delta_data["base_sha256"] = signature["sha256"]
+                    delta_data["sha256"] = digest
+                    files = {
+                        "fileUpload": (filename, literals, "application/octet-stream")
+                    }
+                    print(
+                        f"Delta: {len(literals)} of {len(content)} bytes changed "
+                        f"({100 * len(literals) / max(len(content), 1):.1f}%)"
+                    )
+                    response = self.post_upload(
+                        delta_data, files, compress, progress, cancel
+                    )
+                    if response.status_code != 409:
+                        if response.status_code == 200:
+                            self.forget_listing(username, path)
+                        return response
+                    # the server copy changed under us or could not be patched
+                    print("Server could not apply the delta, sending the whole file.")
+
+        files = {"fileUpload": (filename, content, "text/plain")}
+        response = self.post_upload(data, files, compress, progress, cancel)
+        if response.status_code == 200:
+            # the folder now holds the new file
+            self.forget_listing(username, path)
+        return response
+
+    def post_upload(self, data, files, compress, progress, cancel):
+        """Send one upload request, compressed if the server accepts it."""
+        request = requests.Request(
+            "POST", self.base_url + UPLOAD_ENDPOINT, files=files, data=data
+        )
+        request = self.session.prepare_request(request)
+        body = request.body
+        size = len(body)
+        coding = self.upload_encoding(UPLOAD_ENDPOINT, compress)
+
+        def send(prepared, content):
+            prepared.body = UploadBody(content, progress, cancel)
+            prepared.headers["Content-Length"] = str(len(content))
+            try:
+                return self.send(prepared, UPLOAD_ENDPOINT)
+            except requests.RequestException:
+                if cancel is not None and cancel.is_set():
+                    raise UploadCancelled() from None
+                raise
+
+        start = time.perf_counter()
+        if coding is not None:
+            compressed = request.copy()
+            compressed.headers["Content-Encoding"] = coding
+            content = UPLOAD_COMPRESSORS[coding](body)
+            response = send(compressed, content)
+            if response.status_code == 415:
+                # the server changed its mind; send plain text from now on
+                print(f"Server refused {coding} upload, sending uncompressed.")
+                self.encodings[UPLOAD_ENDPOINT] = set()
+                coding = None
+            else:
+                sent = len(content)
+        if coding is None:
+            response = send(request, body)
+            sent = size
+        elapsed = time.perf_counter() - start
+
+        if coding is None:
+            print(f"Sent {size} bytes in {elapsed:.2f} s")
+        else:
+            print(
+                f"Sent {size} bytes as {sent} bytes {coding} "
+                f"(ratio {size / max(sent, 1):.1f}:1) in {elapsed:.2f} s"
+            )
+        return response
+
+    def upload_async(self, *args, **kwargs):
+        """Run upload() on a worker thread and return its future."""
+        return self.executor.submit(self.upload, *args, **kwargs)
+
+    def queue_upload(self, username, file_content, filename, path, compress, error):
+        """Keep an upload in the outbox and start delivering it in the background."""
+        self.outbox.add(username, file_content, filename, path, compress, error)
+        self.start_flusher()
+
+    def deliver(self, entry):
+        return self.upload(
+            entry["user"],
+            self.outbox.content(entry["id"]),
+            entry["filename"],
+            entry["location"],
+            entry["compress"],
+        )
+
+    def flush_outbox(self):
+        """Send the waiting uploads in concurrent batches.
+
+        Returns (sent, failed, offline); a batch that finds the server away
+        ends the flush, since the rest would fail the same way.
+        """
+        if self.outbox is None or not self.flush_lock.acquire(blocking=False):
+            return 0, 0, False
+        try:
+            entries = self.outbox.waiting()
+            sent = failed = 0
+            for first in range(0, len(entries), OUTBOX_BATCH):
+                batch = [
+                    entry
+                    for entry in entries[first : first + OUTBOX_BATCH]
+                    if self.outbox.claim(entry["id"])
+                ]
+                futures = [(e, self.executor.submit(self.deliver, e)) for e in batch]
+                offline = False
+                for entry, future in futures:
+                    try:
+                        response = future.result()
+                    except requests.RequestException as e:
+                        error = type(e).__name__
+                        away = self.server_offline(error=e)
+                    except Exception as e:
+                        # e.g. an unreadable entry; counts, so it is given up
+                        error = f"{type(e).__name__}: {e}"
+                        away = False
+                    else:
+                        if response.status_code == 200:
+                            self.outbox.remove(entry["id"])
+                            print(f"Delivered queued upload {entry['filename']}")
+                            sent += 1
+                            continue
+                        error = f"{response.status_code} {response.text[:200]}"
+                        away = self.server_offline(response=response)
+                    # only rejections count; waiting out an outage is free
+                    self.outbox.release(entry, error, not away)
+                    offline = offline or away
+                    failed += 1
+                if offline:
+                    return sent, failed, True
+            return sent, failed, False
+        finally:
+            self.flush_lock.release()
+
+    def start_flusher(self):
+        """Deliver the outbox on a background thread until it is empty."""
+        with self.lock:
+            if self.flusher is not None:
+                return
+            if self.outbox is None or not self.outbox.waiting():
+                return
+            self.flusher = threading.Thread(
+                target=self.run_flusher, name="NibblerBOT outbox", daemon=True
+            )
+            self.flusher.start()
+
+    def run_flusher(self):
+        delay = self.flush_interval
+        try:
+            while True:
+                time.sleep(delay)
+                sent, failed, offline = self.flush_outbox()
+                if offline:
+                    delay = min(delay * 2, MAX_FLUSH_INTERVAL)
+                else:
+                    delay = self.flush_interval
+                with self.lock:
+                    if not self.outbox.waiting():
+                        self.flusher = None
+                        return
+        finally:
+            # an error must not leave start_flusher() thinking one runs
+            with self.lock:
+                if self.flusher is threading.current_thread():
+                    self.flusher = None
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def shared_client(base_url):
+    """Return the RemoteClient for base_url, creating it on first use."""
+    with clients_lock:
+        client = clients.get(base_url)
+        if client is None:
+            client = clients[base_url] = RemoteClient(base_url)
+        return client
+
+
+def main(argv=None):
+    """Show or deliver the upload outbox from the command line."""
+    parser = argparse.ArgumentParser(description="NibblerBOT upload outbox")
+    parser.add_argument("command", choices=["status", "flush"], nargs="?")
+    parser.add_argument(
+        "--cache-dir",
+        required=True,
+        help="the NibblerBOT folder in FreeCAD's user data folder",
+    )
+    parser.add_argument("--url", default="https://nibblerbot.knoxmakers.org:1337/")
+    args = parser.parse_args(argv)
+
+    client = shared_client(args.url)
+    client.configure(client.connect_timeout, client.read_timeout, 0, args.cache_dir)
+    if args.command == "flush":
+        sent, failed, offline = client.flush_outbox()
+        print(f"Sent {sent}, failed {failed}" + (", server offline" if offline else ""))
+    lines = client.outbox.status()
+    print(f"{len(lines)} upload(s) in the outbox")
+    for line in lines:
+        print("  " + line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
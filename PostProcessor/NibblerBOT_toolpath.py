@@ -0,0 +1,1102 @@
+"""Toolpath stages for the NibblerBOT post processor.
+
+Everything here works on placed commands, i.e. objects with a Name and a
+Parameters dict in FreeCAD's internal units (mm, mm/s), before any text is
+formatted.  Once the stages that rewrite commands are done, each command
+list becomes a CommandTable and the estimate and checks run on its
+columns.  Nothing in this module needs FreeCAD, so the stages can be
+tested and benchmarked on their own.
+"""
+
+import math
+
+import numpy as np
+
+
+class PostCommand:
+    """Plain Python stand-in for a Path.Command that can be pickled."""
+
+    __slots__ = ("Name", "Parameters")
+
+    def __init__(self, name, parameters):
+        self.Name = name
+        self.Parameters = parameters
+
+    def __repr__(self):
+        return "PostCommand(%r, %r)" % (self.Name, self.Parameters)
+
+
+# Words kept in the columns of a CommandTable; NaN where a command has none
+TABLE_WORDS = ("X", "Y", "Z", "I", "J", "F")
+TABLE_COLUMNS = {word: column for column, word in enumerate(TABLE_WORDS)}
+
+
+class CommandTable:
+    """Columnar form of one placed command list.
+
+    codes holds the index of every command's name in names and values one
+    column per TABLE_WORDS word, stored column by column.  side keeps the
+    complete parameters of the few commands with any other word, such as
+    tool changes, dwells and canned cycles, keyed by row.  Later stages
+    work on whole columns instead of one Parameters dict per command.
+    """
+
+    __slots__ = ("names", "codes", "values", "side")
+
+    def __init__(self, names, codes, values, side):
+        self.names = names
+        self.codes = codes
+        self.values = values
+        self.side = side
+
+    @classmethod
+    def from_commands(cls, commands):
+        nan = math.nan
+        no_words = (nan,) * len(TABLE_WORDS)
+        column_words = frozenset(TABLE_WORDS)
+        codes = {}
+        records = []
+        side = {}
+        for index, c in enumerate(commands):
+            name = c.Name
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(codes)
+            parameters = c.Parameters
+            if not parameters:
+                records.append((code,) + no_words)
+                continue
+            get = parameters.get
+            records.append(
+                (
+                    code,
+                    get("X", nan),
+                    get("Y", nan),
+                    get("Z", nan),
+                    get("I", nan),
+                    get("J", nan),
+                    get("F", nan),
+                )
+            )
+            if not column_words.issuperset(parameters):
+                side[index] = parameters
+        table = np.array(records, dtype=float).reshape(-1, 1 + len(TABLE_WORDS))
+        return cls(
+            list(codes),
+            table[:, 0].astype(np.int32),
+            np.asfortranarray(table[:, 1:]),
+            side,
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, values, default, dtype=float):
+        """Return values[name] for the command of every row, else default."""
+        by_code = [values.get(name, default) for name in self.names]
+        return np.array(by_code or [default], dtype=dtype)[self.codes]
+
+    def rows_of(self, names):
+        """Return a mask of the rows whose command is one of names."""
+        return self.lookup(dict.fromkeys(names, True), False, bool)
+
+    def words(self, letters):
+        """Return the columns of letters side by side, a view if adjacent."""
+        first = TABLE_COLUMNS[letters[0]]
+        if letters == "".join(TABLE_WORDS[first : first + len(letters)]):
+            return self.values[:, first : first + len(letters)]
+        return self.values[:, [TABLE_COLUMNS[letter] for letter in letters]]
+
+    def parameters(self, index):
+        if index in self.side:
+            return self.side[index]
+        row = self.values[index]
+        return {w: float(v) for w, v in zip(TABLE_WORDS, row) if not math.isnan(v)}
+
+    def command(self, index):
+        return PostCommand(self.names[self.codes[index]], self.parameters(index))
+
+    def fingerprint(self, digest):
+        """Feed the complete table into digest, a hashlib object."""
+        digest.update(repr((len(self), self.names)).encode())
+        digest.update(np.ascontiguousarray(self.codes))
+        digest.update(np.ascontiguousarray(self.values.T))  # free in column order
+        digest.update(repr(sorted(self.side.items())).encode())
+
+
+RAPIDS = ("G0", "G00")
+STRAIGHT_FEEDS = ("G1", "G01")
+PLANES = {"G17": True, "G18": False, "G19": False}
+MOTIONS = ("G0", "G00", "G1", "G01", "G2", "G02", "G3", "G03")
+MOVE_WORDS = frozenset("XYZ")
+RUN_WORDS = frozenset("XYZF")
+
+# Circles flatter than this are left to the line simplification
+MAX_ARC_RADIUS = 5000.0
+# Angle one polyline segment may sweep before the run is not a sampled arc
+MAX_SEGMENT_SWEEP = math.pi / 4
+# Stop short of a full circle, which needs a different end point check
+MAX_ARC_SWEEP = 2 * math.pi - 0.01
+MIN_ARC_SEGMENTS = 3
+
+
+def run_points(start, run):
+    """Return the start point and the end point of every move in run."""
+    points = [start]
+    x, y, z = start
+    for c in run:
+        parameters = c.Parameters
+        x = parameters.get("X", x)
+        y = parameters.get("Y", y)
+        z = parameters.get("Z", z)
+        points.append((x, y, z))
+    return points
+
+
+def run_end(start, run):
+    """Return the position after the moves in run."""
+    end = list(start)
+    found = set()
+    for c in reversed(run):
+        for index, axis in enumerate("XYZ"):
+            if axis not in found and axis in c.Parameters:
+                end[index] = c.Parameters[axis]
+                found.add(axis)
+        if len(found) == 3:
+            break
+    return end
+
+
+def feed_runs(commands, xy_only=False):
+    """Split commands into runs of plain G1 moves at one feed.
+
+    Yields (start, feed, run) for every run, where start is the XYZ position
+    before it, and (position, feed, command) for every other command with
+    the position before it, holding None for axes that are not known.
+    Runs only start from a known position, and with xy_only only while the
+    XY plane is selected.
+    """
+    position = [None, None, None]
+    feed = None
+    xy_plane = True
+    run = []
+    run_start = None
+
+    for c in commands:
+        name = c.Name
+        parameters = c.Parameters
+        if name in STRAIGHT_FEEDS and parameters.keys() <= RUN_WORDS:
+            command_feed = parameters.get("F", feed)
+            if run:
+                if command_feed == feed:
+                    run.append(c)
+                    continue
+                yield run_start, feed, run
+                position = run_end(run_start, run)
+                run = []
+            feed = command_feed
+            if (xy_plane or not xy_only) and None not in position:
+                run = [c]
+                run_start = tuple(position)
+                continue
+        elif run:
+            yield run_start, feed, run
+            position = run_end(run_start, run)
+            run = []
+
+        yield position, feed, c
+        if "F" in parameters:
+            feed = parameters["F"]
+        if name in PLANES:
+            xy_plane = PLANES[name]
+        elif name in MOTIONS:
+            position = [
+                parameters.get(axis, value) for axis, value in zip("XYZ", position)
+            ]
+        elif parameters.keys() & MOVE_WORDS:
+            # some other command moved the machine; start over
+            position = [None, None, None]
+
+    if run:
+        yield run_start, feed, run
+
+
+def circle_through(a, b, c):
+    """Return (cx, cy, r) of the circle through three XY points or None."""
+    ax, ay = a[0], a[1]
+    bx, by = b[0], b[1]
+    cx, cy = c[0], c[1]
+    d = 2.0 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return ux, uy, math.hypot(ax - ux, ay - uy)
+
+
+def arc_through(points, first, last, tolerance):
+    """Fit points[first..last] to one arc.
+
+    Returns (cx, cy, sweep) when every point lies within tolerance of the
+    circle through the end points and the middle point, every chord stays
+    within tolerance of the arc, the points advance in one direction and Z
+    changes linearly with the swept angle.  Otherwise returns None.
+    """
+    circle = circle_through(points[first], points[(first + last) // 2], points[last])
+    if circle is None:
+        return None
+    cx, cy, r = circle
+    if r > MAX_ARC_RADIUS or r < tolerance:
+        return None
+    # largest angle a chord may span before its middle leaves the tolerance
+    max_step = min(MAX_SEGMENT_SWEEP, 2.0 * math.acos(max(-1.0, 1.0 - tolerance / r)))
+
+    angles = [0.0]
+    previous = math.atan2(points[first][1] - cy, points[first][0] - cx)
+    sweep = 0.0
+    for index in range(first + 1, last + 1):
+        x, y = points[index][0], points[index][1]
+        if abs(math.hypot(x - cx, y - cy) - r) > tolerance:
+            return None
+        angle = math.atan2(y - cy, x - cx)
+        step = angle - previous
+        if step > math.pi:
+            step -= 2 * math.pi
+        elif step < -math.pi:
+            step += 2 * math.pi
+        if step == 0.0 or abs(step) > max_step:
+            return None
+        if sweep != 0.0 and (step > 0.0) != (sweep > 0.0):
+            return None
+        sweep += step
+        angles.append(sweep)
+        previous = angle
+    if abs(sweep) > MAX_ARC_SWEEP:
+        return None
+
+    z0 = points[first][2]
+    dz = points[last][2] - z0
+    if dz != 0.0 or any(points[i][2] != z0 for i in range(first, last + 1)):
+        for offset, angle in enumerate(angles):
+            if abs(points[first + offset][2] - (z0 + dz * angle / sweep)) > tolerance:
+                return None
+    return cx, cy, sweep
+
+
+def longest_arc(points, first, tolerance):
+    """Return (last, fit) of the longest arc starting at first, or None."""
+    last = first + MIN_ARC_SEGMENTS
+    if last >= len(points):
+        return None
+    fit = arc_through(points, first, last, tolerance)
+    if fit is None:
+        return None
+
+    # grow exponentially, then bisect between the last fit and the first miss
+    step = 1
+    miss = None
+    while True:
+        candidate = last + step
+        if candidate >= len(points):
+            miss = len(points)
+            break
+        candidate_fit = arc_through(points, first, candidate, tolerance)
+        if candidate_fit is None:
+            miss = candidate
+            break
+        last, fit = candidate, candidate_fit
+        step *= 2
+    while miss - last > 1:
+        middle = (last + miss) // 2
+        middle_fit = arc_through(points, first, middle, tolerance)
+        if middle_fit is None:
+            miss = middle
+        else:
+            last, fit = middle, middle_fit
+    return last, fit
+
+
+class ArcFitStats:
+    """What fit_arcs() replaced, for the report."""
+
+    def __init__(self):
+        self.moves = 0  # G1 moves replaced
+        self.arcs = 0  # G2/G3 arcs emitted
+        self.replaced = []  # (removed, added) command lists for byte counts
+
+    @property
+    def lines_saved(self):
+        return self.moves - self.arcs
+
+
+def fit_arc_run(start, feed, run, tolerance, stats):
+    """Return run with every stretch that follows an arc replaced by G2/G3."""
+    if len(run) < MIN_ARC_SEGMENTS:
+        return run
+    result = []
+    points = run_points(start, run)
+    first = 0
+    while first < len(run):
+        found = longest_arc(points, first, tolerance)
+        if found is None:
+            result.append(run[first])
+            first += 1
+            continue
+        last, (cx, cy, sweep) = found
+        begin = points[first]
+        end = points[last]
+        parameters = {
+            "X": end[0],
+            "Y": end[1],
+            "Z": end[2],
+            "I": cx - begin[0],
+            "J": cy - begin[1],
+        }
+        if feed is not None:
+            parameters["F"] = feed
+        arc = PostCommand("G3" if sweep > 0 else "G2", parameters)
+        result.append(arc)
+        if stats is not None:
+            stats.moves += last - first
+            stats.arcs += 1
+            stats.replaced.append((run[first:last], [arc]))
+        first = last
+    return result
+
+
+def fit_arcs(commands, tolerance, stats=None):
+    """Replace runs of G1 moves that follow a circular arc with G2/G3.
+
+    Only XY-plane runs with a constant feed are fitted; Z may change
+    linearly along the arc, giving a helix.  Returns a new command list.
+    """
+    result = []
+    for start, feed, item in feed_runs(commands, xy_only=True):
+        if type(item) is list:
+            result.extend(fit_arc_run(start, feed, item, tolerance, stats))
+        else:
+            result.append(item)
+    return result
+
+
+# Moves shorter than this are treated as not moving at all
+MIN_MOVE_LENGTH = 1e-6
+
+
+class SimplifyStats:
+    """What simplify() removed, for the report."""
+
+    def __init__(self):
+        self.degenerate = 0  # zero length moves dropped
+        self.merged = 0  # moves dropped because they were within tolerance
+
+
+def strip_merge(points, tolerance):
+    """Return a keep mask for points[1:] using a straight strip merge.
+
+    Each kept point starts a strip of width tolerance along its next
+    segment; the following points are dropped while they stay inside it and
+    keep moving forward.  Every point is looked at a bounded number of
+    times, so this runs in linear time.
+    """
+    count = len(points) - 1
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    half = tolerance / 2.0
+
+    segments = points[1:] - points[:-1]
+    lengths = np.sqrt((segments * segments).sum(axis=1))
+    directions = segments / lengths[:, None]
+    # a point is a corner if the point after it leaves the strip of the
+    # segment before it; those never need a strip search
+    after = points[2:] - points[:-2]
+    along = (after * directions[:-1]).sum(axis=1)
+    across = np.sqrt(np.maximum((after * after).sum(axis=1) - along * along, 0.0))
+    corner = (across > half) | (along <= lengths[:-1])
+    corner = np.append(corner, True).tolist()
+
+    anchor = 0
+    while anchor < count:
+        last = anchor + 1  # index into points of the last point in the strip
+        if not corner[anchor]:
+            origin = points[anchor]
+            direction = directions[anchor]
+            last_along = lengths[anchor]
+            window = 16
+            while last < count:
+                chunk = points[last + 1 : last + 1 + window] - origin
+                along = chunk @ direction
+                across = np.sqrt(
+                    np.maximum((chunk * chunk).sum(axis=1) - along * along, 0.0)
+                )
+                previous = np.concatenate(([last_along], along[:-1]))
+                outside = (across > half) | (along <= previous)
+                if outside.any():
+                    last += int(outside.argmax())
+                    break
+                last += len(chunk)
+                last_along = along[-1]
+                window *= 2
+        keep[last - 1] = True
+        anchor = last
+    return keep
+
+
+def douglas_peucker(points, tolerance):
+    """Return a keep mask for points[1:] using Douglas-Peucker.
+
+    Points that would make the path double back along the chord are kept,
+    so overlapping passes are never folded together.
+    """
+    count = len(points) - 1
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    keep[-1] = True
+    stack = [(0, count)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        origin = points[first]
+        chord = points[last] - origin
+        length = math.sqrt(float(chord @ chord))
+        inner = points[first + 1 : last] - origin
+        if length < MIN_MOVE_LENGTH:
+            distance = np.sqrt((inner * inner).sum(axis=1))
+            backwards = np.zeros(len(inner), dtype=bool)
+        else:
+            direction = chord / length
+            along = inner @ direction
+            distance = np.sqrt(
+                np.maximum((inner * inner).sum(axis=1) - along * along, 0.0)
+            )
+            backwards = np.diff(along, prepend=0.0) <= 0.0
+            backwards |= along >= length
+        if backwards.any():
+            split = first + 1 + int(backwards.argmax())
+        else:
+            worst = int(distance.argmax())
+            if distance[worst] <= tolerance:
+                continue
+            split = first + 1 + worst
+        keep[split - 1] = True
+        stack.append((first, split))
+        stack.append((split, last))
+    return keep
+
+
+SIMPLIFY_METHODS = {
+    "merge": strip_merge,
+    "douglas-peucker": douglas_peucker,
+}
+
+
+def simplify_run(start, feed, run, tolerance, keep_method, stats):
+    """Return run without its zero length and in-tolerance straight moves."""
+    if len(run) < 2:
+        return run
+    points = run_points(start, run)
+    path = np.array(points, dtype=float)
+    segments = path[1:] - path[:-1]
+    moved = np.flatnonzero(
+        np.sqrt((segments * segments).sum(axis=1)) >= MIN_MOVE_LENGTH
+    )
+    keep = np.zeros(len(run), dtype=bool)
+    if len(moved):
+        path = np.concatenate((path[:1], path[moved + 1]))
+        keep[moved[keep_method(path, tolerance)]] = True
+    kept = np.flatnonzero(keep).tolist()
+    # a dropped trailing move may carry the feed word the next run relies on
+    dropped_tail = run[kept[-1] + 1 if kept else 0 :]
+    if not keep[-1] and any("F" in c.Parameters for c in dropped_tail):
+        keep[-1] = True
+        kept.append(len(run) - 1)
+    if stats is not None:
+        # counted from what is really dropped; the feed move kept above may
+        # be a zero length one
+        removed = ~keep
+        merged = int(removed[moved].sum())
+        stats.merged += merged
+        stats.degenerate += int(removed.sum()) - merged
+
+    # kept moves take over the words of the moves dropped before them
+    result = []
+    previous = -1
+    for index in kept:
+        c = run[index]
+        if index > previous + 1:
+            parameters = c.Parameters
+            before = points[previous + 1]
+            point = points[index + 1]
+            changed = {
+                axis: value
+                for axis, value, was in zip("XYZ", point, before)
+                if axis not in parameters and value != was
+            }
+            dropped = run[previous + 1 : index]
+            if "F" not in parameters and any("F" in d.Parameters for d in dropped):
+                changed["F"] = feed
+            if changed:
+                parameters = dict(parameters)
+                parameters.update(changed)
+                c = PostCommand(c.Name, parameters)
+        result.append(c)
+        previous = index
+    return result
+
+
+def simplify(commands, tolerance, method="merge", stats=None):
+    """Drop zero length moves and G1 moves that are straight within tolerance.
+
+    Runs of G1 moves are simplified as 3D polylines and never across a feed
+    change, so every kept move runs at the feed it had before and the path
+    stays within tolerance of the original in Z as well.  Rapids to the
+    current position are dropped.  Returns a new command list.
+    """
+    keep_method = SIMPLIFY_METHODS[method]
+    result = []
+    for position, feed, item in feed_runs(commands):
+        if type(item) is list:
+            result.extend(
+                simplify_run(position, feed, item, tolerance, keep_method, stats)
+            )
+            continue
+        parameters = item.Parameters
+        if (
+            item.Name in RAPIDS
+            and parameters
+            and parameters.keys() <= MOVE_WORDS
+            and all(
+                value is not None
+                and (
+                    axis not in parameters
+                    or abs(parameters[axis] - value) < MIN_MOVE_LENGTH
+                )
+                for axis, value in zip("XYZ", position)
+            )
+        ):
+            if stats is not None:
+                stats.degenerate += 1
+            continue
+        result.append(item)
+    return result
+
+
+def path_ends(paths):
+    """Return the first and the last XY position the moves in paths reach.
+
+    Both are None when the paths never reach a known XY position.
+    """
+    entry = None
+    x = y = None
+    for commands in paths:
+        for c in commands:
+            if c.Name in MOTIONS:
+                parameters = c.Parameters
+                x = parameters.get("X", x)
+                y = parameters.get("Y", y)
+                if entry is None and x is not None and y is not None:
+                    entry = (x, y)
+    if entry is None:
+        return None, None
+    return entry, (x, y)
+
+
+def travel_length(order, ends, start=None):
+    """Return the XY distance rapided between the items of order.
+
+    ends holds the (entry, exit) point of every item and start the position
+    before the first one, None if it is not known.
+    """
+    total = 0.0
+    here = start
+    for index in order:
+        entry, exit = ends[index]
+        if here is not None and entry is not None:
+            total += math.dist(here, entry)
+        if exit is not None:
+            here = exit
+    return total
+
+
+def respects(order, before):
+    """Return True if every item in order comes after the items it needs."""
+    placed = set()
+    for index in order:
+        if not before[index] <= placed:
+            return False
+        placed.add(index)
+    return True
+
+
+def plan_order(ends, start=None, before=None):
+    """Return an order of the items that keeps the travel between them short.
+
+    A nearest neighbour tour is improved with 2-opt moves.  before[i] is the
+    set of items that must come ahead of item i.  The original order is
+    returned when nothing shorter is found or the constraints cannot be met.
+    """
+    count = len(ends)
+    original = list(range(count))
+    if count < 2:
+        return original
+    if before is None:
+        before = [set() for _ in original]
+
+    def distance(here, index):
+        entry = ends[index][0]
+        if here is None or entry is None:
+            return 0.0
+        return math.dist(here, entry)
+
+    order = []
+    placed = set()
+    remaining = list(original)
+    here = start
+    while remaining:
+        ready = [index for index in remaining if before[index] <= placed]
+        if not ready:
+            return original  # circular dependency
+        index = min(ready, key=lambda i: (distance(here, i), i))
+        order.append(index)
+        placed.add(index)
+        remaining.remove(index)
+        if ends[index][1] is not None:
+            here = ends[index][1]
+
+    best = travel_length(order, ends, start)
+    improved = True
+    while improved:
+        improved = False
+        for first in range(count - 1):
+            for last in range(first + 1, count):
+                candidate = (
+                    order[:first] + order[first : last + 1][::-1] + order[last + 1 :]
+                )
+                length = travel_length(candidate, ends, start)
+                if length < best - 1e-9 and respects(candidate, before):
+                    order, best = candidate, length
+                    improved = True
+
+    if travel_length(original, ends, start) <= best:
+        return original
+    return order
+
+
+def tool_loads(order, tools):
+    """Return how many times a tool is loaded when items run in order."""
+    loads = 0
+    current = object()
+    for index in order:
+        if tools[index] != current:
+            loads += 1
+            current = tools[index]
+    return loads
+
+
+# States the exact tool grouping may visit before it settles for greedy
+MAX_GROUPING_STATES = 20000
+
+
+def group_by_tool(tools, before):
+    """Return an order of the items with as few tool loads as possible.
+
+    tools[i] is the tool item i runs with and before[i] the set of items
+    that must come ahead of it.  Once a tool is loaded every ready item
+    using it runs, so only the choice of the next tool is searched, breadth
+    first by number of loads.  Large jobs fall back to always loading the
+    tool that runs the most items next.  Returns the original order when it
+    is already as good.
+    """
+    count = len(tools)
+    original = list(range(count))
+    if count < 2:
+        return original
+    everything = (1 << count) - 1
+    masks = [sum(1 << i for i in needs) for needs in before]
+
+    def run_tool(placed, order, tool):
+        # add every item of tool whose prerequisites are placed, repeatedly
+        added = True
+        while added:
+            added = False
+            for index in range(count):
+                bit = 1 << index
+                if (
+                    not placed & bit
+                    and tools[index] == tool
+                    and masks[index] & placed == masks[index]
+                ):
+                    placed |= bit
+                    order = order + [index]
+                    added = True
+        return placed, order
+
+    def ready_tools(placed):
+        found = []
+        for index in range(count):
+            if (
+                not placed & (1 << index)
+                and masks[index] & placed == masks[index]
+                and tools[index] not in found
+            ):
+                found.append(tools[index])
+        return found
+
+    best = None
+    level = [(0, [], None)]
+    seen = set()
+    while level and best is None and len(seen) < MAX_GROUPING_STATES:
+        following = []
+        for placed, order, current in level:
+            for tool in ready_tools(placed):
+                if tool == current:
+                    continue
+                state = run_tool(placed, order, tool)
+                if state[0] == everything:
+                    best = state[1]
+                    break
+                key = (state[0], tool)
+                if key not in seen:
+                    seen.add(key)
+                    following.append((state[0], state[1], tool))
+            if best is not None:
+                break
+        level = following
+
+    if best is None:
+        # too many states or circular constraints, go greedy
+        placed, best, current = 0, [], None
+        while placed != everything:
+            choices = [
+                run_tool(placed, best, tool)
+                for tool in ready_tools(placed)
+                if tool != current
+            ]
+            if not choices:
+                return original
+            placed, best = max(choices, key=lambda state: len(state[1]))
+            current = tools[best[-1]]
+
+    if tool_loads(best, tools) >= tool_loads(original, tools):
+        return original
+    return best
+
+
+MOTION_KINDS = {
+    "G0": 0,
+    "G00": 0,
+    "G1": 1,
+    "G01": 1,
+    "G2": 2,
+    "G02": 2,
+    "G3": 3,
+    "G03": 3,
+}
+RESET = -1  # a command that left the position unknown
+OTHER = -2  # any command that is not a move
+DWELLS = ("G4", "G04")
+TOOL_CHANGES = ("M6", "M06")
+
+
+class Machine:
+    """Speed limits the cycle time estimate plans with, in mm and seconds.
+
+    jerk 0 gives plain trapezoidal moves; deviation is how far a corner
+    between feed moves may be rounded, which sets the speed it is taken at.
+    """
+
+    def __init__(
+        self,
+        rapid_xy,
+        rapid_z,
+        accel=500.0,
+        jerk=0.0,
+        deviation=0.05,
+        tool_change=0.0,
+    ):
+        self.rapid_xy = rapid_xy
+        self.rapid_z = rapid_z
+        self.accel = accel
+        self.jerk = jerk
+        self.deviation = deviation
+        self.tool_change = tool_change
+
+
+class MotionState:
+    """Position and feed carried from one estimated command list to the next."""
+
+    def __init__(self):
+        self.position = [None, None, None]
+        self.feed = 0.0
+
+
+def carry_forward(words, resets=None):
+    """Return the value of every column after each row, NaN where unset.
+
+    Every column is carried forward from the last row that set it; rows
+    marked in resets set all of them to unknown.
+    """
+    carried = np.empty(words.shape, order="F")
+    rows = np.arange(len(words))
+    for column in range(words.shape[1]):
+        values = words[:, column]
+        setting = ~np.isnan(values)
+        if resets is not None:
+            setting |= resets
+        source = np.where(setting, rows, 0)
+        np.maximum.accumulate(source, out=source)
+        np.take(values, source, out=carried[:, column])
+    return carried
+
+
+def motion_table(table, state, tool_change=0.0):
+    """Collect the moves of a CommandTable into arrays for the estimate.
+
+    Returns (kinds, starts, ends, centers, feeds, stops, extra) where stops
+    marks moves that start from standstill and extra holds the seconds
+    spent in dwells and tool_change seconds for every tool change.
+    """
+    nan = math.nan
+    kinds = table.lookup(MOTION_KINDS, OTHER, np.int8)
+    comments = table.rows_of([name for name in table.names if name[0] == "("])
+    feeds = carry_forward(np.append(state.feed, table.words("F")[:, 0])[:, None])[:, 0]
+    state.feed = float(feeds[-1])
+    extra = tool_change * np.count_nonzero(table.rows_of(TOOL_CHANGES))
+    for index in np.flatnonzero(table.rows_of(DWELLS)):
+        extra += table.parameters(index).get("P", 0.0)
+
+    xyz = table.words("XYZ")
+    resets = (kinds == OTHER) & ~np.isnan(xyz).all(axis=1)
+    # a move starts from standstill after a rapid or any other command,
+    # comments aside
+    counted = np.flatnonzero(~comments)
+    stoppers = kinds[counted] <= 0
+    stops = np.ones(len(kinds), bool)
+    stops[counted] = np.append(True, stoppers[:-1]) | (kinds[counted] == 0)
+
+    selected = (kinds >= 0) | resets
+    kinds = np.where(resets, RESET, kinds)[selected]
+    centers = np.nan_to_num(table.words("IJ"))
+    centers[table.rows_of(STRAIGHT_FEEDS)] = 0.0
+    state_position = [nan if value is None else value for value in state.position]
+    words = np.vstack((state_position, np.where(resets[:, None], nan, xyz)[selected]))
+    kinds = np.append(np.int8(RESET), kinds)
+    feeds = np.append(feeds[0], feeds[1:][selected])
+    stops = np.append(True, stops[selected])
+    centers = np.vstack(((0.0, 0.0), np.where(resets[:, None], 0.0, centers)[selected]))
+
+    ends = carry_forward(words, kinds == RESET)
+    starts = np.concatenate((ends[:1], ends[:-1]))
+    starts = np.where(np.isnan(starts), ends, starts)
+
+    state.position = [None if math.isnan(v) else float(v) for v in ends[-1]]
+
+    known = ~np.isnan(ends).any(axis=1)
+    # a move after an unknown position or a reset starts from standstill
+    stops[1:] |= ~known[:-1] | (kinds[:-1] == RESET)
+    moves = known & (kinds != RESET)
+    return (
+        kinds[moves],
+        starts[moves],
+        ends[moves],
+        starts[moves, :2] + centers[moves],
+        feeds[moves],
+        stops[moves],
+        extra,
+    )
+
+
+def move_times(lengths, top, entry, exit, machine):
+    """Return the seconds of every move with the given speeds, vectorized.
+
+    Each move accelerates from entry towards top and decelerates to exit;
+    with jerk limiting every speed change takes accel / jerk longer.
+    """
+    accel = machine.accel
+    twice = 2.0 * accel * lengths
+    entry = np.minimum(entry, np.sqrt(exit * exit + twice))
+    exit = np.minimum(exit, np.sqrt(entry * entry + twice))
+    peak = np.minimum(top, np.sqrt((twice + entry * entry + exit * exit) / 2.0))
+    peak = np.maximum(peak, np.maximum(entry, exit))
+    ramps = (peak * peak - entry * entry + peak * peak - exit * exit) / (2.0 * accel)
+    cruise = np.maximum(lengths - ramps, 0.0)
+    times = (2.0 * peak - entry - exit) / accel
+    times += np.divide(cruise, peak, out=np.zeros_like(cruise), where=peak > 0)
+    if machine.jerk > 0:
+        changes = (peak > entry).astype(float) + (peak > exit)
+        times += changes * (accel / machine.jerk)
+    return np.where(lengths > 0, times, 0.0)
+
+
+def estimate_time(table, machine, state):
+    """Return the estimated seconds the commands of table take on machine.
+
+    state carries the position and feed from the previous call so moves
+    between operations are counted too.
+    """
+    moves = motion_table(table, state, machine.tool_change)
+    kinds, starts, ends, centers, feeds, stops, extra = moves
+    if not len(kinds):
+        return extra
+
+    delta = ends - starts
+    planar = np.hypot(delta[:, 0], delta[:, 1])
+    lengths = np.sqrt(planar * planar + delta[:, 2] * delta[:, 2])
+    top = feeds.copy()
+    # unit directions at the start and the end of every move
+    leaving = np.divide(
+        delta, lengths[:, None], out=np.zeros_like(delta), where=lengths[:, None] > 0
+    )
+    arriving = leaving.copy()
+
+    arcs = kinds >= 2
+    if arcs.any():
+        center = centers[arcs]
+        begin = starts[arcs, :2] - center
+        finish = ends[arcs, :2] - center
+        radius = np.hypot(begin[:, 0], begin[:, 1])
+        sweep = np.arctan2(finish[:, 1], finish[:, 0]) - np.arctan2(
+            begin[:, 1], begin[:, 0]
+        )
+        clockwise = kinds[arcs] == 2
+        sweep = np.where(
+            clockwise, -np.mod(-sweep, 2 * np.pi), np.mod(sweep, 2 * np.pi)
+        )
+        sweep = np.where(
+            sweep == 0.0, np.where(clockwise, -2 * np.pi, 2 * np.pi), sweep
+        )
+        arc_lengths = np.hypot(radius * sweep, delta[arcs, 2])
+        lengths[arcs] = arc_lengths
+        # centripetal acceleration limits the speed on small arcs
+        top[arcs] = np.minimum(top[arcs], np.sqrt(machine.accel * radius))
+        turn = np.where(clockwise, -1.0, 1.0)[:, None]
+        scale = np.divide(1.0, radius, out=np.zeros_like(radius), where=radius > 0)[
+            :, None
+        ]
+        leaving[arcs, :2] = turn * np.stack((-begin[:, 1], begin[:, 0]), axis=1) * scale
+        arriving[arcs, :2] = (
+            turn * np.stack((-finish[:, 1], finish[:, 0]), axis=1) * scale
+        )
+        leaving[arcs, 2] = arriving[arcs, 2] = 0.0
+
+    rapids = kinds == 0
+    if rapids.any():
+        # rapids run at the speed the slower of the XY and Z limits allows
+        seconds = np.maximum(
+            planar[rapids] / machine.rapid_xy,
+            np.abs(delta[rapids, 2]) / machine.rapid_z,
+        )
+        top[rapids] = np.divide(
+            lengths[rapids], seconds, out=np.zeros_like(seconds), where=seconds > 0
+        )
+    top = np.where(top > 0, top, machine.rapid_xy)
+
+    # corner speeds between blended feed moves, as in grbl's junction model
+    entry = np.zeros(len(kinds))
+    if len(kinds) > 1:
+        cosine = -(arriving[:-1] * leaving[1:]).sum(axis=1)
+        sine = np.sqrt(np.clip(0.5 * (1.0 - cosine), 0.0, 1.0))
+        corner = np.sqrt(
+            np.divide(
+                machine.accel * machine.deviation * sine,
+                1.0 - sine,
+                out=np.full(len(sine), np.inf),
+                where=sine < 1.0,
+            )
+        )
+        corner = np.minimum(corner, np.minimum(top[:-1], top[1:]))
+        entry[1:] = np.where(stops[1:], 0.0, corner)
+    exit = np.append(entry[1:], 0.0)
+    return float(move_times(lengths, top, entry, exit, machine).sum()) + extra
+
+
+# Canned drilling cycles move to their X/Y/Z words like a feed
+DRILL_CYCLES = frozenset(("G73", "G81", "G82", "G83", "G85", "G86", "G89"))
+ENVELOPE_TOLERANCE = 1e-6  # mm
+ENVELOPE_LIMITS = ("X-", "X+", "Y-", "Y+", "Z-", "Z+")
+
+
+def arc_bounds(starts, ends, centers, clockwise):
+    """Return the XY corners (low, high) of the boxes around arcs.
+
+    The box holds the end points and every quadrant point, where the arc is
+    furthest along an axis, that the sweep passes.  An arc that ends where
+    it starts is a full circle.
+    """
+    radius = np.hypot(*(starts - centers).T)
+    start_angle = np.arctan2(*(starts - centers).T[::-1])
+    end_angle = np.arctan2(*(ends - centers).T[::-1])
+    turn = 2 * math.pi
+    sweep = np.where(clockwise, start_angle - end_angle, end_angle - start_angle)
+    sweep %= turn
+    sweep[sweep < 1e-9] = turn
+    low = np.minimum(starts, ends)
+    high = np.maximum(starts, ends)
+    for quadrant, direction in enumerate(((1, 0), (0, 1), (-1, 0), (0, -1))):
+        angle = quadrant * math.pi / 2
+        offset = np.where(clockwise, start_angle - angle, angle - start_angle) % turn
+        passed = (offset <= sweep)[:, None]
+        point = centers + radius[:, None] * direction
+        low = np.where(passed, np.minimum(low, point), low)
+        high = np.where(passed, np.maximum(high, point), high)
+    return low, high
+
+
+def envelope_violations(table, lower, upper, state):
+    """Return the rows of table that move outside a box and how they do.
+
+    lower and upper are the (x, y, z) corners of the box.  Returns the row
+    indices and, for each of them, a flag per ENVELOPE_LIMITS entry telling
+    which limits it crosses.  Arcs in the XY plane count with their full
+    extent, not just their end points.  Axes whose position is still
+    unknown are not checked.  state carries the position from one table to
+    the next.
+    """
+    nan = math.nan
+    kinds = table.lookup(MOTION_KINDS, OTHER, np.int8)
+    kinds[table.rows_of(DRILL_CYCLES)] = 1
+    xyz = table.words("XYZ")
+    resets = (kinds == OTHER) & ~np.isnan(xyz).all(axis=1)
+    if resets.any():
+        xyz = np.where(resets[:, None], nan, xyz)
+    if not all(PLANES.get(name, True) for name in table.names):
+        planes = table.lookup(PLANES, nan)
+        xy_plane = carry_forward(np.append(1.0, planes)[:, None])[1:, 0] > 0
+        # only the end points of arcs in other planes
+        kinds[(kinds > 1) & ~xy_plane] = 1
+
+    selected = np.flatnonzero((kinds >= 0) | resets)
+    index = np.append(-1, selected)
+    kinds = np.append(np.int8(RESET), np.where(resets, RESET, kinds)[selected])
+    state_position = [nan if value is None else value for value in state.position]
+    ends = carry_forward(np.vstack((state_position, xyz[selected])), kinds == RESET)
+    state.position = [None if math.isnan(v) else float(v) for v in ends[-1]]
+
+    low = high = ends
+    arcs = np.flatnonzero(kinds >= 2)
+    arcs = arcs[~np.isnan(ends[arcs - 1, :2]).any(axis=1)]
+    if len(arcs):
+        starts = ends[arcs - 1, :2]
+        centers = starts + np.nan_to_num(table.words("IJ")[index[arcs]])
+        low = ends.copy()
+        high = ends.copy()
+        low[arcs, :2], high[arcs, :2] = arc_bounds(
+            starts, ends[arcs, :2], centers, kinds[arcs] == 2
+        )
+
+    crossed = np.empty((len(low) - 1, 6), bool)
+    crossed[:, 0::2] = low[1:] < np.asarray(lower, float) - ENVELOPE_TOLERANCE
+    crossed[:, 1::2] = high[1:] > np.asarray(upper, float) + ENVELOPE_TOLERANCE
+    outside = np.flatnonzero(crossed.any(axis=1))
+    return index[outside + 1], crossed[outside]
+
+
+def crossed_limits(flags):
+    """Return the limits flagged by envelope_violations() as text, e.g. "X- Z+"."""
+    return " ".join(limit for limit, flag in zip(ENVELOPE_LIMITS, flags) if flag)
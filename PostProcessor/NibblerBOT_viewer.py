@@ -0,0 +1,239 @@
+"""Read-only viewer for G-code programs too large for the editor.
+
+The program is memory mapped and never loaded as a whole.  LineIndex finds
+the line starts, operations and tool changes a chunk at a time while the
+viewer is already showing the first lines, and the list view only asks for
+the lines on screen, so opening costs the same for any size of program.
+"""
+
+import mmap
+import re
+
+import numpy as np
+from PySide import QtCore, QtGui, QtWidgets
+
+# Bytes indexed per step; a step takes a few milliseconds
+SCAN_CHUNK = 1 << 20
+
+# Operation and tool change lines as the post writes them, with optional
+# block delete and line number in front
+MARKER = re.compile(
+    rb"[/ ]*(?:N\d+)?[/ ]*(?:\(begin operation: ([^)\r\n]*)\)|M0?6 +T(\d+))"
+)
+# Searching for these is far faster than running MARKER over every line
+MARKER_NEEDLES = (b"(begin operation: ", b"M6 ", b"M06 ")
+
+
+class LineIndex:
+    """Line offsets and markers of a program, built incrementally.
+
+    data is anything that supports the buffer protocol, normally a read-only
+    mmap of the written file.  Call scan() until it returns True; lines and
+    markers cover what has been scanned so far.
+    """
+
+    def __init__(self, data, file=None):
+        self.data = data
+        self.file = file
+        self.size = len(data)
+        self.scanned = 0
+        self.starts = np.zeros(1, np.int64)  # offset of every known line
+        self.markers = []  # (line, "operation" or "tool", text)
+
+    @classmethod
+    def open(cls, filename):
+        file = open(filename, "rb")
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file cannot be mapped
+            data = b""
+        return cls(data, file)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.file is not None:
+            self.file.close()
+
+    @property
+    def done(self):
+        return self.scanned >= self.size
+
+    @property
+    def lines(self):
+        """Number of lines found so far, including an unterminated last one."""
+        if self.done and self.size and self.starts[-1] < self.size:
+            return len(self.starts)
+        return len(self.starts) - 1 if self.size else 0
+
+    def estimated_lines(self):
+        if self.done or not self.scanned:
+            return self.lines
+        return int(self.lines * self.size / self.scanned)
+
+    def scan(self, limit=SCAN_CHUNK):
+        """Index up to limit more bytes; return True once the end is reached."""
+        if self.done:
+            return True
+        start = self.scanned
+        end = min(start + limit, self.size)
+        if end < self.size:
+            # stop after a whole line so no marker is cut in two
+            newline = self.data.rfind(b"\n", start, end)
+            if newline >= start:
+                end = newline + 1
+        chunk = np.frombuffer(self.data, np.uint8, end - start, start)
+        newlines = np.flatnonzero(chunk == 10)
+        first_line = len(self.starts) - 1
+        line_starts = np.concatenate(([start], newlines + (start + 1)))
+        found = {}
+        for needle in MARKER_NEEDLES:
+            hit = self.data.find(needle, start, end)
+            while hit != -1:
+                line = int(newlines.searchsorted(hit - start))
+                match = MARKER.match(self.data, int(line_starts[line]), end)
+                if match is not None and match.group(1) is not None:
+                    found[line] = ("operation", match.group(1).decode())
+                elif match is not None:
+                    found[line] = ("tool", "T" + match.group(2).decode())
+                if line + 1 == len(line_starts):
+                    break  # the unterminated last line of the program
+                hit = self.data.find(needle, int(line_starts[line + 1]), end)
+        for line in sorted(found):
+            self.markers.append((first_line + line,) + found[line])
+        self.starts = np.concatenate((self.starts, line_starts[1:]))
+        self.scanned = end
+        return self.done
+
+    def scan_to(self, line):
+        """Index until line is known or the program ends."""
+        while self.lines <= line and not self.scan():
+            pass
+
+    def line(self, number):
+        """Return line number (0-based) as text without its line ending."""
+        start = int(self.starts[number])
+        if number + 1 < len(self.starts):
+            end = int(self.starts[number + 1]) - 1
+        else:
+            end = self.size
+        return self.data[start:end].decode(errors="replace").rstrip("\r")
+
+
+class LineModel(QtCore.QAbstractListModel):
+    """Rows are program lines, read from the index only when painted."""
+
+    def __init__(self, program, parent=None):
+        super().__init__(parent)
+        self.program = program
+        self.rows = 0
+        self.marked = {}
+        self.marker_brush = QtGui.QBrush(QtGui.QColor(255, 244, 200))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        row = index.row()
+        if role == QtCore.Qt.DisplayRole:
+            return "%8d  %s" % (row + 1, self.program.line(row))
+        if role == QtCore.Qt.BackgroundRole and row in self.marked:
+            return self.marker_brush
+        return None
+
+    def grow(self):
+        """Show the lines and markers the index has found since last time."""
+        rows = self.program.lines
+        if rows > self.rows:
+            self.beginInsertRows(QtCore.QModelIndex(), self.rows, rows - 1)
+            self.rows = rows
+            self.endInsertRows()
+        for line, kind, text in self.program.markers[len(self.marked) :]:
+            self.marked[line] = (kind, text)
+
+
+class GCodeViewer(QtWidgets.QDialog):
+    """Read-only program view with an operation and tool change outline."""
+
+    def __init__(self, program, title="G-code", parent=None):
+        super().__init__(parent)
+        self.program = program
+        self.setWindowTitle(title)
+        self.setLayout(QtWidgets.QVBoxLayout())
+
+        top = QtWidgets.QHBoxLayout()
+        top.addWidget(QtWidgets.QLabel("Go to line:"))
+        self.goto = QtWidgets.QSpinBox()
+        self.goto.setRange(1, 1 << 30)
+        self.goto.setKeyboardTracking(False)
+        self.goto.valueChanged.connect(lambda value: self.go_to_line(value - 1))
+        top.addWidget(self.goto)
+        top.addStretch()
+        self.status = QtWidgets.QLabel()
+        top.addWidget(self.status)
+        self.layout().addLayout(top)
+
+        splitter = QtWidgets.QSplitter()
+        self.outline = QtWidgets.QListWidget()
+        self.outline.itemActivated.connect(self.handle_marker)
+        self.outline.itemClicked.connect(self.handle_marker)
+        splitter.addWidget(self.outline)
+
+        self.model = LineModel(program, self)
+        self.view = QtWidgets.QListView()
+        self.view.setUniformItemSizes(True)  # lets the view skip offscreen rows
+        self.view.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.view.setModel(self.model)
+        splitter.addWidget(self.view)
+        splitter.setSizes([200, 600])
+        self.layout().addWidget(splitter)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+        self.layout().addWidget(buttons)
+        self.resize(900, 600)
+
+        # show the first screen at once, index the rest between events
+        program.scan(64 << 10)
+        self.refresh()
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.scan_more)
+        self.timer.start(0)
+
+    def scan_more(self):
+        if self.program.scan():
+            self.timer.stop()
+        self.refresh()
+
+    def refresh(self):
+        seen = len(self.model.marked)
+        self.model.grow()
+        for line, kind, text in self.program.markers[seen:]:
+            label = text if kind == "operation" else "    tool change " + text
+            item = QtWidgets.QListWidgetItem(label)
+            item.setData(QtCore.Qt.UserRole, line)
+            self.outline.addItem(item)
+        if self.program.done:
+            self.status.setText("%d lines" % self.program.lines)
+        else:
+            self.status.setText(
+                "about %d lines, indexing %d%%"
+                % (
+                    self.program.estimated_lines(),
+                    100 * self.program.scanned // self.program.size,
+                )
+            )
+
+    def handle_marker(self, item):
+        self.go_to_line(item.data(QtCore.Qt.UserRole))
+
+    def go_to_line(self, line):
+        if line >= self.model.rows:
+            self.program.scan_to(line)
+            self.refresh()
+        line = min(line, self.model.rows - 1)
+        if line < 0:
+            return
+        row = self.model.index(line)
+        self.view.scrollTo(row, QtWidgets.QAbstractItemView.PositionAtTop)
+        self.view.setCurrentIndex(row)